@@ -1,28 +1,42 @@
 import os
 import cv2
 import numpy as np
-import pandas as pd
-import base64
-import io
-from PIL import Image
+import functools
+import hashlib
+import importlib
+import json
+import re
+import sqlite3
+import struct
+import tempfile
 from typing import Optional, List, Dict, Any
 import asyncio
 import logging
+import threading
+import time
+import uuid
+import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 
 # FastAPI imports
 from fastapi import FastAPI, HTTPException, UploadFile, File, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 
-# ML and Spotify imports
-import tensorflow as tf
-from tensorflow.keras.models import load_model
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials, SpotifyOAuth
+# TensorFlow, spotipy and PIL are imported where they are used, so importing this
+# module (and uvicorn --reload) stays fast and the model loads after the server is up
 import urllib.parse
 from dotenv import load_dotenv
 
+import image_decode
+import metrics
+from inference_pool import ProcessInferencePool
+from spotify_api import AsyncSpotifyClient, SpotifyAPIError
+from video_timeline import TIMELINE_FORMATS, parquet_available, process_video_file
+
 # Load environment variables
 load_dotenv()
 
@@ -52,12 +66,145 @@ app.add_middleware(
 
 # Mood model and face cascade
 mood_model = None
+mood_backend = None
 face_cascade = None
+# CascadeClassifier.detectMultiScale is not thread-safe, so every thread detects with its own copy
+face_cascade_local = threading.local()
+FACE_CASCADE_PATH = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
 spotify_client = None
 spotify_oauth = None
 
-# Store created playlist URLs to avoid duplicates
-created_playlists = {}  # {mood: playlist_url}
+# Refresh the user's Spotify token this many seconds before it expires
+SPOTIFY_TOKEN_REFRESH_MARGIN = float(os.getenv("KAGUYA_SPOTIFY_TOKEN_REFRESH_MARGIN", "300"))
+
+# Background task that keeps the per-mood track pools fresh
+track_pool_task = None
+
+# The model loads in the background after startup; liveness does not wait for it
+model_task = None
+spotify_task = None
+process_pool = None
+model_status = {"phase": "not_started", "started_at": None, "loaded_at": None, "ready_at": None}
+# Importing TensorFlow holds the GIL for seconds; background loading waits this long
+# so uvicorn can bind its socket and answer /health first
+STARTUP_GRACE_SECONDS = float(os.getenv("KAGUYA_STARTUP_GRACE_SECONDS", "0.5"))
+
+# Executor sizing (inference is CPU-bound; the I/O pool runs spotipy OAuth and file writes,
+# all other Spotify traffic goes through the async client)
+INFERENCE_WORKERS = int(os.getenv("KAGUYA_INFERENCE_WORKERS", os.cpu_count() or 1))
+INFERENCE_QUEUE_DEPTH = int(os.getenv("KAGUYA_INFERENCE_QUEUE_DEPTH", "32"))
+SPOTIFY_IO_WORKERS = int(os.getenv("KAGUYA_SPOTIFY_IO_WORKERS", "8"))
+SPOTIFY_IO_QUEUE_DEPTH = int(os.getenv("KAGUYA_SPOTIFY_IO_QUEUE_DEPTH", "64"))
+SPOTIFY_MAX_CONNECTIONS = int(os.getenv("KAGUYA_SPOTIFY_MAX_CONNECTIONS", "20"))
+
+# Optional multi-process inference: N worker processes each load the model and cascade and
+# receive frames through a shared-memory ring (0 = run inference on threads in this process).
+# A slot holds one encoded image, or the base64 text of a JSON request (about 4/3 larger)
+INFERENCE_PROCESSES = int(os.getenv("KAGUYA_INFERENCE_PROCESSES", "0"))
+PROCESS_SLOTS = int(os.getenv("KAGUYA_PROCESS_SLOTS", str(max(1, INFERENCE_PROCESSES) * 4)))
+PROCESS_SLOT_BYTES = int(os.getenv("KAGUYA_PROCESS_SLOT_BYTES", str(4 * 1024 * 1024)))
+PROCESS_THREADS = int(os.getenv("KAGUYA_PROCESS_THREADS", "1"))
+PROCESS_TIMEOUT = float(os.getenv("KAGUYA_PROCESS_TIMEOUT", "30"))
+
+# Inference backend: "tf_function" (default), "tflite" or "keras" (model.predict)
+INFERENCE_BACKEND = os.getenv("KAGUYA_INFERENCE_BACKEND", "tf_function").lower()
+
+# Upper bound on faces classified per image in multi-face mode
+MAX_FACES = int(os.getenv("KAGUYA_MAX_FACES", "32"))
+
+# WebSocket frame-rate hints: suggest the rate the server can keep up with per connection
+WS_ADAPTIVE_FPS = os.getenv("KAGUYA_WS_ADAPTIVE_FPS", "true").lower() in ("1", "true", "yes")
+WS_MIN_FPS = float(os.getenv("KAGUYA_WS_MIN_FPS", "1"))
+WS_MAX_FPS = float(os.getenv("KAGUYA_WS_MAX_FPS", "15"))
+
+# WebSocket mood smoothing: an exponentially weighted average of each connection's probability
+# vectors (WS_SMOOTHING_ALPHA = weight of the newest frame). The reported mood only switches once
+# another mood leads the average by WS_SMOOTHING_MARGIN for WS_SMOOTHING_MIN_FRAMES frames in a
+# row, and recommendations are only fetched when it does
+WS_SMOOTHING = os.getenv("KAGUYA_WS_SMOOTHING", "true").lower() in ("1", "true", "yes")
+WS_SMOOTHING_ALPHA = float(os.getenv("KAGUYA_WS_SMOOTHING_ALPHA", "0.3"))
+WS_SMOOTHING_MARGIN = float(os.getenv("KAGUYA_WS_SMOOTHING_MARGIN", "0.05"))
+WS_SMOOTHING_MIN_FRAMES = int(os.getenv("KAGUYA_WS_SMOOTHING_MIN_FRAMES", "3"))
+# Frames without a face after which the smoothed mood is dropped
+WS_SMOOTHING_MAX_MISSED_FRAMES = int(os.getenv("KAGUYA_WS_SMOOTHING_MAX_MISSED_FRAMES", "15"))
+
+# Face detection runs on a grayscale copy downscaled to at most this many pixels on its
+# longest side (0 = full resolution); boxes are mapped back and cropped from the original.
+DETECTION_MAX_DIM = int(os.getenv("KAGUYA_DETECTION_MAX_DIM", "640"))
+# Image limits, checked before decoding (the pixel count comes from the image header)
+MAX_IMAGE_BYTES = int(os.getenv("KAGUYA_MAX_IMAGE_BYTES", str(20 * 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.getenv("KAGUYA_MAX_IMAGE_PIXELS", "40000000"))
+# JPEGs at least twice this size on their longest side are decoded at 1/2, 1/4 or 1/8 scale,
+# never below it (0 = always full size); boxes in responses stay in original-image pixels
+DECODE_MAX_DIM = int(os.getenv("KAGUYA_DECODE_MAX_DIM", "1280"))
+# Face size limits in original-image pixels, also for JPEGs decoded at reduced size (0 = no limit)
+MIN_FACE_SIZE = int(os.getenv("KAGUYA_MIN_FACE_SIZE", "0"))
+MAX_FACE_SIZE = int(os.getenv("KAGUYA_MAX_FACE_SIZE", "0"))
+
+# Streaming face tracking: full cascade every N frames, padded-window search in between
+TRACK_DETECT_INTERVAL = int(os.getenv("KAGUYA_TRACK_DETECT_INTERVAL", "5"))
+TRACK_SEARCH_PADDING = float(os.getenv("KAGUYA_TRACK_SEARCH_PADDING", "0.5"))
+TRACK_REDETECT_ON_LOSS = os.getenv("KAGUYA_TRACK_REDETECT_ON_LOSS", "true").lower() in ("1", "true", "yes")
+
+# Near-duplicate caches: a frame whose perceptual hash is within FRAME_HASH_MAX_DISTANCE bits
+# of a recent frame reuses its mood without the cascade or the model; a face crop close to a
+# recent crop skips the model. Entries live MOOD_CACHE_TTL seconds (0 entries = off).
+# Both are only used by WebSocket streams, each seeing just its own entries; one-shot HTTP
+# requests always run the model. An expression only moves a few pixels of a 48x48 crop, so
+# the face hash is large (FACE_HASH_SIZE^2 bits) and only near-identical crops match.
+MOOD_CACHE_SIZE = int(os.getenv("KAGUYA_MOOD_CACHE_SIZE", "256"))
+MOOD_CACHE_TTL = float(os.getenv("KAGUYA_MOOD_CACHE_TTL", "10"))
+FRAME_HASH_SIZE = int(os.getenv("KAGUYA_FRAME_HASH_SIZE", "16"))  # hash is FRAME_HASH_SIZE^2 bits
+FRAME_HASH_MAX_DISTANCE = int(os.getenv("KAGUYA_FRAME_HASH_MAX_DISTANCE", "8"))
+FACE_HASH_SIZE = int(os.getenv("KAGUYA_FACE_HASH_SIZE", "24"))
+FACE_HASH_MAX_DISTANCE = int(os.getenv("KAGUYA_FACE_HASH_MAX_DISTANCE", "4"))
+
+# Spotify search cache: fresh for TTL seconds, then served stale while refreshing for STALE_TTL more
+SPOTIFY_CACHE_TTL = float(os.getenv("KAGUYA_SPOTIFY_CACHE_TTL", "900"))
+SPOTIFY_CACHE_STALE_TTL = float(os.getenv("KAGUYA_SPOTIFY_CACHE_STALE_TTL", "86400"))
+
+# Precomputed per-mood track pools, sampled on the request path instead of searching Spotify
+TRACK_POOLS_ENABLED = os.getenv("KAGUYA_TRACK_POOLS", "true").lower() in ("1", "true", "yes")
+TRACK_POOL_SIZE = int(os.getenv("KAGUYA_TRACK_POOL_SIZE", "300"))
+TRACK_POOL_REFRESH_INTERVAL = float(os.getenv("KAGUYA_TRACK_POOL_REFRESH_INTERVAL", "21600"))
+TRACK_POOL_PATH = os.getenv("KAGUYA_TRACK_POOL_PATH", ".kaguya_track_pools.json")
+
+# Micro-batching knobs (a max batch size of 1 disables coalescing)
+BATCH_MAX_SIZE = int(os.getenv("KAGUYA_BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.getenv("KAGUYA_BATCH_MAX_WAIT_MS", "5"))
+
+# Batch sizes run through the model before /ready reports ready (default: powers of two up to BATCH_MAX_SIZE)
+DEFAULT_WARMUP_BATCH_SIZES = [2 ** power for power in range(BATCH_MAX_SIZE.bit_length()) if 2 ** power < BATCH_MAX_SIZE] + [BATCH_MAX_SIZE]
+WARMUP_BATCH_SIZES = sorted({
+    int(size) for size in os.getenv("KAGUYA_WARMUP_BATCH_SIZES", ",".join(map(str, DEFAULT_WARMUP_BATCH_SIZES))).split(",")
+    if size.strip()
+})
+
+# Created playlists are recorded in SQLite so every worker and restart reuses them.
+# Reuse key: "mood" (one playlist per user and mood) or "tracks" (per exact track set)
+PLAYLIST_REGISTRY_PATH = os.getenv("KAGUYA_PLAYLIST_REGISTRY_PATH", ".kaguya_playlists.db")
+PLAYLIST_REUSE = os.getenv("KAGUYA_PLAYLIST_REUSE", "mood").lower()
+PLAYLIST_REGISTRY_CACHE_TTL = float(os.getenv("KAGUYA_PLAYLIST_REGISTRY_CACHE_TTL", "60"))
+
+# Create playlists in a background job by default in /mood-and-playlist (overridable per request)
+ASYNC_PLAYLISTS = os.getenv("KAGUYA_ASYNC_PLAYLISTS", "false").lower() in ("1", "true", "yes")
+
+# Playlist cleanup: concurrent page fetches / unfollows, and how long finished jobs stay queryable
+CLEANUP_CONCURRENCY = int(os.getenv("KAGUYA_CLEANUP_CONCURRENCY", "8"))
+JOB_RETENTION_SECONDS = float(os.getenv("KAGUYA_JOB_RETENTION_SECONDS", "3600"))
+
+# Batch scoring (/detect-mood/batch): images scored concurrently per request, limits per request
+# and per image, and the only directory tree local jobs (directory scoring, video timelines) may
+# read from (unset = local file input off)
+BATCH_CONCURRENCY = int(os.getenv("KAGUYA_BATCH_CONCURRENCY", str(max(4, INFERENCE_WORKERS * 2))))
+BATCH_MAX_IMAGES = int(os.getenv("KAGUYA_BATCH_MAX_IMAGES", "10000"))
+BATCH_MAX_IMAGE_BYTES = int(os.getenv("KAGUYA_BATCH_MAX_IMAGE_BYTES", str(MAX_IMAGE_BYTES)))
+BATCH_ROOT = os.getenv("KAGUYA_BATCH_ROOT", "")
+
+# Offline video timelines (/video-timeline): analysis threads per video and where timelines are written
+# (each file is deleted with its job, JOB_RETENTION_SECONDS after it finishes or is cancelled)
+VIDEO_WORKERS = int(os.getenv("KAGUYA_VIDEO_WORKERS", str(max(1, INFERENCE_WORKERS // 2))))
+VIDEO_OUTPUT_DIR = os.getenv("KAGUYA_VIDEO_OUTPUT_DIR", os.path.join(tempfile.gettempdir(), "kaguya-timelines"))
 
 # Mood mapping
 MOOD_LABELS = {
@@ -70,6 +217,260 @@ MOOD_LABELS = {
     6: "Neutral"
 }
 
+# ==============================
+# Executors
+# ==============================
+
+class BoundedExecutor:
+    """Thread pool that keeps blocking work off the event loop and sheds load when full"""
+
+    def __init__(self, name: str, max_workers: int, queue_depth: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.capacity = max_workers + queue_depth
+        self.pending = 0
+        self.rejected = 0
+        self._waiters = deque()  # futures of run_when_free callers waiting for room
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix=f"kaguya-{name}"
+        )
+
+    @property
+    def full(self) -> bool:
+        return self.pending >= self.capacity
+
+    async def run(self, func, *args):
+        """Run func(*args) in the pool, raising 503 if the queue is already full"""
+        if self.full:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail=f"Server busy - {self.name} queue is full, retry shortly",
+                headers={"Retry-After": "1"}
+            )
+        return await self._submit(func, *args)
+
+    async def run_when_free(self, func, *args):
+        """Like run, but waits for room in the queue instead of raising 503 (for background jobs)"""
+        while self.full:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+        return await self._submit(func, *args)
+
+    async def _submit(self, func, *args):
+        # pending is only touched from the event loop thread, so no lock is needed
+        loop = asyncio.get_running_loop()
+        self.pending += 1
+        try:
+            future = self.executor.submit(func, *args)
+        except BaseException:
+            self._release()
+            raise
+        # Released when the job finishes, not when the caller stops waiting: a cancelled
+        # caller (a closed WebSocket) leaves its job running in the pool until it is done
+        future.add_done_callback(lambda _: self._release_threadsafe(loop))
+        return await asyncio.wrap_future(future)
+
+    def _release_threadsafe(self, loop: asyncio.AbstractEventLoop):
+        try:
+            loop.call_soon_threadsafe(self._release)
+        except RuntimeError:
+            # The loop is already closed (shutdown)
+            pass
+
+    def _release(self):
+        self.pending -= 1
+        # Hand the freed place to the longest-waiting background caller
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.max_workers,
+            "capacity": self.capacity,
+            "pending": self.pending,
+            "waiting": len(self._waiters),
+            "rejected": self.rejected
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+inference_executor = BoundedExecutor("inference", INFERENCE_WORKERS, INFERENCE_QUEUE_DEPTH)
+spotify_executor = BoundedExecutor("spotify", SPOTIFY_IO_WORKERS, SPOTIFY_IO_QUEUE_DEPTH)
+
+# ==============================
+# Metrics
+# ==============================
+
+metrics_registry = metrics.MetricsRegistry()
+
+STAGE_SECONDS = metrics_registry.histogram(
+    "kaguya_stage_duration_seconds",
+    "Time spent in each pipeline stage",
+    ("stage",)
+)
+REQUEST_SECONDS = metrics_registry.histogram(
+    "kaguya_http_request_duration_seconds",
+    "HTTP request latency by route",
+    ("method", "route", "status")
+)
+NO_FACE_TOTAL = metrics_registry.counter(
+    "kaguya_no_face_total",
+    "Images or frames in which no face was found",
+    ("mode",)
+)
+DROPPED_FRAMES_TOTAL = metrics_registry.counter(
+    "kaguya_ws_dropped_frames_total",
+    "WebSocket frames replaced by a newer frame before being processed"
+)
+MOOD_CHANGES_TOTAL = metrics_registry.counter(
+    "kaguya_ws_mood_changes_total",
+    "Smoothed mood changes reported to WebSocket clients"
+)
+
+# Values tracked elsewhere are read at scrape time
+metrics_registry.gauge(
+    "kaguya_ws_active_connections",
+    "Open video mood WebSocket connections",
+    fn=lambda: len(manager.active_connections)
+)
+metrics_registry.gauge(
+    "kaguya_executor_pending",
+    "Tasks running or queued per executor",
+    ("executor",),
+    fn=lambda: {executor.name: executor.pending for executor in (inference_executor, spotify_executor)}
+)
+metrics_registry.counter(
+    "kaguya_executor_rejected_total",
+    "Tasks rejected with 503 because the executor queue was full",
+    ("executor",),
+    fn=lambda: {executor.name: executor.rejected for executor in (inference_executor, spotify_executor)}
+)
+metrics_registry.gauge(
+    "kaguya_batch_queue_depth",
+    "Faces waiting for the micro-batcher",
+    fn=lambda: mood_batcher.stats()["queued"]
+)
+metrics_registry.counter(
+    "kaguya_cache_hits_total",
+    "Cache lookups served without a remote call",
+    ("cache",),
+    fn=lambda: {
+        "spotify_search": spotify_search_cache.hits + spotify_search_cache.stale_hits,
+        "playlist_registry": playlist_registry.hits,
+        **{f"{cache.name}_mood": cache.hits for cache in mood_caches}
+    }
+)
+metrics_registry.counter(
+    "kaguya_cache_misses_total",
+    "Cache lookups that needed a remote call or database read",
+    ("cache",),
+    fn=lambda: {
+        "spotify_search": spotify_search_cache.misses,
+        "playlist_registry": playlist_registry.misses,
+        **{f"{cache.name}_mood": cache.misses for cache in mood_caches}
+    }
+)
+metrics_registry.counter(
+    "kaguya_track_pool_samples_total",
+    "Recommendations served from precomputed track pools",
+    fn=lambda: track_pools.samples
+)
+
+# ==============================
+# Background Jobs
+# ==============================
+
+class BackgroundJob:
+    """Long-running task whose progress can be polled by id"""
+
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = "pending"
+        self.progress: Dict[str, Any] = {}
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        # Files the job wrote; deleted along with the job once it is pruned
+        self.files: List[str] = []
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at
+        }
+
+class JobRegistry:
+    """In-memory job table; finished jobs (and their files) are dropped after the retention period"""
+
+    def __init__(self, retention: float):
+        self.retention = retention
+        self.jobs: Dict[str, BackgroundJob] = {}
+
+    def start(self, kind: str, run) -> BackgroundJob:
+        """Schedule run(job) on the event loop and return the job immediately"""
+        self._prune()
+        job = BackgroundJob(kind)
+        self.jobs[job.id] = job
+        job.task = asyncio.create_task(self._run(job, run))
+        return job
+
+    async def _run(self, job: BackgroundJob, run):
+        job.status = "running"
+        try:
+            job.result = await run(job)
+            job.status = "completed"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            raise
+        except Exception as e:
+            logger.error(f"Background {job.kind} job {job.id} failed: {e}")
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+
+    def get(self, job_id: str, kind: Optional[str] = None) -> Optional[BackgroundJob]:
+        self._prune()
+        job = self.jobs.get(job_id)
+        if job is None or (kind and job.kind != kind):
+            return None
+        return job
+
+    def cancel_all(self):
+        for job in self.jobs.values():
+            if job.task and not job.task.done():
+                job.task.cancel()
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        for job_id in [job.id for job in self.jobs.values() if job.finished_at and job.finished_at < cutoff]:
+            job = self.jobs.pop(job_id)
+            for path in job.files:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning(f"Could not delete {path} of {job.kind} job {job_id}: {e}")
+
+background_jobs = JobRegistry(JOB_RETENTION_SECONDS)
+
 # ==============================
 # Pydantic Models
 # ==============================
@@ -81,6 +482,22 @@ class MoodDetectionResponse(BaseModel):
     mood: str
     confidence: float
     playlist_url: Optional[str] = None
+    playlist_job_id: Optional[str] = None  # set when the playlist is being created in the background
+    recommendations: List[Dict[str, Any]] = []
+
+class FaceMood(BaseModel):
+    box: List[int]  # [x, y, w, h] in image pixels
+    mood: str
+    confidence: float
+    probabilities: Dict[str, float] = {}
+
+class GroupMoodResponse(BaseModel):
+    face_count: int
+    faces: List[FaceMood] = []
+    room_mood: str
+    room_confidence: float
+    mood_distribution: Dict[str, float] = {}
+    face_counts: Dict[str, int] = {}
     recommendations: List[Dict[str, Any]] = []
 
 class PlaylistRequest(BaseModel):
@@ -106,15 +523,23 @@ class CreatePlaylistRequest(BaseModel):
 # ==============================
 
 def load_mood_model():
-    """Load the pre-trained mood detection model"""
-    global mood_model
+    """Load the pre-trained mood detection model and its inference backend"""
+    global mood_model, mood_backend
     try:
         model_path = "MoodDetector.h5"
         if not os.path.exists(model_path):
             raise FileNotFoundError(f"Model file not found: {model_path}")
         
-        mood_model = load_model(model_path, compile=False)
+        from tensorflow.keras.models import load_model
+        
+        model = load_model(model_path, compile=False)
         logger.info("✅ Mood detection model loaded successfully")
+        
+        # Trace or convert now; warm_up_inference_worker runs the dummy batches
+        backend = create_inference_backend(model, model_path, INFERENCE_BACKEND)
+        logger.info(f"✅ Using '{backend.name}' inference backend")
+        
+        mood_model, mood_backend = model, backend
         return True
     except Exception as e:
         logger.error(f"❌ Failed to load mood model: {e}")
@@ -124,8 +549,7 @@ def load_face_cascade():
     """Load OpenCV face cascade"""
     global face_cascade
     try:
-        cascade_path = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
-        face_cascade = cv2.CascadeClassifier(cascade_path)
+        face_cascade = cv2.CascadeClassifier(FACE_CASCADE_PATH)
         
         if face_cascade.empty():
             raise Exception("Failed to load face cascade")
@@ -136,7 +560,112 @@ def load_face_cascade():
         logger.error(f"❌ Failed to load face cascade: {e}")
         return False
 
-def initialize_spotify():
+def thread_face_cascade():
+    """This thread's face cascade, loaded on first use"""
+    cascade = getattr(face_cascade_local, "cascade", None)
+    if cascade is None:
+        cascade = face_cascade_local.cascade = cv2.CascadeClassifier(FACE_CASCADE_PATH)
+    return cascade
+
+def warm_up_inference_worker(barrier: threading.Barrier):
+    """
+    Run dummy work through one inference thread: a decode and cascade pass on a blank
+    frame, then every warm-up batch size, so graph tracing, kernel selection and
+    per-thread interpreters are done before real traffic arrives
+    """
+    # Hold every worker at the barrier so each warm-up lands on a different thread
+    barrier.wait()
+    
+    blank_frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    _, encoded = cv2.imencode(".jpg", blank_frame)
+    extract_face_from_bytes(encoded.tobytes())
+    detect_faces(to_grayscale(blank_frame), max_dim=0)
+    
+    for batch_size in WARMUP_BATCH_SIZES:
+        mood_backend.warmup(batch_size)
+
+async def warm_up_models():
+    """Warm up every inference thread in parallel"""
+    loop = asyncio.get_running_loop()
+    barrier = threading.Barrier(INFERENCE_WORKERS, timeout=120)
+    await asyncio.gather(*(
+        loop.run_in_executor(inference_executor.executor, warm_up_inference_worker, barrier)
+        for _ in range(INFERENCE_WORKERS)
+    ))
+
+async def start_inference_processes():
+    """Spawn the worker processes; each loads and warms up its own model"""
+    global process_pool
+    pool = ProcessInferencePool(
+        INFERENCE_PROCESSES, PROCESS_SLOTS, PROCESS_SLOT_BYTES,
+        timeout=PROCESS_TIMEOUT, threads_per_process=PROCESS_THREADS
+    )
+    pool.start()
+    if not await pool.wait_ready():
+        pool.shutdown()
+        model_status["phase"] = "failed"
+        logger.error("Inference processes failed to start - mood detection will not work")
+        return
+    
+    process_pool = pool
+    model_status.update({"phase": "ready", "ready_at": time.time()})
+    logger.info(
+        f"✅ {INFERENCE_PROCESSES} inference processes ready after "
+        f"{model_status['ready_at'] - model_status['started_at']:.1f}s"
+    )
+
+async def load_models_in_background():
+    """Load the face cascade and model on an inference thread while the server already answers"""
+    model_status.update({"phase": "loading", "started_at": time.time()})
+    await asyncio.sleep(STARTUP_GRACE_SECONDS)
+    if INFERENCE_PROCESSES > 0:
+        await start_inference_processes()
+        return
+    
+    loop = asyncio.get_running_loop()
+    if not await loop.run_in_executor(inference_executor.executor, load_face_cascade):
+        logger.error("Failed to load face cascade - face detection will not work")
+    if not await loop.run_in_executor(inference_executor.executor, load_mood_model):
+        model_status["phase"] = "failed"
+        logger.error("Failed to load mood model - mood detection will not work")
+        return
+    
+    model_status.update({"phase": "warming_up", "loaded_at": time.time()})
+    try:
+        await warm_up_models()
+    except Exception as e:
+        # A cold instance still works, just slowly at first - don't keep it out of rotation
+        logger.warning(f"Model warm-up failed: {e}")
+    
+    model_status.update({"phase": "ready", "ready_at": time.time()})
+    logger.info(
+        f"✅ Mood model ready after {model_status['ready_at'] - model_status['started_at']:.1f}s "
+        f"(warm-up {model_status['ready_at'] - model_status['loaded_at']:.1f}s, batch sizes {WARMUP_BATCH_SIZES})"
+    )
+
+def models_available() -> bool:
+    """Mood model and face cascade usable, here or in the inference processes"""
+    return process_pool is not None or (mood_model is not None and face_cascade is not None)
+
+def is_ready() -> bool:
+    """Model loaded and warmed up, face cascade loaded (in every inference process when they are used)"""
+    if process_pool is not None:
+        return model_status["phase"] == "ready" and process_pool.ready.is_set()
+    return model_status["phase"] == "ready" and models_available()
+
+def require_mood_models():
+    """Raise 503 until the mood model and face cascade are usable"""
+    if models_available():
+        return
+    if model_status["phase"] == "loading":
+        raise HTTPException(
+            status_code=503,
+            detail="Mood detection model is still loading",
+            headers={"Retry-After": "2"}
+        )
+    raise HTTPException(status_code=503, detail="Mood detection models not loaded")
+
+async def initialize_spotify():
     """Initialize Spotify client with OAuth support for playlist creation"""
     global spotify_client, spotify_oauth
     try:
@@ -147,6 +676,8 @@ def initialize_spotify():
             logger.warning("Spotify credentials not found - playlist creation will be disabled")
             return False
         
+        from spotipy.oauth2 import SpotifyOAuth
+        
         # Initialize OAuth for playlist creation with automatic token management
         redirect_uri = os.getenv("SPOTIFY_REDIRECT_URI", "http://127.0.0.1:8000/callback")
         spotify_oauth = SpotifyOAuth(
@@ -158,133 +689,1112 @@ def initialize_spotify():
             show_dialog=False
         )
         
-        # Also keep the basic client for search functionality
-        auth_manager = SpotifyClientCredentials(
+        # Async client with pooled connections for search and playlist management
+        spotify_client = AsyncSpotifyClient(
             client_id=client_id,
-            client_secret=client_secret
+            client_secret=client_secret,
+            max_connections=SPOTIFY_MAX_CONNECTIONS
         )
-        spotify_client = spotipy.Spotify(auth_manager=auth_manager)
         
-        # Test the connection
-        spotify_client.search(q="test", type="track", limit=1)
-        logger.info("✅ Spotify client initialized successfully")
+        logger.info("✅ Spotify client initialized")
         return True
     except Exception as e:
         logger.error(f"❌ Failed to initialize Spotify client: {e}")
         return False
 
-def get_authenticated_spotify_client():
-    """Get an authenticated Spotify client for playlist creation"""
+async def start_spotify_in_background():
+    """
+    Set up the Spotify clients, start the track pool refresher and run one test search,
+    all after the server is already answering
+    """
+    global track_pool_task
+    await asyncio.sleep(STARTUP_GRACE_SECONDS)
+    # spotipy pulls in requests and friends; import it off the event loop
+    await spotify_executor.run(importlib.import_module, "spotipy.oauth2")
+    if not await initialize_spotify():
+        logger.error("Failed to initialize Spotify - music recommendations will not work")
+        return
+    
+    if TRACK_POOLS_ENABLED:
+        track_pool_task = asyncio.create_task(refresh_track_pools())
+    
     try:
-        if not spotify_oauth:
-            return None
-            
-        # Try to get cached token
-        token_info = spotify_oauth.get_cached_token()
-        
-        if not token_info:
-            logger.info("No cached Spotify token found - playlist creation will use search URLs")
-            return None
+        await spotify_client.search(q="test", type="track", limit=1)
+        logger.info("✅ Spotify connection verified")
+    except Exception as e:
+        logger.error(f"❌ Spotify test search failed - music recommendations may not work: {e}")
+
+class SpotifyUserSession:
+    """
+    Long-lived Spotify user session for playlist creation. Keeps the OAuth
+    token in memory, refreshes it shortly before it expires and caches the
+    user's profile.
+    """
+
+    def __init__(self, refresh_margin: float):
+        self.refresh_margin = refresh_margin
+        self._lock = asyncio.Lock()
+        self._token_info = None
+        self._user = None
+
+    def _cached_token(self) -> Optional[Dict[str, Any]]:
+        """Token from memory, falling back to the OAuth cache file (no network)"""
+        if self._token_info is None and spotify_oauth:
+            self._token_info = spotify_oauth.cache_handler.get_cached_token()
+        return self._token_info
+
+    def _expires_soon(self, token_info: Dict[str, Any]) -> bool:
+        return token_info.get("expires_at", 0) - time.time() < self.refresh_margin
+
+    async def get_access_token(self) -> Optional[str]:
+        """Return the user's access token, refreshing it first if it is about to expire"""
+        async with self._lock:
+            if not spotify_oauth or spotify_client is None:
+                return None
             
-        # Create authenticated client
-        sp = spotipy.Spotify(auth=token_info['access_token'])
-        
-        # Test if token is still valid
-        try:
-            sp.current_user()
-            logger.info("✅ Using authenticated Spotify client for playlist creation")
-            return sp
-        except Exception as e:
-            logger.warning(f"Spotify token invalid: {e}")
-            return None
+            token_info = self._cached_token()
+            if not token_info:
+                logger.info("No cached Spotify token found - playlist creation will use search URLs")
+                return None
             
+            try:
+                if self._expires_soon(token_info):
+                    token_info = await spotify_client.refresh_user_token(token_info["refresh_token"])
+                    self._token_info = token_info
+                    await spotify_executor.run(spotify_oauth.cache_handler.save_token_to_cache, token_info)
+                    logger.info("🔄 Refreshed Spotify access token")
+                
+                # Validate the token once and keep the profile for later requests
+                if self._user is None:
+                    self._user = await spotify_client.current_user(token_info["access_token"])
+                    logger.info("✅ Using authenticated Spotify client for playlist creation")
+                
+                return token_info["access_token"]
+                
+            except Exception as e:
+                logger.warning(f"Spotify token invalid: {e}")
+                self._reset()
+                return None
+
+    def set_token(self, token_info: Dict[str, Any]):
+        """Adopt a freshly issued token (e.g. from /spotify-token)"""
+        self._reset()
+        self._token_info = token_info
+
+    def invalidate(self):
+        """Forget the token after Spotify rejected it, so the cache file is re-read next time"""
+        self._reset()
+
+    def _reset(self):
+        self._token_info = None
+        self._user = None
+
+    @property
+    def user(self) -> Optional[Dict[str, Any]]:
+        return self._user
+
+    def is_authenticated(self) -> bool:
+        """Local check for a usable token - never touches the network"""
+        token_info = self._cached_token()
+        return bool(token_info and (token_info.get("refresh_token") or not self._expires_soon(token_info)))
+
+spotify_session = SpotifyUserSession(SPOTIFY_TOKEN_REFRESH_MARGIN)
+
+async def get_spotify_user_token() -> Optional[str]:
+    """Get the authenticated user's access token for playlist creation"""
+    try:
+        return await spotify_session.get_access_token()
     except Exception as e:
-        logger.error(f"Error getting authenticated Spotify client: {e}")
+        logger.error(f"Error getting authenticated Spotify token: {e}")
         return None
 
+def handle_spotify_auth_error(e: Exception):
+    """Drop the cached user session if Spotify rejected its token"""
+    if isinstance(e, SpotifyAPIError) and e.http_status == 401:
+        spotify_session.invalidate()
+
+# ==============================
+# Inference Backends
+# ==============================
+
+MODEL_INPUT_SHAPE = (48, 48, 1)
+
+class KerasPredictBackend:
+    """Plain model.predict - builds a tf.data pipeline per call, kept for comparison"""
+    name = "keras"
+
+    def __init__(self, model):
+        self.model = model
+
+    def predict(self, face_batch: np.ndarray) -> np.ndarray:
+        return self.model.predict(face_batch, verbose=0)
+
+    def warmup(self, batch_size: int = 1):
+        self.predict(np.zeros((batch_size, *MODEL_INPUT_SHAPE), dtype=np.float32))
+
+class TFFunctionBackend(KerasPredictBackend):
+    """Direct model call traced once into a tf.function with a fixed input signature"""
+    name = "tf_function"
+
+    def __init__(self, model):
+        super().__init__(model)
+
+        import tensorflow as tf
+
+        @tf.function(
+            input_signature=[tf.TensorSpec(shape=(None, *MODEL_INPUT_SHAPE), dtype=tf.float32)],
+            autograph=False
+        )
+        def forward(face_batch):
+            return model(face_batch, training=False)
+
+        self._forward = forward
+
+    def predict(self, face_batch: np.ndarray) -> np.ndarray:
+        # The input signature converts the float32 array to a tensor
+        return self._forward(np.asarray(face_batch, dtype=np.float32)).numpy()
+
+class TFLiteBackend(KerasPredictBackend):
+    """TFLite interpreter (XNNPACK on CPU) converted from the Keras model"""
+    name = "tflite"
+
+    def __init__(self, model, tflite_path: str):
+        super().__init__(model)
+        self.model_content = self._load_or_convert(model, tflite_path)
+        self._local = threading.local()
+
+    @staticmethod
+    def _load_or_convert(model, tflite_path: str) -> bytes:
+        """Reuse a converted model next to the .h5 file, converting it if missing"""
+        if os.path.exists(tflite_path):
+            with open(tflite_path, "rb") as f:
+                return f.read()
+        
+        import tensorflow as tf
+
+        model_content = tf.lite.TFLiteConverter.from_keras_model(model).convert()
+        try:
+            with open(tflite_path, "wb") as f:
+                f.write(model_content)
+            logger.info(f"✅ Converted mood model to TFLite: {tflite_path}")
+        except OSError as e:
+            logger.warning(f"Could not cache TFLite model at {tflite_path}: {e}")
+        return model_content
+
+    def _interpreter(self):
+        """Interpreters are not thread-safe, so each inference thread gets its own"""
+        state = self._local
+        if not hasattr(state, "interpreter"):
+            try:
+                from ai_edge_litert.interpreter import Interpreter
+            except ImportError:
+                import tensorflow as tf
+                Interpreter = tf.lite.Interpreter
+            state.interpreter = Interpreter(model_content=self.model_content, num_threads=1)
+            state.input_index = state.interpreter.get_input_details()[0]["index"]
+            state.output_index = state.interpreter.get_output_details()[0]["index"]
+            state.batch_size = None
+        return state
+
+    def predict(self, face_batch: np.ndarray) -> np.ndarray:
+        state = self._interpreter()
+        interpreter = state.interpreter
+        
+        # Reallocating is only needed when the batch size changes
+        if state.batch_size != len(face_batch):
+            interpreter.resize_tensor_input(state.input_index, [len(face_batch), *MODEL_INPUT_SHAPE])
+            interpreter.allocate_tensors()
+            state.batch_size = len(face_batch)
+        
+        interpreter.set_tensor(state.input_index, np.ascontiguousarray(face_batch, dtype=np.float32))
+        interpreter.invoke()
+        return interpreter.get_tensor(state.output_index).copy()
+
+INFERENCE_BACKENDS = {
+    "keras": KerasPredictBackend,
+    "tf_function": TFFunctionBackend,
+    "tflite": TFLiteBackend
+}
+
+def create_inference_backend(model, model_path: str, backend_name: str):
+    """Build the requested inference backend, falling back to tf_function on failure"""
+    if backend_name not in INFERENCE_BACKENDS:
+        logger.warning(f"Unknown inference backend '{backend_name}' - using tf_function")
+        backend_name = "tf_function"
+    
+    try:
+        if backend_name == "tflite":
+            return TFLiteBackend(model, os.path.splitext(model_path)[0] + ".tflite")
+        return INFERENCE_BACKENDS[backend_name](model)
+    except Exception as e:
+        if backend_name == "tf_function":
+            raise
+        logger.error(f"❌ Failed to create '{backend_name}' inference backend: {e} - using tf_function")
+        return TFFunctionBackend(model)
+
+# ==============================
+# Near-duplicate Frame Cache
+# ==============================
+
+def dhash(gray_image: np.ndarray, hash_size: int) -> int:
+    """
+    Difference hash: shrink to (hash_size + 1) x hash_size and compare neighbouring pixels.
+    Near-identical images hash a few bits apart; noise and recompression barely move it.
+    """
+    small = cv2.resize(gray_image, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+class PerceptualHashCache:
+    """
+    LRU cache of mood probabilities keyed by perceptual hash. A lookup returns the most
+    recently used entry within max_distance bits of the key, so a static scene or a
+    person standing still reuses the last prediction. Entries expire after ttl. Shared
+    by the inference threads; a scope (such as a stream id) limits a lookup to entries
+    stored under the same scope.
+    """
+
+    def __init__(self, name: str, capacity: int, hash_size: int, max_distance: int, ttl: float):
+        self.name = name
+        self.capacity = capacity
+        self.hash_size = hash_size
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()  # {(scope, hash): (probabilities, stored_at)}, least recently used first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, gray_image: np.ndarray) -> Optional[int]:
+        return dhash(gray_image, self.hash_size) if self.capacity > 0 else None
+
+    def lookup(self, key: Optional[int], scope: Optional[str] = None) -> Optional[np.ndarray]:
+        if key is None:
+            return None
+        
+        now = time.monotonic()
+        with self._lock:
+            # A linear scan is fine at a few hundred entries and finds near matches, not just equal hashes
+            for entry_key in reversed(self._entries):
+                entry_scope, entry_hash = entry_key
+                if entry_scope != scope:
+                    continue
+                probabilities, stored_at = self._entries[entry_key]
+                if now - stored_at < self.ttl and (entry_hash ^ key).bit_count() <= self.max_distance:
+                    self._entries.move_to_end(entry_key)
+                    self.hits += 1
+                    return probabilities
+            self.misses += 1
+            return None
+
+    def store(self, key: Optional[int], probabilities: np.ndarray, scope: Optional[str] = None):
+        if key is None:
+            return
+        
+        now = time.monotonic()
+        with self._lock:
+            self._entries[(scope, key)] = (probabilities, now)
+            self._entries.move_to_end((scope, key))
+            for expired in [entry_key for entry_key, (_, stored_at) in self._entries.items() if now - stored_at >= self.ttl]:
+                del self._entries[expired]
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def add_counts(self, hits: int, misses: int):
+        """Fold in lookups done by an inference process's own copy of the cache"""
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "capacity": self.capacity,
+            "hash_bits": self.hash_size ** 2,
+            "max_distance": self.max_distance,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+frame_mood_cache = PerceptualHashCache("frame", MOOD_CACHE_SIZE, FRAME_HASH_SIZE, FRAME_HASH_MAX_DISTANCE, MOOD_CACHE_TTL)
+face_mood_cache = PerceptualHashCache("face", MOOD_CACHE_SIZE, FACE_HASH_SIZE, FACE_HASH_MAX_DISTANCE, MOOD_CACHE_TTL)
+mood_caches = (frame_mood_cache, face_mood_cache)
+
 # ==============================
 # Mood Detection Functions
 # ==============================
 
-def detect_mood_from_image(image_array: np.ndarray) -> tuple:
+def to_grayscale(image_array: np.ndarray) -> np.ndarray:
+    """Convert an RGB image array to grayscale, passing grayscale through"""
+    if len(image_array.shape) == 3:
+        return cv2.cvtColor(image_array, cv2.COLOR_RGB2GRAY)
+    return image_array
+
+@STAGE_SECONDS.timed(stage="face_detection")
+def detect_faces(gray_image: np.ndarray, max_dim: int = None,
+                 min_face_size=None, max_face_size=None, decode_scale: int = 1) -> np.ndarray:
     """
-    Detect mood from a face image array
-    Returns: (mood_name, confidence)
+    Run the face cascade on a downscaled copy of the image
+    Face sizes are in gray_image pixels, as an int or a (w, h) tuple (0 = no limit); the
+    MIN_FACE_SIZE / MAX_FACE_SIZE defaults are divided by decode_scale, the factor a JPEG
+    was reduced by when decoded, so they stay in original-image pixels
+    Returns: (x, y, w, h) boxes in gray_image coordinates
+    """
+    max_dim = DETECTION_MAX_DIM if max_dim is None else max_dim
+    min_face_size = round(MIN_FACE_SIZE / decode_scale) if min_face_size is None else min_face_size
+    max_face_size = round(MAX_FACE_SIZE / decode_scale) if max_face_size is None else max_face_size
+    
+    height, width = gray_image.shape[:2]
+    scale = 1.0
+    if max_dim and max(height, width) > max_dim:
+        scale = max_dim / max(height, width)
+        gray_image = cv2.resize(
+            gray_image, (max(1, round(width * scale)), max(1, round(height * scale))),
+            interpolation=cv2.INTER_AREA
+        )
+    
+    def scaled_size(size):
+        if isinstance(size, int):
+            size = (size, size)
+        return (int(size[0] * scale), int(size[1] * scale))
+    
+    faces = thread_face_cascade().detectMultiScale(
+        gray_image, 1.3, 5,
+        minSize=scaled_size(min_face_size),
+        maxSize=scaled_size(max_face_size)
+    )
+    
+    if len(faces) == 0 or scale == 1.0:
+        return faces
+    
+    # Map boxes back to original coordinates, clamped to the image
+    boxes = np.round(np.asarray(faces, dtype=np.float64) / scale).astype(np.int32)
+    boxes[:, 2] = np.minimum(boxes[:, 2], width - boxes[:, 0])
+    boxes[:, 3] = np.minimum(boxes[:, 3], height - boxes[:, 1])
+    return boxes
+
+class FaceTracker:
+    """
+    Per-connection face tracker for video streams. Runs the full-frame cascade
+    every detection_interval frames and otherwise only searches a padded window
+    around the last known face, which is far cheaper on large frames.
+    Not thread-safe - each stream processes one frame at a time.
+    """
+
+    # Totals across all trackers, reported by /inference-stats; streams update them from
+    # several inference threads at once
+    totals = {"frames": 0, "full_detections": 0, "window_searches": 0, "lost": 0}
+    _totals_lock = threading.Lock()
+
+    def __init__(self, detection_interval: int = TRACK_DETECT_INTERVAL,
+                 padding: float = TRACK_SEARCH_PADDING,
+                 redetect_on_loss: bool = TRACK_REDETECT_ON_LOSS):
+        self.detection_interval = max(1, detection_interval)
+        self.padding = padding
+        self.redetect_on_loss = redetect_on_loss
+        # Scopes this stream's entries in the frame cache
+        self.stream_id = uuid.uuid4().hex
+        self.last_box = None
+        self.frames_since_detection = 0
+        self.frames = 0
+        self.full_detections = 0
+        self.window_searches = 0
+        self.lost = 0
+
+    def detect(self, gray_image: np.ndarray, decode_scale: int = 1) -> list:
+        """Return the tracked face box as a one-element list, or [] if there is none"""
+        self.frames += 1
+        FaceTracker._count("frames")
+        
+        if self.last_box is not None and self.frames_since_detection < self.detection_interval:
+            box = self._search_window(gray_image)
+            if box is not None:
+                self.last_box = box
+                self.frames_since_detection += 1
+                return [box]
+            
+            self.lost += 1
+            FaceTracker._count("lost")
+            self.last_box = None
+            if not self.redetect_on_loss:
+                return []
+        
+        return self._detect_full(gray_image, decode_scale)
+
+    def reuse(self):
+        """
+        Count a frame served from the frame cache: it is nearly identical to a recent frame,
+        so the face has not moved, but the next full detection stays on schedule
+        """
+        self.frames += 1
+        FaceTracker._count("frames")
+        if self.last_box is not None:
+            self.frames_since_detection += 1
+
+    def _detect_full(self, gray_image: np.ndarray, decode_scale: int = 1) -> list:
+        self.full_detections += 1
+        FaceTracker._count("full_detections")
+        self.frames_since_detection = 1
+        
+        faces = detect_faces(gray_image, decode_scale=decode_scale)
+        if len(faces) == 0:
+            self.last_box = None
+            return []
+        
+        self.last_box = tuple(int(value) for value in max(faces, key=lambda face: face[2] * face[3]))
+        return [self.last_box]
+
+    def _search_window(self, gray_image: np.ndarray):
+        """Run the cascade on a padded window around the last box, restricted to similar face sizes"""
+        self.window_searches += 1
+        FaceTracker._count("window_searches")
+        
+        x, y, w, h = self.last_box
+        pad_x, pad_y = int(w * self.padding), int(h * self.padding)
+        x0, y0 = max(0, x - pad_x), max(0, y - pad_y)
+        x1 = min(gray_image.shape[1], x + w + pad_x)
+        y1 = min(gray_image.shape[0], y + h + pad_y)
+        
+        faces = detect_faces(
+            gray_image[y0:y1, x0:x1],
+            min_face_size=(int(w * 0.6), int(h * 0.6)),
+            max_face_size=(int(w * 1.6), int(h * 1.6))
+        )
+        if len(faces) == 0:
+            return None
+        
+        fx, fy, fw, fh = max(faces, key=lambda face: face[2] * face[3])
+        return (int(fx) + x0, int(fy) + y0, int(fw), int(fh))
+
+    def merge(self, updated: "FaceTracker"):
+        """Adopt the state of a copy that processed a frame in a worker process"""
+        for key in ("frames", "full_detections", "window_searches", "lost"):
+            FaceTracker._count(key, getattr(updated, key) - getattr(self, key))
+        self.__dict__.update(updated.__dict__)
+
+    @classmethod
+    def _count(cls, key: str, amount: int = 1):
+        with cls._totals_lock:
+            cls.totals[key] += amount
+
+    def skip_ratio(self) -> float:
+        """Fraction of frames that avoided a full-frame cascade pass"""
+        return 1.0 - self.full_detections / self.frames if self.frames else 0.0
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        with cls._totals_lock:
+            totals = dict(cls.totals)
+        frames = totals["frames"]
+        return {
+            "detection_interval": TRACK_DETECT_INTERVAL,
+            "redetect_on_loss": TRACK_REDETECT_ON_LOSS,
+            **totals,
+            "cascade_skip_ratio": 1.0 - totals["full_detections"] / frames if frames else 0.0
+        }
+
+@STAGE_SECONDS.timed(stage="preprocess")
+def preprocess_face(gray_image: np.ndarray, box) -> np.ndarray:
+    """Crop a face box and turn it into a 48x48x1 float32 model input"""
+    x, y, w, h = box
+    
+    # Extract face region
+    face_roi = gray_image[y:y+h, x:x+w]
+    
+    # Resize to model input size (48x48)
+    face_resized = cv2.resize(face_roi, (48, 48))
+    
+    # Normalize and add the channel axis expected by the model
+    face_normalized = face_resized.astype('float32') / 255.0
+    return np.expand_dims(face_normalized, axis=-1)
+
+def extract_face(image_array: np.ndarray, tracker: Optional[FaceTracker] = None,
+                 decode_scale: int = 1) -> Optional[np.ndarray]:
+    """
+    Find the largest face in an image and preprocess it for the mood model.
+    Streams pass their FaceTracker so most frames skip the full-frame cascade.
+    decode_scale: factor the image was reduced by when decoded (see detect_faces)
+    Returns: 48x48x1 float32 array, or None if no face was found
     """
     try:
-        if mood_model is None:
+        if mood_backend is None:
             raise Exception("Mood model not loaded")
         
-        # Convert to grayscale if needed
-        if len(image_array.shape) == 3:
-            gray_image = cv2.cvtColor(image_array, cv2.COLOR_RGB2GRAY)
+        gray_image = to_grayscale(image_array)
+        if tracker:
+            faces = tracker.detect(gray_image, decode_scale)
         else:
-            gray_image = image_array
-        
-        # Detect faces
-        faces = face_cascade.detectMultiScale(gray_image, 1.3, 5)
+            faces = detect_faces(gray_image, decode_scale=decode_scale)
         
         if len(faces) == 0:
-            return None, 0.0
+            return None
         
         # Get the largest face
         largest_face = max(faces, key=lambda face: face[2] * face[3])
-        x, y, w, h = largest_face
-        
-        # Extract face region
-        face_roi = gray_image[y:y+h, x:x+w]
-        
-        # Resize to model input size (48x48)
-        face_resized = cv2.resize(face_roi, (48, 48))
+        return preprocess_face(gray_image, largest_face)
         
-        # Normalize and reshape for model
-        face_normalized = face_resized.astype('float32') / 255.0
-        face_input = np.expand_dims(face_normalized, axis=0)
-        face_input = np.expand_dims(face_input, axis=-1)
+    except Exception as e:
+        logger.error(f"Error in face extraction: {e}")
+        return None
+
+def extract_face_cached(image_array: np.ndarray, tracker: Optional[FaceTracker] = None,
+                        decode_scale: int = 1) -> tuple:
+    """
+    extract_face behind the near-duplicate caches: a stream's frame close to one of its recent
+    frames skips the cascade and the model, a face crop close to one of its recent crops skips
+    the model. Only streams (with a tracker) use the caches, each seeing just its own entries.
+    Returns: (cached probabilities or None, face input or None, hash keys for store_mood_prediction)
+    """
+    gray_image = to_grayscale(image_array)
+    if tracker is None:
+        face_input = extract_face(gray_image, decode_scale=decode_scale)
+        return None, face_input, ()
+    
+    stream_id = tracker.stream_id
+    frame_key = frame_mood_cache.key(gray_image)
+    probabilities = frame_mood_cache.lookup(frame_key, stream_id)
+    if probabilities is not None:
+        tracker.reuse()
+        return probabilities, None, ()
+    
+    face_input = extract_face(gray_image, tracker, decode_scale)
+    if face_input is None:
+        return None, None, ()
+    
+    face_key = face_mood_cache.key(face_input[..., 0])
+    probabilities = face_mood_cache.lookup(face_key, stream_id)
+    if probabilities is not None:
+        frame_mood_cache.store(frame_key, probabilities, stream_id)
+        return probabilities, None, ()
+    
+    return None, face_input, (stream_id, frame_key, face_key)
+
+def store_mood_prediction(keys: tuple, probabilities: np.ndarray):
+    """Remember a fresh prediction under the frame and face hashes from extract_face_cached"""
+    if keys:
+        stream_id, frame_key, face_key = keys
+        frame_mood_cache.store(frame_key, probabilities, stream_id)
+        face_mood_cache.store(face_key, probabilities, stream_id)
+
+def extract_all_faces(image_array: np.ndarray, decode_scale: int = 1) -> tuple:
+    """
+    Find every face in an image (largest first, up to MAX_FACES) and preprocess them
+    decode_scale: factor the image was reduced by when decoded (see detect_faces)
+    Returns: (list of [x, y, w, h] boxes, Nx48x48x1 float32 array or None)
+    """
+    try:
+        if mood_backend is None:
+            raise Exception("Mood model not loaded")
         
-        # Predict mood
-        predictions = mood_model.predict(face_input, verbose=0)
-        mood_index = np.argmax(predictions[0])
-        confidence = float(np.max(predictions[0]))
+        gray_image = to_grayscale(image_array)
+        faces = detect_faces(gray_image, decode_scale=decode_scale)
         
-        mood_name = MOOD_LABELS.get(mood_index, "Unknown")
+        if len(faces) == 0:
+            return [], None
         
-        return mood_name, confidence
+        faces = sorted(faces, key=lambda face: face[2] * face[3], reverse=True)[:MAX_FACES]
+        boxes = [[int(value) for value in face] for face in faces]
+        face_batch = np.stack([preprocess_face(gray_image, face) for face in faces])
+        return boxes, face_batch
         
     except Exception as e:
-        logger.error(f"Error in mood detection: {e}")
-        return None, 0.0
+        logger.error(f"Error in face extraction: {e}")
+        return [], None
 
-def base64_to_image(base64_string: str) -> np.ndarray:
-    """Convert base64 string to image array"""
+@STAGE_SECONDS.timed(stage="inference")
+def predict_mood_batch(face_batch: np.ndarray) -> np.ndarray:
+    """
+    Run the mood model on a batch of preprocessed faces
+    Returns: (batch_size, 7) array of class probabilities
+    """
+    return mood_backend.predict(face_batch)
+
+def probabilities_to_mood(probabilities: np.ndarray) -> tuple:
+    """
+    Collapse a probability vector to its most likely mood
+    Returns: (mood_name, confidence)
+    """
+    mood_index = int(np.argmax(probabilities))
+    confidence = float(probabilities[mood_index])
+    return MOOD_LABELS.get(mood_index, "Unknown"), confidence
+
+def mood_probabilities(probabilities: np.ndarray) -> Dict[str, float]:
+    """Full probability vector keyed by mood name"""
+    return {MOOD_LABELS[index]: float(value) for index, value in enumerate(probabilities)}
+
+def summarize_room_mood(probabilities: np.ndarray) -> Dict[str, Any]:
+    """
+    Aggregate per-face probability vectors into a single room mood
+    Returns: dict with the room mood, its confidence, the mean distribution and per-mood face counts
+    """
+    mean_probabilities = probabilities.mean(axis=0)
+    room_mood, room_confidence = probabilities_to_mood(mean_probabilities)
+    
+    face_counts = {mood: 0 for mood in MOOD_LABELS.values()}
+    for face_probabilities in probabilities:
+        mood, _ = probabilities_to_mood(face_probabilities)
+        face_counts[mood] = face_counts.get(mood, 0) + 1
+    
+    return {
+        "room_mood": room_mood,
+        "room_confidence": room_confidence,
+        "mood_distribution": mood_probabilities(mean_probabilities),
+        "face_counts": face_counts
+    }
+
+def detect_mood_from_image(image_array: np.ndarray) -> tuple:
+    """
+    Detect mood from a face image array
+    Returns: (mood_name, confidence)
+    """
     try:
-        # Remove data URL prefix if present
-        if "," in base64_string:
-            base64_string = base64_string.split(",")[1]
-        
-        # Decode base64
-        image_data = base64.b64decode(base64_string)
+        probabilities, face_input, cache_keys = extract_face_cached(image_array)
         
-        # Convert to PIL Image
-        pil_image = Image.open(io.BytesIO(image_data))
-        
-        # Convert to RGB if needed
-        if pil_image.mode != 'RGB':
-            pil_image = pil_image.convert('RGB')
-        
-        # Convert to numpy array
-        image_array = np.array(pil_image)
+        if probabilities is None:
+            if face_input is None:
+                return None, 0.0
+            
+            # Predict mood
+            probabilities = predict_mood_batch(np.expand_dims(face_input, axis=0))[0]
+            store_mood_prediction(cache_keys, probabilities)
         
-        return image_array
+        return probabilities_to_mood(probabilities)
         
     except Exception as e:
-        logger.error(f"Error converting base64 to image: {e}")
+        logger.error(f"Error in mood detection: {e}")
+        return None, 0.0
+
+def decode_gray_image(image_data) -> tuple:
+    """
+    Decode encoded image bytes (JPEG, PNG, WebP, ...) straight to grayscale
+    Returns: (grayscale image, factor mapping its pixels back to the original image)
+    """
+    try:
+        return image_decode.decode_grayscale(image_data, MAX_IMAGE_BYTES, MAX_IMAGE_PIXELS, DECODE_MAX_DIM)
+    except image_decode.ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except image_decode.ImageDecodeError as e:
+        logger.warning(f"Could not decode image: {e}")
+        raise HTTPException(status_code=400, detail="Invalid image data")
+
+def decode_base64_payload(base64_string: str) -> bytes:
+    """Decode base64 image bytes, skipping an optional data URL prefix"""
+    try:
+        return image_decode.decode_base64(base64_string, MAX_IMAGE_BYTES)
+    except image_decode.ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except image_decode.ImageDecodeError as e:
+        logger.warning(f"Could not decode base64 image: {e}")
+        raise HTTPException(status_code=400, detail="Invalid image data")
+
+@STAGE_SECONDS.timed(stage="decode")
+def decode_image_bytes(image_data: bytes) -> tuple:
+    """Decode uploaded image bytes to grayscale (see decode_gray_image)"""
+    return decode_gray_image(image_data)
+
+@STAGE_SECONDS.timed(stage="decode")
+def decode_base64_image(base64_string: str) -> tuple:
+    """Decode a base64 image to grayscale (see decode_gray_image)"""
+    return decode_gray_image(decode_base64_payload(base64_string))
+
+def scale_boxes(boxes: list, scale: int) -> list:
+    """Map boxes found in a reduced-size decode back to original-image pixels"""
+    if scale == 1:
+        return boxes
+    return [[value * scale for value in box] for box in boxes]
+
+# Binary WebSocket frames: 14-byte little-endian header followed by the payload
+#   kind (u8)       FRAME_KIND_ENCODED = JPEG/WebP/PNG bytes, FRAME_KIND_GRAY = raw 8-bit pixels
+#   flags (u8)      FRAME_FLAG_INCLUDE_PLAYLIST | FRAME_FLAG_MULTI_FACE | FRAME_FLAG_CREATE_PLAYLIST
+#   width (u16)     pixel width (raw grayscale frames only)
+#   height (u16)    pixel height (raw grayscale frames only)
+#   timestamp (f64) echoed back in the response
+FRAME_HEADER = struct.Struct("<BBHHd")
+FRAME_KIND_ENCODED = 0
+FRAME_KIND_GRAY = 1
+# Not accepted from clients: base64 text forwarded to an inference process, which decodes it
+FRAME_KIND_BASE64 = 2
+FRAME_FLAG_INCLUDE_PLAYLIST = 1
+FRAME_FLAG_MULTI_FACE = 2
+FRAME_FLAG_CREATE_PLAYLIST = 4
+
+def parse_binary_frame(message: bytes) -> Dict[str, Any]:
+    """Split a binary WebSocket frame into its header fields and a zero-copy payload view"""
+    if len(message) <= FRAME_HEADER.size:
+        raise ValueError("Binary frame too short")
+    
+    kind, flags, width, height, timestamp = FRAME_HEADER.unpack_from(message)
+    payload = memoryview(message)[FRAME_HEADER.size:]
+    
+    if kind == FRAME_KIND_GRAY and len(payload) != width * height:
+        raise ValueError(f"Expected {width * height} grayscale bytes for {width}x{height}, got {len(payload)}")
+    if kind not in (FRAME_KIND_ENCODED, FRAME_KIND_GRAY):
+        raise ValueError(f"Unknown frame kind: {kind}")
+    
+    return {
+        "kind": kind,
+        "flags": flags,
+        "width": width,
+        "height": height,
+        "timestamp": timestamp,
+        "payload": payload
+    }
+
+@STAGE_SECONDS.timed(stage="decode")
+def decode_binary_frame(frame: Dict[str, Any]) -> tuple:
+    """
+    Decode a parsed binary frame straight to grayscale
+    Returns: (grayscale image, factor mapping its pixels back to the original image)
+    """
+    if frame["kind"] == FRAME_KIND_GRAY:
+        return np.frombuffer(frame["payload"], dtype=np.uint8).reshape(frame["height"], frame["width"]), 1
+    if frame["kind"] == FRAME_KIND_BASE64:
+        return decode_gray_image(decode_base64_payload(frame["payload"]))
+    
+    return decode_gray_image(frame["payload"])
+
+def extract_all_faces_scaled(gray_image: np.ndarray, scale: int) -> tuple:
+    """extract_all_faces with boxes in original-image pixels"""
+    boxes, face_batch = extract_all_faces(gray_image, scale)
+    return scale_boxes(boxes, scale), face_batch
+
+def extract_face_from_binary_frame(frame: Dict[str, Any], tracker: Optional[FaceTracker] = None) -> tuple:
+    """Decode a binary frame and look up or extract its largest face (see extract_face_cached)"""
+    gray_image, scale = decode_binary_frame(frame)
+    return extract_face_cached(gray_image, tracker, scale)
+
+def extract_all_faces_from_binary_frame(frame: Dict[str, Any]) -> tuple:
+    """Decode a binary frame and extract model inputs for every face in it"""
+    return extract_all_faces_scaled(*decode_binary_frame(frame))
+
+def extract_face_from_base64(base64_string: str, tracker: Optional[FaceTracker] = None) -> tuple:
+    """Decode a base64 image and look up or extract its largest face (see extract_face_cached)"""
+    gray_image, scale = decode_base64_image(base64_string)
+    return extract_face_cached(gray_image, tracker, scale)
+
+def extract_face_from_bytes(image_data: bytes) -> tuple:
+    """Decode uploaded image bytes and look up or extract its largest face (see extract_face_cached)"""
+    gray_image, scale = decode_image_bytes(image_data)
+    return extract_face_cached(gray_image, decode_scale=scale)
+
+def extract_all_faces_from_base64(base64_string: str) -> tuple:
+    """Decode a base64 image and extract model inputs for every face in it"""
+    return extract_all_faces_scaled(*decode_base64_image(base64_string))
+
+def extract_all_faces_from_bytes(image_data: bytes) -> tuple:
+    """Decode uploaded image bytes and extract model inputs for every face in it"""
+    return extract_all_faces_scaled(*decode_image_bytes(image_data))
+
+# ==============================
+# Micro-batching
+# ==============================
+
+class MoodBatcher:
+    """
+    Coalesces face crops from concurrent requests into batched forward passes.
+    A batch is dispatched once it holds max_batch_size faces or the oldest
+    face has waited max_wait_ms, whichever comes first.
+    """
+
+    def __init__(self, max_batch_size: int, max_wait_ms: float, max_concurrent_batches: int):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.max_concurrent_batches = max(1, max_concurrent_batches)
+        self.batch_size_counts: Dict[int, int] = {}
+        self.total_batches = 0
+        self.total_items = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+        self._inflight = set()
+
+    def start(self):
+        """Start the collector task on the running event loop"""
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+        self._task = asyncio.create_task(self._collect())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def predict(self, face_input: np.ndarray) -> np.ndarray:
+        """Queue one preprocessed face and wait for its probability vector"""
+        return (await self.predict_many([face_input]))[0]
+
+    async def predict_many(self, face_inputs) -> np.ndarray:
+        """
+        Queue several faces at once so they land in the same forward pass
+        (split only if they exceed max_batch_size)
+        """
+        if self._task is None or self._task.done():
+            self.start()
+        loop = asyncio.get_running_loop()
+        futures = []
+        for face_input in face_inputs:
+            future = loop.create_future()
+            self._queue.put_nowait((face_input, future))
+            futures.append(future)
+        return np.stack(await asyncio.gather(*futures))
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            
+            while len(batch) < self.max_batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            # Wait for a free slot so at most one batch per inference worker is in flight
+            await self._slots.acquire()
+            task = asyncio.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch: list):
+        try:
+            face_batch = np.stack([face_input for face_input, _ in batch])
+            loop = asyncio.get_running_loop()
+            predictions = await loop.run_in_executor(
+                inference_executor.executor, predict_mood_batch, face_batch
+            )
+            for (_, future), probabilities in zip(batch, predictions):
+                if not future.done():
+                    future.set_result(probabilities)
+            self._record(len(batch))
+        except Exception as e:
+            logger.error(f"Error in batched mood prediction: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._slots.release()
+
+    def _record(self, batch_size: int):
+        self.total_batches += 1
+        self.total_items += batch_size
+        self.batch_size_counts[batch_size] = self.batch_size_counts.get(batch_size, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "batches": self.total_batches,
+            "items": self.total_items,
+            "mean_batch_size": self.total_items / self.total_batches if self.total_batches else 0.0,
+            "batch_size_counts": dict(sorted(self.batch_size_counts.items()))
+        }
+
+mood_batcher = MoodBatcher(BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, INFERENCE_WORKERS)
+
+def encoded_frame(image_data: bytes) -> Dict[str, Any]:
+    return {"kind": FRAME_KIND_ENCODED, "payload": image_data, "width": 0, "height": 0}
+
+def encoded_frame_from_base64(base64_string: str) -> Dict[str, Any]:
+    """Ship the base64 text itself, so the inference process decodes it instead of the event loop"""
+    try:
+        payload = base64_string.encode("ascii")
+    except UnicodeEncodeError:
         raise HTTPException(status_code=400, detail="Invalid image data")
+    return {"kind": FRAME_KIND_BASE64, "payload": payload, "width": 0, "height": 0}
+
+# How each extract function's payload is shipped to an inference process: (mode, payload -> frame)
+PROCESS_FRAME_SOURCES = {
+    extract_face_from_base64: ("single", encoded_frame_from_base64),
+    extract_face_from_bytes: ("single", encoded_frame),
+    extract_face_from_binary_frame: ("single", lambda frame: frame),
+    extract_all_faces_from_base64: ("group", encoded_frame_from_base64),
+    extract_all_faces_from_binary_frame: ("group", lambda frame: frame),
+    extract_all_faces_from_bytes: ("group", encoded_frame)
+}
+
+async def run_in_inference_process(extract_func, payload, tracker: Optional[FaceTracker] = None):
+    """Run decode, detection and prediction for one frame in the process pool"""
+    mode, to_frame = PROCESS_FRAME_SOURCES[extract_func]
+    with STAGE_SECONDS.time(stage="process_roundtrip"):
+        result = await process_pool.run(mode, to_frame(payload), tracker)
+    if mode == "group":
+        return result
+    
+    probabilities, updated_tracker, cache_lookups = result
+    if tracker is not None:
+        tracker.merge(updated_tracker)
+    for cache, (hits, misses) in zip(mood_caches, cache_lookups):
+        cache.add_counts(hits, misses)
+    return probabilities, updated_tracker
+
+async def detect_mood_probabilities_async(extract_func, *args) -> Optional[np.ndarray]:
+    """
+    Extract a face off the event loop, then classify it through the shared batcher
+    (or do both in an inference process when the process pool is enabled)
+    Returns: probability vector of the largest face, or None if no face was found
+    """
+    if process_pool is not None:
+        probabilities, _ = await run_in_inference_process(extract_func, *args)
+    else:
+        probabilities, face_input, cache_keys = await inference_executor.run(extract_func, *args)
+        if probabilities is None and face_input is not None:
+            probabilities = await mood_batcher.predict(face_input)
+            store_mood_prediction(cache_keys, probabilities)
+    
+    if probabilities is None:
+        NO_FACE_TOTAL.inc(mode="single")
+    return probabilities
+
+async def detect_mood_async(extract_func, *args) -> tuple:
+    """
+    Detect the mood of the largest face (see detect_mood_probabilities_async)
+    Returns: (mood_name, confidence)
+    """
+    probabilities = await detect_mood_probabilities_async(extract_func, *args)
+    if probabilities is None:
+        return None, 0.0
+    return probabilities_to_mood(probabilities)
+
+async def detect_group_mood_async(extract_func, payload) -> Optional[Dict[str, Any]]:
+    """
+    Classify every face in an image in one batched pass
+    Returns: dict with per-face results and the aggregated room mood, or None if no face was found
+    """
+    if process_pool is not None:
+        boxes, probabilities = await run_in_inference_process(extract_func, payload)
+    else:
+        boxes, face_batch = await inference_executor.run(extract_func, payload)
+        probabilities = await mood_batcher.predict_many(face_batch) if face_batch is not None else None
+    
+    if probabilities is None:
+        NO_FACE_TOTAL.inc(mode="group")
+        return None
+    
+    faces = []
+    for box, face_probabilities in zip(boxes, probabilities):
+        mood, confidence = probabilities_to_mood(face_probabilities)
+        faces.append({
+            "box": box,
+            "mood": mood,
+            "confidence": confidence,
+            "probabilities": mood_probabilities(face_probabilities)
+        })
+    
+    return {
+        "face_count": len(faces),
+        "faces": faces,
+        **summarize_room_mood(probabilities)
+    }
 
 # ==============================
 # Spotify Integration Functions
 # ==============================
 
+class AsyncTTLCache:
+    """
+    Cache for async loaders with a TTL, stale-while-revalidate and single-flight loading.
+    Fresh entries are returned directly; entries within the stale window are returned
+    immediately while one background refresh runs; concurrent misses for the same key
+    share a single load. Failed loads are not cached.
+    """
+
+    def __init__(self, name: str, ttl: float, stale_ttl: float):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries: Dict[Any, tuple] = {}  # {key: (value, fetched_at)}
+        self._inflight: Dict[Any, asyncio.Task] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refresh_errors = 0
+
+    async def get(self, key, loader):
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, fetched_at = entry
+            age = time.monotonic() - fetched_at
+            if age < self.ttl:
+                self.hits += 1
+                return value
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                if key not in self._inflight:
+                    self._start_load(key, loader)
+                return value
+        
+        self.misses += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._start_load(key, loader)
+        else:
+            self.coalesced += 1
+        # Shield so one cancelled caller does not cancel the load for everyone else
+        return await asyncio.shield(task)
+
+    def _start_load(self, key, loader) -> asyncio.Task:
+        task = asyncio.create_task(self._load(key, loader))
+        # Background refreshes (and loads whose callers all went away) are never awaited;
+        # _load already logged the failure, so mark it retrieved instead of letting asyncio
+        # report "Task exception was never retrieved" for each one
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        self._inflight[key] = task
+        return task
+
+    async def _load(self, key, loader):
+        try:
+            value = await loader()
+            self._entries[key] = (value, time.monotonic())
+            return value
+        except Exception as e:
+            self.refresh_errors += 1
+            logger.warning(f"{self.name} cache load failed for {key}: {e}")
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "ttl_seconds": self.ttl,
+            "stale_ttl_seconds": self.stale_ttl,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced_misses": self.coalesced,
+            "refresh_errors": self.refresh_errors,
+            "hit_rate": (self.hits + self.stale_hits) / lookups if lookups else 0.0
+        }
+
+spotify_search_cache = AsyncTTLCache("spotify search", SPOTIFY_CACHE_TTL, SPOTIFY_CACHE_STALE_TTL)
+
 def get_mood_search_query(mood: str) -> str:
     """Map mood to Spotify search parameters"""
     mood_queries = {
@@ -298,69 +1808,235 @@ def get_mood_search_query(mood: str) -> str:
     }
     return mood_queries.get(mood, "pop music")
 
-def search_spotify_by_mood(mood: str, limit: int = 20) -> List[Dict[str, Any]]:
-    """Search Spotify for tracks based on mood"""
-    try:
-        if spotify_client is None:
-            raise Exception("Spotify client not initialized")
+def format_track(track: Dict[str, Any]) -> Dict[str, Any]:
+    """Reduce a Spotify track object to the fields the API returns"""
+    # Get artist name
+    artist_name = track['artists'][0]['name'] if track['artists'] else "Unknown Artist"
+    
+    # Get album image
+    image_url = None
+    if track['album']['images']:
+        # Get medium size image (usually index 1)
+        if len(track['album']['images']) > 1:
+            image_url = track['album']['images'][1]['url']
+        else:
+            image_url = track['album']['images'][0]['url']
+    
+    return {
+        'id': track['id'],
+        'name': track['name'],
+        'artist': artist_name,
+        'album': track['album']['name'],
+        'image_url': image_url,
+        'preview_url': track['preview_url'],
+        'spotify_url': track['external_urls']['spotify'],
+        'duration_ms': track['duration_ms'],
+        'popularity': track['popularity']
+    }
+
+async def fetch_spotify_tracks(mood: str, market: str, limit: int) -> List[Dict[str, Any]]:
+    """Search Spotify for tracks based on mood (uncached - raises on failure)"""
+    if spotify_client is None:
+        raise Exception("Spotify client not initialized")
+    
+    search_query = get_mood_search_query(mood)
+    
+    # Search for tracks with higher limit to account for duplicates
+    search_limit = min(limit * 2, 50)  # Search more tracks to filter duplicates
+    
+    results = await spotify_client.search(
+        q=search_query, 
+        type='track', 
+        limit=search_limit,
+        market=market
+    )
+    
+    tracks = []
+    seen_track_ids = set()  # Track unique track IDs
+    
+    for track in results['tracks']['items']:
+        if not track:
+            continue
         
-        search_query = get_mood_search_query(mood)
-        market = os.getenv("SPOTIFY_MARKET", "US")
+        # Skip if we've already seen this track ID
+        if track['id'] in seen_track_ids:
+            continue
         
-        # Search for tracks with higher limit to account for duplicates
-        search_limit = min(limit * 2, 50)  # Search more tracks to filter duplicates
+        tracks.append(format_track(track))
+        seen_track_ids.add(track['id'])
         
-        results = spotify_client.search(
-            q=search_query, 
-            type='track', 
-            limit=search_limit,
+        # Stop if we have enough unique tracks
+        if len(tracks) >= limit:
+            break
+    
+    logger.info(f"Found {len(tracks)} unique tracks for mood '{mood}' (filtered from {len(results['tracks']['items'])} total)")
+    return tracks
+
+async def fetch_spotify_track_pool(mood: str, market: str, size: int) -> List[Dict[str, Any]]:
+    """Fetch pages of the mood search (50 per request) concurrently to build a deep, deduplicated track pool"""
+    if spotify_client is None:
+        raise Exception("Spotify client not initialized")
+    
+    search_query = get_mood_search_query(mood)
+    
+    # Spotify caps search offsets at 1000
+    pages = await asyncio.gather(*[
+        spotify_client.search(
+            q=search_query,
+            type='track',
+            limit=50,
+            offset=offset,
             market=market
         )
+        for offset in range(0, min(size, 1000), 50)
+    ])
+    
+    tracks = []
+    seen_track_ids = set()
+    for results in pages:
+        for track in results['tracks']['items']:
+            if track and track['id'] not in seen_track_ids:
+                tracks.append(format_track(track))
+                seen_track_ids.add(track['id'])
+    
+    logger.info(f"Built track pool of {len(tracks[:size])} tracks for mood '{mood}' ({market})")
+    return tracks[:size]
+
+class TrackPoolStore:
+    """
+    Per-(mood, market) pools of tracks kept in memory and mirrored to a JSON file,
+    so recommendations can be sampled without a Spotify call on the request path
+    """
+
+    def __init__(self, path: str, refresh_interval: float):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.pools: Dict[tuple, Dict[str, Any]] = {}  # {(mood, market): {"tracks": [...], "refreshed_at": epoch}}
+        self.samples = 0
+
+    def load(self):
+        """Load pools saved by a previous run, if any"""
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+            for entry in saved:
+                self.pools[(entry["mood"], entry["market"])] = {
+                    "tracks": entry["tracks"],
+                    "refreshed_at": entry["refreshed_at"]
+                }
+            logger.info(f"✅ Loaded {len(self.pools)} track pools from {self.path}")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Could not load track pools from {self.path}: {e}")
+
+    def save(self):
+        """Write pools to disk atomically"""
+        saved = [
+            {"mood": mood, "market": market, **pool}
+            for (mood, market), pool in self.pools.items()
+        ]
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(saved, f)
+        os.replace(tmp_path, self.path)
+
+    def needs_refresh(self, mood: str, market: str) -> bool:
+        pool = self.pools.get((mood, market))
+        return pool is None or time.time() - pool["refreshed_at"] >= self.refresh_interval
+
+    def update(self, mood: str, market: str, tracks: List[Dict[str, Any]]):
+        if tracks:
+            self.pools[(mood, market)] = {"tracks": tracks, "refreshed_at": time.time()}
+
+    def sample(self, mood: str, market: str, limit: int) -> Optional[List[Dict[str, Any]]]:
+        """
+        Draw up to limit distinct tracks, weighted by popularity
+        Returns: None if there is no pool for this mood and market yet
+        """
+        pool = self.pools.get((mood, market))
+        if not pool:
+            return None
         
-        tracks = []
-        seen_track_ids = set()  # Track unique track IDs
+        tracks = pool["tracks"]
+        weights = np.array([track.get('popularity') or 0 for track in tracks], dtype=np.float64) + 1.0
         
-        for track in results['tracks']['items']:
-            if not track:
-                continue
-            
-            # Skip if we've already seen this track ID
-            if track['id'] in seen_track_ids:
+        # Oversample so dropping re-releases of the same song still leaves enough tracks
+        picks = np.random.default_rng().choice(
+            len(tracks), size=min(len(tracks), limit * 2), replace=False, p=weights / weights.sum()
+        )
+        
+        sampled = []
+        seen_songs = set()
+        for index in picks:
+            track = tracks[index]
+            song = (track['name'].lower(), track['artist'].lower())
+            if song in seen_songs:
                 continue
-                
-            # Get artist name
-            artist_name = track['artists'][0]['name'] if track['artists'] else "Unknown Artist"
-            
-            # Get album image
-            image_url = None
-            if track['album']['images']:
-                # Get medium size image (usually index 1)
-                if len(track['album']['images']) > 1:
-                    image_url = track['album']['images'][1]['url']
-                else:
-                    image_url = track['album']['images'][0]['url']
-            
-            track_info = {
-                'id': track['id'],
-                'name': track['name'],
-                'artist': artist_name,
-                'album': track['album']['name'],
-                'image_url': image_url,
-                'preview_url': track['preview_url'],
-                'spotify_url': track['external_urls']['spotify'],
-                'duration_ms': track['duration_ms'],
-                'popularity': track['popularity']
-            }
-            
-            tracks.append(track_info)
-            seen_track_ids.add(track['id'])
-            
-            # Stop if we have enough unique tracks
-            if len(tracks) >= limit:
+            sampled.append(track)
+            seen_songs.add(song)
+            if len(sampled) >= limit:
                 break
         
-        logger.info(f"Found {len(tracks)} unique tracks for mood '{mood}' (filtered from {len(results['tracks']['items'])} total)")
-        return tracks
+        self.samples += 1
+        return sampled
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pools": len(self.pools),
+            "tracks": sum(len(pool["tracks"]) for pool in self.pools.values()),
+            "samples": self.samples,
+            "oldest_refresh_age_seconds": (
+                time.time() - min(pool["refreshed_at"] for pool in self.pools.values())
+                if self.pools else None
+            )
+        }
+
+track_pools = TrackPoolStore(TRACK_POOL_PATH, TRACK_POOL_REFRESH_INTERVAL)
+
+async def refresh_track_pools():
+    """Background job: build missing or stale pools for every mood, forever"""
+    while True:
+        market = os.getenv("SPOTIFY_MARKET", "US")
+        refreshed = 0
+        
+        for mood in MOOD_LABELS.values():
+            if spotify_client is None or not track_pools.needs_refresh(mood, market):
+                continue
+            try:
+                tracks = await fetch_spotify_track_pool(mood, market, TRACK_POOL_SIZE)
+                track_pools.update(mood, market, tracks)
+                refreshed += 1
+            except Exception as e:
+                logger.error(f"Error refreshing track pool for mood '{mood}': {e}")
+        
+        if refreshed:
+            try:
+                await spotify_executor.run(track_pools.save)
+            except Exception as e:
+                logger.warning(f"Could not save track pools to {track_pools.path}: {e}")
+        
+        # Re-check well before pools go stale so one failed refresh is retried soon
+        await asyncio.sleep(min(track_pools.refresh_interval / 4, 900))
+
+@STAGE_SECONDS.timed(stage="spotify_search")
+async def search_spotify_by_mood(mood: str, limit: int = 20) -> List[Dict[str, Any]]:
+    """
+    Get tracks for a mood - sampled from the precomputed track pool when one exists,
+    otherwise from the (cached) Spotify search
+    """
+    try:
+        market = os.getenv("SPOTIFY_MARKET", "US")
+        
+        if TRACK_POOLS_ENABLED:
+            tracks = track_pools.sample(mood, market, limit)
+            if tracks is not None:
+                return tracks
+        
+        return await spotify_search_cache.get(
+            (mood, market, limit),
+            lambda: fetch_spotify_tracks(mood, market, limit)
+        )
         
     except Exception as e:
         logger.error(f"Error searching Spotify: {e}")
@@ -410,87 +2086,561 @@ def create_spotify_playlist_url(tracks: List[Dict[str, Any]], mood: str = None)
         logger.error(f"Error creating playlist URL: {e}")
         return f"https://open.spotify.com/search/mood%20music"
 
-def create_actual_spotify_playlist(tracks: List[Dict[str, Any]], mood: str) -> str:
+class PlaylistRegistry:
+    """
+    Playlists created per (user, mood, track-set hash), stored in SQLite (WAL mode) so
+    all uvicorn workers share them, with an in-memory read-through cache in front.
+    A worker claims a key before creating its playlist; others wait for the claim
+    to complete instead of creating a duplicate.
+    """
+
+    # A claim older than this is treated as abandoned (its worker died mid-creation)
+    CLAIM_TIMEOUT = 60.0
+
+    def __init__(self, path: str, cache_ttl: float):
+        self.path = path
+        self.cache_ttl = cache_ttl
+        self._cache: Dict[tuple, tuple] = {}  # {key: (url, cached_at)}
+        self._local = threading.local()
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+
+    @staticmethod
+    def track_hash(tracks: List[Dict[str, Any]]) -> str:
+        """Order-independent hash of the track ids, or '*' when reusing per mood"""
+        if PLAYLIST_REUSE != "tracks":
+            return "*"
+        track_ids = sorted({track['id'] for track in tracks if track.get('id')})
+        return hashlib.sha1(",".join(track_ids).encode()).hexdigest()
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread; sqlite3 connections are not shared across threads"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with self._schema_lock:
+                if not self._schema_ready:
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS playlists ("
+                        " user_id TEXT NOT NULL, mood TEXT NOT NULL, track_hash TEXT NOT NULL,"
+                        " playlist_id TEXT, url TEXT, claimed_at REAL, created_at REAL,"
+                        " PRIMARY KEY (user_id, mood, track_hash))"
+                    )
+                    conn.execute("CREATE INDEX IF NOT EXISTS playlists_by_id ON playlists (playlist_id)")
+                    self._schema_ready = True
+            self._local.conn = conn
+        return conn
+
+    def cached(self, key: tuple) -> Optional[str]:
+        entry = self._cache.get(key)
+        if entry and time.time() - entry[1] < self.cache_ttl:
+            self.hits += 1
+            return entry[0]
+        return None
+
+    def lookup(self, key: tuple) -> Optional[str]:
+        """URL of the playlist recorded for key, if creation has completed"""
+        row = self._connection().execute(
+            "SELECT url FROM playlists WHERE user_id = ? AND mood = ? AND track_hash = ? AND url IS NOT NULL",
+            key
+        ).fetchone()
+        if row:
+            self.hits += 1
+            self._cache[key] = (row[0], time.time())
+            return row[0]
+        self.misses += 1
+        return None
+
+    def claim(self, key: tuple) -> bool:
+        """True if this caller should create the playlist for key"""
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT url, claimed_at FROM playlists WHERE user_id = ? AND mood = ? AND track_hash = ?",
+                key
+            ).fetchone()
+            if row is None:
+                conn.execute(
+                    "INSERT INTO playlists (user_id, mood, track_hash, claimed_at) VALUES (?, ?, ?, ?)",
+                    (*key, now)
+                )
+                claimed = True
+            elif row[0] is None and now - (row[1] or 0) > self.CLAIM_TIMEOUT:
+                conn.execute(
+                    "UPDATE playlists SET claimed_at = ? WHERE user_id = ? AND mood = ? AND track_hash = ?",
+                    (now, *key)
+                )
+                claimed = True
+            else:
+                claimed = False
+            conn.execute("COMMIT")
+            return claimed
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def complete(self, key: tuple, playlist_id: str, url: str):
+        self._connection().execute(
+            "UPDATE playlists SET playlist_id = ?, url = ?, created_at = ? "
+            "WHERE user_id = ? AND mood = ? AND track_hash = ?",
+            (playlist_id, url, time.time(), *key)
+        )
+        self._cache[key] = (url, time.time())
+        self.created += 1
+
+    def release(self, key: tuple):
+        """Drop an unfinished claim so another request can retry creation"""
+        self._connection().execute(
+            "DELETE FROM playlists WHERE user_id = ? AND mood = ? AND track_hash = ? AND url IS NULL",
+            key
+        )
+
+    def remove_playlists(self, playlist_ids: List[str]):
+        """Forget playlists that were deleted from Spotify"""
+        if not playlist_ids:
+            return
+        conn = self._connection()
+        conn.executemany("DELETE FROM playlists WHERE playlist_id = ?", [(pid,) for pid in playlist_ids])
+        self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "reuse": PLAYLIST_REUSE,
+            "cached": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "created": self.created
+        }
+
+playlist_registry = PlaylistRegistry(PLAYLIST_REGISTRY_PATH, PLAYLIST_REGISTRY_CACHE_TTL)
+
+async def wait_for_registered_playlist(key: tuple, timeout: float = 15.0) -> Optional[str]:
+    """Poll for a playlist another worker is creating"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.25)
+        url = await spotify_executor.run(playlist_registry.lookup, key)
+        if url:
+            return url
+    return None
+
+async def create_actual_spotify_playlist(tracks: List[Dict[str, Any]], mood: str) -> str:
     """Create an actual Spotify playlist with tracks using backend authentication"""
     try:
         if not tracks:
             return None
             
-        # Check if we already created a playlist for this mood
-        if mood in created_playlists:
-            logger.info(f"✅ Reusing existing playlist for mood '{mood}': {created_playlists[mood]}")
-            return created_playlists[mood]
-            
-        # Get authenticated Spotify client
-        sp = get_authenticated_spotify_client()
-        if not sp:
+        # Get authenticated user token
+        token = await get_spotify_user_token()
+        if not token:
             logger.info("No authenticated Spotify client - no playlist created")
-            return None
-            
-        # Get user info
-        user_info = sp.current_user()
-        user_id = user_info['id']
-        
-        # Create playlist
-        playlist_name = f"kaguya {mood.lower()} mood"
-        playlist_description = f"curated {mood.lower()} playlist generated by kaguya ai mood detection"
-        
-        playlist = sp.user_playlist_create(
-            user=user_id,
-            name=playlist_name,
-            public=True,
-            description=playlist_description
-        )
-        
-        # Get track URIs (ensure no duplicates)
-        track_uris = []
-        seen_uris = set()
-        for track in tracks[:50]:  # Spotify allows max 100 tracks per request, we'll use 50
-            if track.get('id'):
-                track_uri = f"spotify:track:{track['id']}"
-                if track_uri not in seen_uris:
-                    track_uris.append(track_uri)
-                    seen_uris.add(track_uri)
-        
-        # Add tracks to playlist
-        if track_uris:
-            sp.playlist_add_items(playlist['id'], track_uris)
+            return None
+            
+        # User profile is cached by the session
+        user_id = spotify_session.user['id']
         
-        playlist_url = playlist['external_urls']['spotify']
+        # Reuse a playlist any worker already created for this user and mood (or track set)
+        key = (user_id, mood.lower(), PlaylistRegistry.track_hash(tracks))
+        playlist_url = playlist_registry.cached(key) or await spotify_executor.run(playlist_registry.lookup, key)
+        if playlist_url:
+            logger.info(f"✅ Reusing existing playlist for mood '{mood}': {playlist_url}")
+            return playlist_url
         
-        # Store the playlist URL to avoid duplicates
-        created_playlists[mood] = playlist_url
+        if not await spotify_executor.run(playlist_registry.claim, key):
+            # Another request is creating it right now
+            return await wait_for_registered_playlist(key)
         
-        logger.info(f"✅ Created public Spotify playlist: {playlist['name']} with {len(track_uris)} tracks")
-        return playlist_url
+        try:
+            return await create_registered_playlist(token, user_id, key, tracks, mood)
+        except Exception:
+            await spotify_executor.run(playlist_registry.release, key)
+            raise
         
     except Exception as e:
         logger.error(f"Error creating Spotify playlist: {e}")
+        handle_spotify_auth_error(e)
         # Don't return search URLs - only real playlists
         return None
 
+@STAGE_SECONDS.timed(stage="playlist_create")
+async def create_registered_playlist(token: str, user_id: str, key: tuple,
+                                     tracks: List[Dict[str, Any]], mood: str) -> str:
+    """Create the playlist on Spotify and record it under the claimed key"""
+    # Create playlist
+    playlist_name = f"kaguya {mood.lower()} mood"
+    # The creation date lets cleanup filter by age (Spotify does not expose it)
+    created_on = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    playlist_description = f"curated {mood.lower()} playlist generated by kaguya ai mood detection on {created_on}"
+    
+    playlist = await spotify_client.create_playlist(
+        token,
+        user_id,
+        name=playlist_name,
+        public=True,
+        description=playlist_description
+    )
+    
+    # Get track URIs (ensure no duplicates)
+    track_uris = []
+    seen_uris = set()
+    for track in tracks[:50]:  # Spotify allows max 100 tracks per request, we'll use 50
+        if track.get('id'):
+            track_uri = f"spotify:track:{track['id']}"
+            if track_uri not in seen_uris:
+                track_uris.append(track_uri)
+                seen_uris.add(track_uri)
+    
+    # Add tracks to playlist
+    if track_uris:
+        await spotify_client.add_playlist_items(token, playlist['id'], track_uris)
+    
+    playlist_url = playlist['external_urls']['spotify']
+    
+    # Record the playlist so every worker reuses it
+    await spotify_executor.run(playlist_registry.complete, key, playlist['id'], playlist_url)
+    
+    logger.info(f"✅ Created public Spotify playlist: {playlist['name']} with {len(track_uris)} tracks")
+    return playlist_url
+
+def start_playlist_job(tracks: List[Dict[str, Any]], mood: str, on_ready=None) -> BackgroundJob:
+    """
+    Create the playlist in a background job; poll GET /playlist-jobs/{job_id} or pass
+    on_ready(job, result) to be called with {"mood", "playlist_url"} once it is done
+    """
+    async def run(job: BackgroundJob) -> Dict[str, Any]:
+        job.progress["mood"] = mood
+        playlist_url = await create_actual_spotify_playlist(tracks, mood)
+        result = {"mood": mood, "playlist_url": playlist_url}
+        if on_ready:
+            await on_ready(job, result)
+        return result
+
+    return background_jobs.start("playlist", run)
+
+# ==============================
+# Playlist Cleanup
+# ==============================
+
+KAGUYA_PLAYLIST_NAME = re.compile(r"^kaguya\s+(\w+)\s+mood", re.IGNORECASE)
+PLAYLIST_CREATED_ON = re.compile(r"on (\d{4}-\d{2}-\d{2})")
+
+async def fetch_all_user_playlists(token: str, progress: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Fetch the first page to learn the total, then the remaining pages concurrently"""
+    limit = 50
+    first_page = await spotify_client.current_user_playlists(token, limit, 0)
+    total = first_page.get('total', len(first_page['items']))
+    if progress is not None:
+        progress["total_playlists"] = total
+
+    semaphore = asyncio.Semaphore(CLEANUP_CONCURRENCY)
+
+    async def fetch_page(offset: int) -> List[Dict[str, Any]]:
+        async with semaphore:
+            page = await spotify_client.current_user_playlists(token, limit, offset)
+            return page['items']
+
+    pages = await asyncio.gather(*(fetch_page(offset) for offset in range(limit, total, limit)))
+    playlists = list(first_page['items'])
+    for items in pages:
+        playlists.extend(items)
+    # Spotify returns null entries for playlists it can no longer resolve
+    return [playlist for playlist in playlists if playlist]
+
+def playlist_age_days(playlist: Dict[str, Any]) -> Optional[float]:
+    """Age from the date kaguya stamps into the description, None if it has none"""
+    match = PLAYLIST_CREATED_ON.search(playlist.get('description') or "")
+    if not match:
+        return None
+    created = datetime.strptime(match.group(1), "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - created).total_seconds() / 86400
+
+def select_kaguya_playlists(playlists: List[Dict[str, Any]], moods: Optional[List[str]] = None,
+                            min_age_days: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    Kaguya playlists matching the filters. Playlists created before dates were
+    stamped into descriptions count as older than any age cutoff.
+    """
+    wanted_moods = {mood.lower() for mood in moods} if moods else None
+    selected = []
+    for playlist in playlists:
+        name = playlist.get('name') or ""
+        if not name.lower().startswith('kaguya'):
+            continue
+        if wanted_moods is not None:
+            match = KAGUYA_PLAYLIST_NAME.match(name)
+            if not match or match.group(1).lower() not in wanted_moods:
+                continue
+        if min_age_days is not None:
+            age = playlist_age_days(playlist)
+            if age is not None and age < min_age_days:
+                continue
+        selected.append(playlist)
+    return selected
+
+async def cleanup_playlists(token: str, moods: Optional[List[str]] = None,
+                            min_age_days: Optional[float] = None,
+                            progress: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Unfollow (delete) kaguya playlists with bounded concurrency. Rate limits are
+    retried by the client; playlists that still fail are reported, not raised.
+    """
+    if progress is None:
+        progress = {}
+    progress.update({"phase": "listing", "matched": 0, "deleted": 0, "failed": 0})
+
+    playlists = await fetch_all_user_playlists(token, progress)
+    kaguya_playlists = select_kaguya_playlists(playlists, moods, min_age_days)
+    progress.update({"phase": "deleting", "matched": len(kaguya_playlists)})
+
+    semaphore = asyncio.Semaphore(CLEANUP_CONCURRENCY)
+    deleted_playlists = []
+    failed_playlists = []
+
+    async def delete(playlist: Dict[str, Any]):
+        async with semaphore:
+            try:
+                await spotify_client.unfollow_playlist(token, playlist['id'])
+            except SpotifyAPIError as e:
+                logger.error(f"Failed to delete playlist {playlist['name']}: {e}")
+                handle_spotify_auth_error(e)
+                failed_playlists.append({"name": playlist['name'], "id": playlist['id'], "error": str(e)})
+                progress["failed"] += 1
+                return
+        deleted_playlists.append({
+            "name": playlist['name'],
+            "id": playlist['id'],
+            "url": playlist['external_urls']['spotify']
+        })
+        progress["deleted"] += 1
+        logger.info(f"🗑️ Deleted playlist: {playlist['name']}")
+
+    await asyncio.gather(*(delete(playlist) for playlist in kaguya_playlists))
+    progress["phase"] = "done"
+
+    # Stop reusing playlists that no longer exist
+    await spotify_executor.run(playlist_registry.remove_playlists, [playlist['id'] for playlist in deleted_playlists])
+
+    logger.info(f"🧹 Cleanup complete: deleted {len(deleted_playlists)} kaguya playlists")
+
+    if not kaguya_playlists:
+        message = "No kaguya playlists found to delete"
+    else:
+        message = f"Successfully deleted {len(deleted_playlists)} kaguya playlists"
+
+    return {
+        "status": "success",
+        "message": message,
+        "deleted_count": len(deleted_playlists),
+        "deleted_playlists": deleted_playlists,
+        "failed_count": len(failed_playlists),
+        "failed_playlists": failed_playlists
+    }
+
+# ==============================
+# Batch Scoring
+# ==============================
+
+BATCH_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+def is_batch_image(name: str) -> bool:
+    return name.lower().endswith(BATCH_IMAGE_EXTENSIONS)
+
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+def upload_image_sources(files: List[UploadFile], archives: List[zipfile.ZipFile]) -> List[tuple]:
+    """
+    (name, size, load) for every uploaded image, expanding zip archives in place.
+    Opened archives are appended to `archives` so the caller can close them.
+    Raises: HTTPException(400) for a corrupt archive
+    """
+    sources = []
+    for upload in files:
+        filename = upload.filename or "upload"
+        if not filename.lower().endswith(".zip") and upload.content_type not in ("application/zip", "application/x-zip-compressed"):
+            sources.append((filename, upload.size, upload.file.read))
+            continue
+        
+        try:
+            archive = zipfile.ZipFile(upload.file)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail=f"{filename} is not a valid zip archive")
+        archives.append(archive)
+        for info in archive.infolist():
+            if not info.is_dir() and is_batch_image(info.filename):
+                sources.append((f"{filename}/{info.filename}", info.file_size, functools.partial(archive.read, info)))
+    return sources
+
+def resolve_batch_path(relative_path: str) -> str:
+    """
+    Resolve a path given by a client for a local job, which must stay inside BATCH_ROOT
+    Raises: HTTPException(403) when local input is disabled or the path leads outside the root
+    """
+    if not BATCH_ROOT:
+        raise HTTPException(status_code=403, detail="Local file input is disabled - set KAGUYA_BATCH_ROOT")
+    
+    root = os.path.realpath(BATCH_ROOT)
+    path = os.path.realpath(os.path.join(root, relative_path))
+    if os.path.commonpath([root, path]) != root:
+        raise HTTPException(status_code=403, detail="Path must be inside KAGUYA_BATCH_ROOT")
+    return path
+
+def directory_image_sources(directory: str) -> List[tuple]:
+    """
+    (name, size, load) for every image below a directory inside BATCH_ROOT, in sorted order.
+    Names are relative to BATCH_ROOT.
+    """
+    root = os.path.realpath(BATCH_ROOT)
+    path = resolve_batch_path(directory)
+    if not os.path.isdir(path):
+        raise HTTPException(status_code=404, detail=f"Directory not found: {directory}")
+    
+    sources = []
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            file_path = os.path.join(dirpath, filename)
+            # Symlinked files must not lead out of the root either
+            if not is_batch_image(filename) or os.path.commonpath([root, os.path.realpath(file_path)]) != root:
+                continue
+            sources.append((os.path.relpath(file_path, root), os.path.getsize(file_path), functools.partial(read_file, file_path)))
+    return sources
+
+async def score_batch_image(name: str, size: Optional[int], load) -> Dict[str, Any]:
+    """
+    Score every face in one image; failures are reported in the result (with the HTTP
+    status the image would have got on its own) instead of raised
+    """
+    if size is not None and size > BATCH_MAX_IMAGE_BYTES:
+        return {"name": name, "status": 413, "error": f"Image too large ({size} bytes, limit {BATCH_MAX_IMAGE_BYTES})"}
+    
+    try:
+        image_data = await asyncio.to_thread(load)
+        result = await detect_group_mood_async(extract_all_faces_from_bytes, image_data)
+    except HTTPException as e:
+        return {"name": name, "status": e.status_code, "error": e.detail}
+    except Exception as e:
+        logger.warning(f"Failed to score {name}: {e}")
+        return {"name": name, "status": 500, "error": "Failed to score image"}
+    
+    if result is None:
+        return {"name": name, "face_count": 0, "faces": []}
+    return {"name": name, **result}
+
+def inference_queue_full() -> bool:
+    return process_pool.full if process_pool is not None else inference_executor.full
+
+async def stream_batch_scores(sources: List[tuple], archives: List[zipfile.ZipFile]):
+    """
+    Yield one NDJSON line per image, in input order, with up to BATCH_CONCURRENCY images in
+    flight so decoding runs in parallel and faces from different images share model batches.
+    No new image is started while the inference queue is full; one that is still turned
+    away by other traffic is reported with status 503 for the client to resubmit.
+    Ends with a summary line.
+    """
+    started = time.perf_counter()
+    sources = iter(sources)
+    pending = deque()
+    totals = {"images": 0, "face_count": 0, "errors": 0, "busy": 0}
+    
+    try:
+        while True:
+            while len(pending) < BATCH_CONCURRENCY and not (pending and inference_queue_full()):
+                source = next(sources, None)
+                if source is None:
+                    break
+                pending.append(asyncio.create_task(score_batch_image(*source)))
+            if not pending:
+                break
+            
+            result = await pending.popleft()
+            totals["images"] += 1
+            totals["face_count"] += result.get("face_count", 0)
+            totals["errors"] += "error" in result
+            totals["busy"] += result.get("status") == 503
+            yield json.dumps(result) + "\n"
+        
+        yield json.dumps({"done": True, **totals, "seconds": round(time.perf_counter() - started, 3)}) + "\n"
+    finally:
+        # Client went away or the stream finished - stop outstanding work and release the archives
+        for task in pending:
+            task.cancel()
+        for archive in archives:
+            archive.close()
+
 # ==============================
 # API Endpoints
 # ==============================
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize models and services on startup"""
+    """
+    Start serving right away; the model (with TensorFlow) and Spotify are set up in
+    background tasks, and /health reports when the instance is ready
+    """
+    global model_task, spotify_task
     logger.info("🚀 Starting Kaguya Music Mood API...")
     
-    # Load mood detection model
-    if not load_mood_model():
-        logger.error("Failed to load mood model - mood detection will not work")
+    # Load the face cascade, import TensorFlow and load and warm up the model
+    model_task = asyncio.create_task(load_models_in_background())
     
-    # Load face cascade
-    if not load_face_cascade():
-        logger.error("Failed to load face cascade - face detection will not work")
+    # Initialize Spotify, then keep the track pools fresh
+    spotify_task = asyncio.create_task(start_spotify_in_background())
     
-    # Initialize Spotify
-    if not initialize_spotify():
-        logger.error("Failed to initialize Spotify - music recommendations will not work")
+    # Start collecting faces for batched inference
+    mood_batcher.start()
+    
+    # Serve recommendations from saved track pools as soon as Spotify is up
+    if TRACK_POOLS_ENABLED:
+        track_pools.load()
     
-    logger.info("✅ Startup complete!")
+    logger.info("✅ Server up - models and Spotify loading in the background")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background tasks and release executor threads on shutdown"""
+    for task in (track_pool_task, model_task, spotify_task):
+        if task:
+            task.cancel()
+    background_jobs.cancel_all()
+    await mood_batcher.stop()
+    if process_pool:
+        process_pool.shutdown()
+    if spotify_client:
+        await spotify_client.aclose()
+    inference_executor.shutdown()
+    spotify_executor.shutdown()
+
+@app.middleware("http")
+async def record_request_latency(request, call_next):
+    """Observe request latency per route template (not per raw path, to bound label cardinality)"""
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=route.path if route else "unmatched",
+            status=status
+        )
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus text-format metrics: per-stage latency histograms, counters and queue gauges"""
+    return Response(content=metrics_registry.render(), media_type=metrics.CONTENT_TYPE)
 
 @app.get("/")
 async def root():
@@ -500,40 +2650,89 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "health": "/health",
+            "ready": "/ready",
             "detect_mood": "/detect-mood",
+            "detect_group_mood": "/detect-group-mood",
+            "detect_mood_batch": "/detect-mood/batch",
             "get_playlist": "/playlist/{mood}",
             "mood_and_playlist": "/mood-and-playlist",
+            "playlist_job": "/playlist-jobs/{job_id}",
             "spotify_setup": "/spotify-setup",
             "spotify_auth_url": "/spotify-auth-url", 
             "spotify_callback": "/callback",
             "spotify_token": "/spotify-token",
-            "cleanup": "/cleanup"
+            "cleanup": "/cleanup",
+            "cleanup_job": "/cleanup/{job_id}",
+            "video_timeline": "/video-timeline",
+            "video_timeline_job": "/video-timeline/{job_id}",
+            "inference_stats": "/inference-stats",
+            "cache_stats": "/cache-stats",
+            "metrics": "/metrics"
         }
     }
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
+    """
+    Liveness check - answers as soon as the server is up, even while the model loads.
+    Restart on this failing; route traffic on /ready.
+    """
     return {
         "status": "healthy",
-        "mood_model_loaded": mood_model is not None,
-        "face_cascade_loaded": face_cascade is not None,
+        "ready": is_ready(),
+        "model_status": model_status["phase"],
+        # In process mode the models live in the workers, which report readiness to the pool
+        "mood_model_loaded": process_pool.ready.is_set() if process_pool is not None else mood_model is not None,
+        "face_cascade_loaded": process_pool.ready.is_set() if process_pool is not None else face_cascade is not None,
         "spotify_search_available": spotify_client is not None,
-        "spotify_playlist_creation": get_authenticated_spotify_client() is not None
+        "spotify_playlist_creation": spotify_session.is_authenticated()
+    }
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness check - 503 until the model is loaded and warmed up, so load balancers skip cold replicas"""
+    status = {
+        "ready": is_ready(),
+        "model_status": model_status["phase"],
+        "warmup_batch_sizes": WARMUP_BATCH_SIZES,
+        "startup_seconds": (
+            model_status["ready_at"] - model_status["started_at"] if model_status["ready_at"] else None
+        )
+    }
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+@app.get("/inference-stats")
+async def inference_stats():
+    """Executor load and achieved batch sizes, for tuning throughput vs. latency"""
+    return {
+        "executors": {
+            "inference": inference_executor.stats(),
+            "spotify": spotify_executor.stats()
+        },
+        "batching": mood_batcher.stats(),
+        "tracking": FaceTracker.stats(),
+        "smoothing": MoodSession.stats(),
+        "processes": process_pool.stats() if process_pool else None
+    }
+
+@app.get("/cache-stats")
+async def cache_stats():
+    """Hit/miss metrics for the Spotify search cache, track pools, playlist registry and mood caches"""
+    return {
+        "spotify_search": spotify_search_cache.stats(),
+        "track_pools": track_pools.stats(),
+        "playlist_registry": playlist_registry.stats(),
+        **{f"{cache.name}_mood": cache.stats() for cache in mood_caches}
     }
 
 @app.post("/detect-mood", response_model=MoodDetectionResponse)
 async def detect_mood(request: MoodDetectionRequest):
     """Detect mood from base64 encoded image"""
     try:
-        if mood_model is None or face_cascade is None:
-            raise HTTPException(status_code=503, detail="Mood detection models not loaded")
+        require_mood_models()
         
-        # Convert base64 to image
-        image_array = base64_to_image(request.image_base64)
-        
-        # Detect mood
-        mood, confidence = detect_mood_from_image(image_array)
+        # Decode and detect mood off the event loop
+        mood, confidence = await detect_mood_async(extract_face_from_base64, request.image_base64)
         
         if mood is None:
             raise HTTPException(status_code=400, detail="No face detected in image")
@@ -549,6 +2748,30 @@ async def detect_mood(request: MoodDetectionRequest):
         logger.error(f"Error in mood detection endpoint: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@app.post("/detect-group-mood", response_model=GroupMoodResponse)
+async def detect_group_mood(request: MoodDetectionRequest, include_playlist: bool = False, limit: int = 20):
+    """Detect the mood of every face in an image and aggregate them into a room mood"""
+    try:
+        require_mood_models()
+        
+        # Decode, detect and classify all faces off the event loop
+        result = await detect_group_mood_async(extract_all_faces_from_base64, request.image_base64)
+        
+        if result is None:
+            raise HTTPException(status_code=400, detail="No face detected in image")
+        
+        # Optionally get recommendations for the room mood
+        if include_playlist and spotify_client is not None:
+            result["recommendations"] = await search_spotify_by_mood(result["room_mood"], limit)
+        
+        return GroupMoodResponse(**result)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in group mood detection endpoint: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 @app.get("/playlist/{mood}", response_model=PlaylistResponse)
 async def get_playlist_by_mood(mood: str, limit: int = 20):
     """Get Spotify playlist recommendations based on mood"""
@@ -561,13 +2784,13 @@ async def get_playlist_by_mood(mood: str, limit: int = 20):
             raise HTTPException(status_code=400, detail=f"Invalid mood. Valid moods: {list(MOOD_LABELS.values())}")
         
         # Search for tracks
-        tracks = search_spotify_by_mood(mood, limit)
+        tracks = await search_spotify_by_mood(mood, limit)
         
         if not tracks:
             raise HTTPException(status_code=404, detail=f"No tracks found for mood: {mood}")
         
         # Try to create actual playlist - only return real playlist URLs
-        playlist_url = create_actual_spotify_playlist(tracks, mood)
+        playlist_url = await create_actual_spotify_playlist(tracks, mood)
         if playlist_url:
             logger.info(f"✅ Real playlist created: {playlist_url}")
         else:
@@ -586,31 +2809,38 @@ async def get_playlist_by_mood(mood: str, limit: int = 20):
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @app.post("/mood-and-playlist", response_model=MoodDetectionResponse)
-async def detect_mood_and_get_playlist(request: MoodDetectionRequest, limit: int = 20):
-    """Detect mood from image and return Spotify playlist recommendations"""
+async def detect_mood_and_get_playlist(request: MoodDetectionRequest, limit: int = 20,
+                                       async_playlist: Optional[bool] = None):
+    """
+    Detect mood from image and return Spotify playlist recommendations.
+    With async_playlist the response does not wait for playlist creation; it carries
+    a playlist_job_id to poll at GET /playlist-jobs/{job_id} instead.
+    """
     try:
-        if mood_model is None or face_cascade is None:
-            raise HTTPException(status_code=503, detail="Mood detection models not loaded")
+        require_mood_models()
         
         if spotify_client is None:
             raise HTTPException(status_code=503, detail="Spotify client not initialized")
         
-        # Convert base64 to image
-        image_array = base64_to_image(request.image_base64)
-        
-        # Detect mood
-        mood, confidence = detect_mood_from_image(image_array)
+        # Decode and detect mood off the event loop
+        mood, confidence = await detect_mood_async(extract_face_from_base64, request.image_base64)
         
         if mood is None:
             raise HTTPException(status_code=400, detail="No face detected in image")
         
         # Get playlist recommendations
-        tracks = search_spotify_by_mood(mood, limit)
+        tracks = await search_spotify_by_mood(mood, limit)
+        
+        if async_playlist is None:
+            async_playlist = ASYNC_PLAYLISTS
         
         # Try to create actual playlist - only return real playlist URLs
         playlist_url = None
-        if tracks:
-            playlist_url = create_actual_spotify_playlist(tracks, mood)
+        playlist_job_id = None
+        if tracks and async_playlist:
+            playlist_job_id = start_playlist_job(tracks, mood).id
+        elif tracks:
+            playlist_url = await create_actual_spotify_playlist(tracks, mood)
             if playlist_url:
                 logger.info(f"✅ Real playlist created and will be shown in QR code: {playlist_url}")
             else:
@@ -622,6 +2852,7 @@ async def detect_mood_and_get_playlist(request: MoodDetectionRequest, limit: int
             mood=mood,
             confidence=confidence,
             playlist_url=playlist_url,
+            playlist_job_id=playlist_job_id,
             recommendations=tracks or []
         )
         
@@ -631,6 +2862,14 @@ async def detect_mood_and_get_playlist(request: MoodDetectionRequest, limit: int
         logger.error(f"Error in mood and playlist endpoint: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@app.get("/playlist-jobs/{job_id}")
+async def get_playlist_job(job_id: str):
+    """Status of a background playlist creation; result.playlist_url is set once completed"""
+    job = background_jobs.get(job_id, kind="playlist")
+    if job is None:
+        raise HTTPException(status_code=404, detail="Playlist job not found")
+    return job.to_dict()
+
 @app.get("/spotify-setup")
 async def spotify_setup_info():
     """Get information about Spotify setup status"""
@@ -639,15 +2878,10 @@ async def spotify_setup_info():
         client_secret = os.getenv("SPOTIFY_CLIENT_SECRET")
         has_credentials = bool(client_id and client_secret)
         
-        auth_client = get_authenticated_spotify_client()
-        is_authenticated = auth_client is not None
+        is_authenticated = await get_spotify_user_token() is not None
         
-        user_info = None
-        if is_authenticated:
-            try:
-                user_info = auth_client.current_user()
-            except:
-                is_authenticated = False
+        # Profile was fetched once when the session validated its token
+        user_info = spotify_session.user if is_authenticated else None
         
         status_message = ""
         if is_authenticated:
@@ -755,16 +2989,21 @@ async def set_spotify_token(code: str):
         if not spotify_oauth:
             raise HTTPException(status_code=503, detail="Spotify OAuth not configured")
         
+        # Already imported by initialize_spotify, which created spotify_oauth
+        from spotipy import SpotifyException
+        
         try:
             # Get access token
-            token_info = spotify_oauth.get_access_token(code, as_dict=True)
+            token_info = await spotify_executor.run(spotify_oauth.get_access_token, code, True)
             
             if not token_info:
                 raise HTTPException(status_code=400, detail="Failed to get access token - check if code is correct")
             
-            # Test the token by getting user info
-            sp = spotipy.Spotify(auth=token_info['access_token'])
-            user_info = sp.current_user()
+            # Hand the token to the shared session, which validates it by fetching the profile
+            spotify_session.set_token(token_info)
+            if await get_spotify_user_token() is None:
+                raise HTTPException(status_code=400, detail="Spotify rejected the new access token")
+            user_info = spotify_session.user
             
             logger.info(f"✅ Spotify token successfully set for user: {user_info.get('display_name', user_info.get('id'))}")
             
@@ -779,7 +3018,7 @@ async def set_spotify_token(code: str):
                 "expires_in": token_info.get("expires_in")
             }
             
-        except spotipy.SpotifyException as e:
+        except SpotifyException as e:
             logger.error(f"Spotify API error: {e}")
             if "invalid_grant" in str(e):
                 raise HTTPException(status_code=400, detail="Invalid or expired authorization code")
@@ -792,78 +3031,49 @@ async def set_spotify_token(code: str):
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @app.post("/cleanup")
-async def cleanup_kaguya_playlists():
-    """Delete all kaguya playlists from Spotify account"""
+async def cleanup_kaguya_playlists(mood: Optional[str] = None, min_age_days: Optional[float] = None,
+                                   background: bool = False):
+    """
+    Delete kaguya playlists from the Spotify account.
+    mood: comma-separated moods to limit the cleanup to
+    min_age_days: only delete playlists at least this old
+    background: return a job id immediately and poll GET /cleanup/{job_id}
+    """
     try:
-        # Get authenticated Spotify client
-        sp = get_authenticated_spotify_client()
-        if not sp:
+        # Get authenticated user token
+        token = await get_spotify_user_token()
+        if not token:
             raise HTTPException(status_code=503, detail="No authenticated Spotify client available")
-        
-        # Get user info
-        user_info = sp.current_user()
-        user_id = user_info['id']
-        
-        # Get all user playlists
-        playlists = []
-        offset = 0
-        limit = 50
-        
-        while True:
-            user_playlists = sp.current_user_playlists(limit=limit, offset=offset)
-            playlists.extend(user_playlists['items'])
-            
-            if len(user_playlists['items']) < limit:
-                break
-            offset += limit
-        
-        # Filter kaguya playlists
-        kaguya_playlists = []
-        for playlist in playlists:
-            if playlist['name'].lower().startswith('kaguya'):
-                kaguya_playlists.append(playlist)
-        
-        if not kaguya_playlists:
-            return {
-                "status": "success",
-                "message": "No kaguya playlists found to delete",
-                "deleted_count": 0,
-                "deleted_playlists": []
-            }
-        
-        # Delete each kaguya playlist
-        deleted_playlists = []
-        for playlist in kaguya_playlists:
-            try:
-                sp.user_playlist_unfollow(user_id, playlist['id'])
-                deleted_playlists.append({
-                    "name": playlist['name'],
-                    "id": playlist['id'],
-                    "url": playlist['external_urls']['spotify']
-                })
-                logger.info(f"🗑️ Deleted playlist: {playlist['name']}")
-            except Exception as e:
-                logger.error(f"Failed to delete playlist {playlist['name']}: {e}")
-        
-        # Clear the stored playlist URLs
-        global created_playlists
-        created_playlists.clear()
-        
-        logger.info(f"🧹 Cleanup complete: deleted {len(deleted_playlists)} kaguya playlists")
-        
-        return {
-            "status": "success",
-            "message": f"Successfully deleted {len(deleted_playlists)} kaguya playlists",
-            "deleted_count": len(deleted_playlists),
-            "deleted_playlists": deleted_playlists
-        }
-        
+
+        moods = [item.strip() for item in mood.split(",") if item.strip()] if mood else None
+
+        if background:
+            async def run(job: BackgroundJob) -> Dict[str, Any]:
+                return await cleanup_playlists(token, moods, min_age_days, job.progress)
+
+            job = background_jobs.start("cleanup", run)
+            return JSONResponse(
+                status_code=202,
+                content={"job_id": job.id, "status": job.status, "status_url": f"/cleanup/{job.id}"}
+            )
+
+        return await cleanup_playlists(token, moods, min_age_days)
+
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error during cleanup: {e}")
+        handle_spotify_auth_error(e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@app.get("/cleanup/{job_id}")
+async def get_cleanup_job(job_id: str):
+    """Progress and result of a background cleanup job"""
+    job = background_jobs.get(job_id, kind="cleanup")
+    if job is None:
+        raise HTTPException(status_code=404, detail="Cleanup job not found")
+    return job.to_dict()
+
 # ==============================
 # WebSocket for Real-time Video Stream
 # ==============================
@@ -884,53 +3094,319 @@ class ConnectionManager:
 
 manager = ConnectionManager()
 
+class FrameScheduler:
+    """
+    Per-connection latest-frame-wins slot. A frame that arrives while the
+    previous one is still waiting replaces it, so results never lag behind
+    the stream by more than one frame.
+    """
+
+    def __init__(self):
+        self._frame = None
+        self._ready = asyncio.Event()
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self._avg_processing_time: Optional[float] = None
+
+    def submit(self, frame: Dict[str, Any]):
+        self.received += 1
+        if self._frame is not None:
+            self.dropped += 1
+            DROPPED_FRAMES_TOTAL.inc()
+        self._frame = frame
+        self._ready.set()
+
+    async def next_frame(self) -> Dict[str, Any]:
+        await self._ready.wait()
+        self._ready.clear()
+        frame, self._frame = self._frame, None
+        return frame
+
+    def record_processing_time(self, seconds: float):
+        self.processed += 1
+        if self._avg_processing_time is None:
+            self._avg_processing_time = seconds
+        else:
+            self._avg_processing_time = 0.8 * self._avg_processing_time + 0.2 * seconds
+
+    def suggested_fps(self) -> Optional[float]:
+        """Frame rate this connection is currently being served at, clamped to the configured range"""
+        if not WS_ADAPTIVE_FPS or not self._avg_processing_time:
+            return None
+        return round(min(WS_MAX_FPS, max(WS_MIN_FPS, 1.0 / self._avg_processing_time)), 1)
+
+class MoodSession:
+    """
+    Per-connection mood smoothing. Keeps an exponentially weighted average of the
+    probability vectors and applies hysteresis: the reported mood only switches once
+    another mood has led the average by `margin` for `min_frames` frames in a row, so
+    single-frame flicker neither changes the mood nor triggers new recommendations.
+    """
+
+    # Totals across all sessions, reported by /inference-stats
+    totals = {"frames": 0, "mood_changes": 0}
+
+    def __init__(self, alpha: float = WS_SMOOTHING_ALPHA, margin: float = WS_SMOOTHING_MARGIN,
+                 min_frames: int = WS_SMOOTHING_MIN_FRAMES,
+                 max_missed_frames: int = WS_SMOOTHING_MAX_MISSED_FRAMES):
+        self.alpha = alpha
+        self.margin = margin
+        self.min_frames = max(1, min_frames)
+        self.max_missed_frames = max(1, max_missed_frames)
+        self.average: Optional[np.ndarray] = None
+        self.mood_index: Optional[int] = None
+        self.candidate: Optional[int] = None
+        self.candidate_frames = 0
+        self.missed_frames = 0
+        # (mood, include_playlist, create_playlist) that tracks were last fetched for
+        self.tracks_fetched_for: Optional[tuple] = None
+
+    @property
+    def mood(self) -> Optional[str]:
+        return MOOD_LABELS.get(self.mood_index) if self.mood_index is not None else None
+
+    @property
+    def confidence(self) -> float:
+        return float(self.average[self.mood_index]) if self.mood_index is not None else 0.0
+
+    def update(self, probabilities: Optional[np.ndarray]) -> bool:
+        """Fold in one frame's probabilities (None = no face); True if the reported mood changed"""
+        MoodSession.totals["frames"] += 1
+        
+        if probabilities is None:
+            self.missed_frames += 1
+            if self.missed_frames < self.max_missed_frames:
+                return False
+            # Nobody in front of the camera any more - start over
+            changed = self.mood_index is not None
+            self.average = self.mood_index = self.candidate = None
+            self.candidate_frames = 0
+            return self._changed() if changed else False
+        
+        self.missed_frames = 0
+        probabilities = np.asarray(probabilities, dtype=np.float64)
+        if self.average is None:
+            self.average = probabilities
+        else:
+            self.average = self.alpha * probabilities + (1.0 - self.alpha) * self.average
+        
+        leader = int(np.argmax(self.average))
+        if self.mood_index is not None and (
+            leader == self.mood_index or self.average[leader] - self.average[self.mood_index] < self.margin
+        ):
+            self.candidate, self.candidate_frames = None, 0
+            return False
+        
+        if leader != self.candidate:
+            self.candidate, self.candidate_frames = leader, 0
+        self.candidate_frames += 1
+        if self.candidate_frames < self.min_frames:
+            return False
+        
+        self.mood_index = leader
+        self.candidate, self.candidate_frames = None, 0
+        return self._changed()
+
+    def _changed(self) -> bool:
+        MoodSession.totals["mood_changes"] += 1
+        MOOD_CHANGES_TOTAL.inc()
+        return True
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        frames = cls.totals["frames"]
+        return {
+            "enabled": WS_SMOOTHING,
+            "alpha": WS_SMOOTHING_ALPHA,
+            "margin": WS_SMOOTHING_MARGIN,
+            "min_frames": WS_SMOOTHING_MIN_FRAMES,
+            **cls.totals,
+            "frames_per_change": frames / cls.totals["mood_changes"] if cls.totals["mood_changes"] else None
+        }
+
+def parse_video_message(message: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Normalize a JSON or binary WebSocket message into a frame description
+    Raises: ValueError for malformed messages
+    """
+    if message.get("bytes") is not None:
+        frame = parse_binary_frame(message["bytes"])
+        return {
+            "image": frame,
+            "binary": True,
+            "timestamp": frame["timestamp"],
+            "include_playlist": bool(frame["flags"] & FRAME_FLAG_INCLUDE_PLAYLIST),
+            "multi_face": bool(frame["flags"] & FRAME_FLAG_MULTI_FACE),
+            "create_playlist": bool(frame["flags"] & FRAME_FLAG_CREATE_PLAYLIST)
+        }
+    
+    try:
+        data = json.loads(message.get("text") or "")
+    except json.JSONDecodeError:
+        raise ValueError("Invalid JSON message")
+    if not isinstance(data, dict) or "image" not in data:
+        raise ValueError("No image data provided")
+    
+    return {
+        "image": data["image"],
+        "binary": False,
+        "timestamp": data.get("timestamp"),
+        "include_playlist": data.get("include_playlist", False),
+        "multi_face": data.get("multi_face", False),
+        "create_playlist": data.get("create_playlist", False)
+    }
+
+async def process_video_frame(frame: Dict[str, Any], tracker: Optional[FaceTracker] = None,
+                              session: Optional[MoodSession] = None) -> Dict[str, Any]:
+    """
+    Run mood detection (and optional recommendations) for one WebSocket frame.
+    With a MoodSession the reported mood is the smoothed one (the frame's own mood
+    until the session has enough history) and recommendations are only fetched
+    when it changes.
+    """
+    if frame["multi_face"]:
+        # Classify every face and report the aggregated room mood
+        extract_func = extract_all_faces_from_binary_frame if frame["binary"] else extract_all_faces_from_base64
+        group = await detect_group_mood_async(extract_func, frame["image"]) or {}
+        mood = group.get("room_mood")
+        response = {
+            "mood": mood,
+            "confidence": group.get("room_confidence", 0.0),
+            "face_count": group.get("face_count", 0),
+            "faces": group.get("faces", []),
+            "mood_distribution": group.get("mood_distribution", {}),
+            "timestamp": frame["timestamp"]
+        }
+        distribution = group.get("mood_distribution")
+        probabilities = np.array([distribution[label] for label in MOOD_LABELS.values()]) if distribution else None
+    else:
+        # Decode and detect mood off the event loop
+        extract_func = extract_face_from_binary_frame if frame["binary"] else extract_face_from_base64
+        probabilities = await detect_mood_probabilities_async(extract_func, frame["image"], tracker)
+        mood, confidence = probabilities_to_mood(probabilities) if probabilities is not None else (None, 0.0)
+        
+        response = {
+            "mood": mood,
+            "confidence": confidence,
+            "timestamp": frame["timestamp"]
+        }
+    
+    fetch_tracks = bool(mood)
+    if session is not None:
+        # Report the smoothed mood; the per-frame result stays available as frame_mood
+        response["mood_changed"] = session.update(probabilities)
+        response["frame_mood"], response["frame_confidence"] = response["mood"], response["confidence"]
+        if session.mood is not None:
+            mood = response["mood"] = session.mood
+            response["confidence"] = session.confidence
+        # Until the session has settled on a mood the frame's own mood is reported
+        tracks_request = (mood, frame["include_playlist"], frame["create_playlist"])
+        fetch_tracks = bool(mood) and tracks_request != session.tracks_fetched_for
+        if fetch_tracks:
+            session.tracks_fetched_for = tracks_request
+    
+    # Optionally get playlist for detected mood
+    if fetch_tracks and (frame["include_playlist"] or frame["create_playlist"]):
+        tracks = await search_spotify_by_mood(mood, 10)
+        if frame["include_playlist"]:
+            response["recommendations"] = tracks[:5]  # Send top 5
+        response["tracks_for_playlist"] = tracks
+    
+    return response
+
 @app.websocket("/ws/video-mood")
 async def websocket_video_mood(websocket: WebSocket):
-    """WebSocket endpoint for real-time mood detection from video stream"""
+    """
+    WebSocket endpoint for real-time mood detection from video stream.
+    Accepts JSON text frames ({"image": <base64>, ...}) or binary frames
+    (FRAME_HEADER followed by encoded image bytes or raw grayscale pixels).
+    """
     await manager.connect(websocket)
     
+    # Frames are received and processed concurrently; stale frames are dropped in between
+    scheduler = FrameScheduler()
+    tracker = FaceTracker()
+    session = MoodSession() if WS_SMOOTHING else None
+    processor = asyncio.create_task(process_video_stream(websocket, scheduler, tracker, session))
+    
     try:
         while True:
-            # Receive base64 image data
-            data = await websocket.receive_json()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
             
-            if "image" not in data:
+            try:
+                frame = parse_video_message(message)
+            except ValueError as e:
                 await manager.send_personal_message(
-                    {"error": "No image data provided"}, 
+                    {"error": str(e)}, 
                     websocket
                 )
                 continue
             
+            scheduler.submit(frame)
+    
+    except WebSocketDisconnect:
+        manager.disconnect(websocket)
+        logger.info(
+            f"Client disconnected from video mood WebSocket "
+            f"({scheduler.processed} frames processed, {scheduler.dropped} dropped, "
+            f"{tracker.skip_ratio():.0%} cascade passes skipped)"
+        )
+    finally:
+        processor.cancel()
+
+async def process_video_stream(websocket: WebSocket, scheduler: FrameScheduler, tracker: FaceTracker,
+                               session: Optional[MoodSession] = None):
+    """Process the most recent frame of a connection whenever the previous one is done"""
+    # One background playlist per mood per connection, pushed as a playlist_ready message
+    playlist_jobs: Dict[str, str] = {}  # {mood: job_id}
+    
+    async def push_playlist(job: BackgroundJob, result: Dict[str, Any]):
+        try:
+            await manager.send_personal_message({"type": "playlist_ready", "job_id": job.id, **result}, websocket)
+        except Exception:
+            # Client went away before the playlist was ready
+            pass
+    
+    while True:
+        frame = await scheduler.next_frame()
+        started = time.perf_counter()
+        
+        try:
+            response = await process_video_frame(frame, tracker, session)
+            tracks = response.pop("tracks_for_playlist", None)
+            mood = response.get("mood")
+            if frame["create_playlist"] and tracks and mood:
+                if mood not in playlist_jobs:
+                    playlist_jobs[mood] = start_playlist_job(tracks, mood, on_ready=push_playlist).id
+                response["playlist_job_id"] = playlist_jobs[mood]
+            scheduler.record_processing_time(time.perf_counter() - started)
+            response["dropped_frames"] = scheduler.dropped
+            suggested_fps = scheduler.suggested_fps()
+            if suggested_fps is not None:
+                response["suggested_fps"] = suggested_fps
+            await manager.send_personal_message(response, websocket)
+            
+        except HTTPException as e:
+            # Queue full or undecodable frame - tell the client and keep the socket open
+            await manager.send_personal_message(
+                {"error": e.detail, "timestamp": frame["timestamp"]}, 
+                websocket
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error processing video frame: {e}")
             try:
-                # Convert base64 to image
-                image_array = base64_to_image(data["image"])
-                
-                # Detect mood
-                mood, confidence = detect_mood_from_image(image_array)
-                
-                response = {
-                    "mood": mood,
-                    "confidence": confidence,
-                    "timestamp": data.get("timestamp")
-                }
-                
-                # Optionally get playlist for detected mood
-                if mood and data.get("include_playlist", False):
-                    tracks = search_spotify_by_mood(mood, limit=10)
-                    response["recommendations"] = tracks[:5]  # Send top 5
-                
-                await manager.send_personal_message(response, websocket)
-                
-            except Exception as e:
-                logger.error(f"Error processing video frame: {e}")
                 await manager.send_personal_message(
                     {"error": "Failed to process frame"}, 
                     websocket
                 )
-    
-    except WebSocketDisconnect:
-        manager.disconnect(websocket)
-        logger.info("Client disconnected from video mood WebSocket")
+            except Exception:
+                # Socket already closed - the receive loop will clean up
+                return
 
 # ==============================
 # Additional Endpoints
@@ -956,24 +3432,13 @@ async def get_available_moods():
 async def upload_image_mood_detection(file: UploadFile = File(...)):
     """Upload image file for mood detection (alternative to base64)"""
     try:
-        if mood_model is None or face_cascade is None:
-            raise HTTPException(status_code=503, detail="Mood detection models not loaded")
+        require_mood_models()
         
         # Read uploaded file
         contents = await file.read()
         
-        # Convert to PIL Image
-        pil_image = Image.open(io.BytesIO(contents))
-        
-        # Convert to RGB if needed
-        if pil_image.mode != 'RGB':
-            pil_image = pil_image.convert('RGB')
-        
-        # Convert to numpy array
-        image_array = np.array(pil_image)
-        
-        # Detect mood
-        mood, confidence = detect_mood_from_image(image_array)
+        # Decode and detect mood off the event loop
+        mood, confidence = await detect_mood_async(extract_face_from_bytes, contents)
         
         if mood is None:
             raise HTTPException(status_code=400, detail="No face detected in image")
@@ -990,6 +3455,114 @@ async def upload_image_mood_detection(file: UploadFile = File(...)):
         logger.error(f"Error in upload image endpoint: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@app.post("/detect-mood/batch")
+async def detect_mood_batch(files: Optional[List[UploadFile]] = File(None), directory: Optional[str] = None):
+    """
+    Score many images in one call: uploaded images and zip archives (multipart), and/or a
+    directory below KAGUYA_BATCH_ROOT for local jobs. Streams NDJSON - one line per image
+    with every face's box and full probability vector, then a summary line. Failed images
+    carry an error and status; those with status 503 can be sent again.
+    """
+    require_mood_models()
+    
+    if not files and not directory:
+        raise HTTPException(status_code=400, detail="Upload images or zip archives, or pass a directory")
+    
+    archives: List[zipfile.ZipFile] = []
+    try:
+        sources = upload_image_sources(files, archives) if files else []
+        if directory:
+            sources += await asyncio.to_thread(directory_image_sources, directory)
+        if len(sources) > BATCH_MAX_IMAGES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Too many images ({len(sources)}, limit {BATCH_MAX_IMAGES}) - split the batch"
+            )
+    except Exception:
+        for archive in archives:
+            archive.close()
+        raise
+    
+    logger.info(f"📦 Scoring a batch of {len(sources)} images")
+    return StreamingResponse(stream_batch_scores(sources, archives), media_type="application/x-ndjson")
+
+@app.post("/video-timeline", status_code=202)
+async def start_video_timeline(path: str, stride: int = 1, all_faces: bool = False, format: str = "csv"):
+    """
+    Write the mood timeline of a recorded video below KAGUYA_BATCH_ROOT in the background.
+    stride: analyze every Nth frame
+    all_faces: one row per face instead of only the largest face
+    Poll GET /video-timeline/{job_id}, then fetch the file from /video-timeline/{job_id}/download
+    """
+    require_mood_models()
+    if mood_backend is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Video timelines need the in-process model - unavailable with KAGUYA_INFERENCE_PROCESSES"
+        )
+    if format not in TIMELINE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format: {format} (use one of {', '.join(TIMELINE_FORMATS)})")
+    if format == "parquet" and not parquet_available():
+        raise HTTPException(status_code=400, detail="Parquet output needs pyarrow on the server - use format=csv")
+    
+    video_path = resolve_batch_path(path)
+    if not os.path.isfile(video_path):
+        raise HTTPException(status_code=404, detail=f"Video not found: {path}")
+    os.makedirs(VIDEO_OUTPUT_DIR, exist_ok=True)
+    
+    loop = asyncio.get_running_loop()
+    
+    def run_on_inference_executor(func, *args):
+        # Called from the timeline's analysis threads: queue behind (and count against) API inference
+        return asyncio.run_coroutine_threadsafe(inference_executor.run_when_free(func, *args), loop).result()
+    
+    async def run(job: BackgroundJob) -> Dict[str, Any]:
+        output = os.path.join(VIDEO_OUTPUT_DIR, f"{job.id}.{format}")
+        job.files.append(output)
+        cancelled = threading.Event()
+        try:
+            summary = await asyncio.to_thread(
+                process_video_file, video_path, output,
+                stride=stride,
+                workers=VIDEO_WORKERS,
+                batch_size=BATCH_MAX_SIZE,
+                all_faces=all_faces,
+                output_format=format,
+                progress=job.progress,
+                cancelled=cancelled,
+                run_blocking=run_on_inference_executor
+            )
+        except asyncio.CancelledError:
+            # The thread keeps running until it sees the flag
+            cancelled.set()
+            raise
+        return {**summary, "download_url": f"/video-timeline/{job.id}/download"}
+    
+    job = background_jobs.start("video", run)
+    logger.info(f"🎞️ Started video timeline job {job.id} for {path}")
+    return {"job_id": job.id, "status": job.status, "status_url": f"/video-timeline/{job.id}"}
+
+@app.get("/video-timeline/{job_id}")
+async def get_video_timeline_job(job_id: str):
+    """Progress and summary of a video timeline job"""
+    job = background_jobs.get(job_id, kind="video")
+    if job is None:
+        raise HTTPException(status_code=404, detail="Video timeline job not found")
+    return job.to_dict()
+
+@app.get("/video-timeline/{job_id}/download")
+async def download_video_timeline(job_id: str):
+    """The finished timeline file (CSV or Parquet)"""
+    job = background_jobs.get(job_id, kind="video")
+    if job is None:
+        raise HTTPException(status_code=404, detail="Video timeline job not found")
+    if job.status != "completed":
+        raise HTTPException(status_code=409, detail=f"Video timeline job is {job.status}")
+    
+    output = job.result["output"]
+    media_type = "text/csv" if output.endswith(".csv") else "application/vnd.apache.parquet"
+    return FileResponse(output, media_type=media_type, filename=f"mood-timeline-{job_id}{os.path.splitext(output)[1]}")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
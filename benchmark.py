@@ -0,0 +1,715 @@
+"""
+Kaguya Music Mood API - Benchmarks
+
+Usage:
+    python benchmark.py backends [--model MoodDetector.h5] [--iterations 200] [--batch-sizes 1,8,16]
+    python benchmark.py detection --images face1.jpg face2.jpg [--resolutions 640x360,1280x720] [--max-dims 0,320,640]
+    python benchmark.py decode [--sizes 640x480,1920x1080] [--formats jpg,png] [--max-dims 0,640,1280]
+    python benchmark.py pipeline [--sizes 640x480,1280x720] [--concurrency 1,4,16] [--requests 200]
+    python benchmark.py startup [--runs 3] [--target-seconds 2]
+
+Every command accepts --json results.json to save its rows and --baseline old.json
+to compare against a previous run (exit status 1 if anything regressed).
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+# ==============================
+# Helpers
+# ==============================
+
+def parse_int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item.strip()]
+
+def time_calls(func: Callable[[], Any], iterations: int, warmup: int = 5) -> List[float]:
+    """Run func repeatedly and return per-call latencies in milliseconds"""
+    for _ in range(warmup):
+        func()
+
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - start) * 1000.0)
+    return latencies
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    ordered = sorted(latencies)
+
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+    return {
+        "mean_ms": statistics.fmean(ordered),
+        "p50_ms": percentile(50),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99)
+    }
+
+def print_table(rows: List[Dict[str, Any]], columns: List[str]):
+    widths = {
+        column: max(len(column), *(len(format_cell(row.get(column))) for row in rows))
+        for column in columns
+    }
+    print("  ".join(column.ljust(widths[column]) for column in columns))
+    for row in rows:
+        print("  ".join(format_cell(row.get(column)).ljust(widths[column]) for column in columns))
+
+def format_cell(value: Any) -> str:
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return str(value)
+
+def parse_resolutions(value: str) -> List[tuple]:
+    return [tuple(int(part) for part in item.split("x")) for item in value.split(",") if item.strip()]
+
+def letterbox(image: np.ndarray, width: int, height: int) -> np.ndarray:
+    """Scale an image to fit width x height and pad the rest with black"""
+    import cv2
+
+    scale = min(width / image.shape[1], height / image.shape[0])
+    resized = cv2.resize(image, (max(1, int(image.shape[1] * scale)), max(1, int(image.shape[0] * scale))))
+    canvas = np.zeros((height, width), dtype=image.dtype)
+    y = (height - resized.shape[0]) // 2
+    x = (width - resized.shape[1]) // 2
+    canvas[y:y + resized.shape[0], x:x + resized.shape[1]] = resized
+    return canvas
+
+def current_rss_mb() -> float:
+    """Resident set size of this process (server included when it runs in-process)"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    # Peak RSS where /proc is unavailable (kilobytes on Linux, bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+def synthetic_face(size: int) -> np.ndarray:
+    """Grayscale cartoon face the Haar cascade reliably detects (no photos needed)"""
+    import cv2
+
+    face = np.full((size, size), 90, np.uint8)
+    center = size // 2
+    cv2.ellipse(face, (center, center), (int(size * 0.32), int(size * 0.42)), 0, 0, 360, 200, -1)
+    eye_y, eye_dx = int(center - size * 0.08), int(size * 0.13)
+    for side in (-1, 1):
+        eye_x = center + side * eye_dx
+        cv2.ellipse(face, (eye_x, eye_y), (int(size * 0.07), int(size * 0.035)), 0, 0, 360, 40, -1)
+        brow_y = eye_y - int(size * 0.08)
+        cv2.line(face, (eye_x - int(size * 0.08), brow_y), (eye_x + int(size * 0.08), brow_y), 60, max(1, size // 40))
+    cv2.line(face, (center, eye_y + int(size * 0.02)), (center, center + int(size * 0.1)), 150, max(1, size // 50))
+    cv2.ellipse(face, (center, center + int(size * 0.2)), (int(size * 0.12), int(size * 0.04)), 0, 0, 360, 70, -1)
+    return cv2.GaussianBlur(face, (0, 0), max(0.5, size / 100))
+
+def synthetic_frame(width: int, height: int, seed: int = 0) -> np.ndarray:
+    """RGB frame with one synthetic face on a noisy background"""
+    rng = np.random.default_rng(seed)
+    frame = rng.integers(60, 120, (height, width), dtype=np.uint8)
+    size = max(48, min(width, height) // 2)
+    y, x = (height - size) // 2, (width - size) // 3
+    frame[y:y + size, x:x + size] = synthetic_face(size)
+    return np.repeat(frame[:, :, None], 3, axis=2)
+
+def encode_jpeg(image: np.ndarray, quality: int = 90) -> bytes:
+    import cv2
+
+    ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("JPEG encoding failed")
+    return encoded.tobytes()
+
+def box_iou(a, b) -> float:
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    overlap_w = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    overlap_h = max(0, min(ay + ah, by + bh) - max(ay, by))
+    intersection = overlap_w * overlap_h
+    union = aw * ah + bw * bh - intersection
+    return intersection / union if union else 0.0
+
+# ==============================
+# Benchmarks
+# ==============================
+
+def bench_backends(args) -> List[Dict[str, Any]]:
+    """Per-frame latency of each inference backend on the same model"""
+    import backend
+    from tensorflow.keras.models import load_model
+
+    model = load_model(args.model, compile=False)
+    rng = np.random.default_rng(0)
+    rows = []
+
+    for backend_name in args.backends.split(","):
+        inference_backend = backend.create_inference_backend(model, args.model, backend_name)
+        if inference_backend.name != backend_name:
+            print(f"Skipping '{backend_name}' - backend could not be created")
+            continue
+
+        for batch_size in args.batch_sizes:
+            face_batch = rng.random((batch_size, *backend.MODEL_INPUT_SHAPE), dtype=np.float32)
+            latencies = time_calls(lambda: inference_backend.predict(face_batch), args.iterations)
+            summary = summarize(latencies)
+            rows.append({
+                "backend": backend_name,
+                "batch_size": batch_size,
+                **summary,
+                "per_frame_ms": summary["mean_ms"] / batch_size
+            })
+
+    print_table(rows, ["backend", "batch_size", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "per_frame_ms"])
+    return rows
+
+def bench_detection(args) -> List[Dict[str, Any]]:
+    """
+    Face detection latency and recall across input resolutions and detection sizes.
+    Recall is measured against full-resolution detection (max_dim 0) on the same frame.
+    """
+    import cv2
+    import backend
+
+    backend.load_face_cascade()
+    images = [cv2.imread(path, cv2.IMREAD_GRAYSCALE) for path in args.images]
+    if any(image is None for image in images):
+        raise SystemExit("Could not read one of the --images files")
+
+    rows = []
+    for width, height in args.resolutions:
+        frames = [letterbox(image, width, height) for image in images]
+        ground_truth = [backend.detect_faces(frame, max_dim=0) for frame in frames]
+        total_faces = sum(len(faces) for faces in ground_truth)
+
+        for max_dim in args.max_dims:
+            def detect_all():
+                return [backend.detect_faces(frame, max_dim=max_dim) for frame in frames]
+
+            detections = detect_all()
+            matched = sum(
+                1
+                for expected, found in zip(ground_truth, detections)
+                for box in expected
+                if any(box_iou(box, candidate) >= 0.5 for candidate in found)
+            )
+            latencies = time_calls(detect_all, args.iterations, warmup=1)
+            summary = summarize([latency / len(frames) for latency in latencies])
+            rows.append({
+                "resolution": f"{width}x{height}",
+                "max_dim": max_dim or "full",
+                **summary,
+                "faces": sum(len(found) for found in detections),
+                "recall": matched / total_faces if total_faces else None
+            })
+
+    print_table(rows, ["resolution", "max_dim", "mean_ms", "p50_ms", "p95_ms", "faces", "recall"])
+    return rows
+
+def pil_decode_to_gray(image_data: bytes) -> np.ndarray:
+    """The decode path the API used before image_decode: PIL, an RGB array, then grayscale"""
+    import io
+    import cv2
+    from PIL import Image
+
+    pil_image = Image.open(io.BytesIO(image_data))
+    if pil_image.mode != "RGB":
+        pil_image = pil_image.convert("RGB")
+    return cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2GRAY)
+
+def peak_allocation_mb(func: Callable[[], Any]) -> float:
+    """
+    Peak memory allocated through Python and NumPy during one call. Scratch buffers
+    inside libjpeg, libpng and PIL are not seen, so this undercounts both paths.
+    """
+    import tracemalloc
+
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / (1024.0 * 1024.0)
+    finally:
+        tracemalloc.stop()
+
+def bench_decode(args) -> List[Dict[str, Any]]:
+    """
+    Per-frame decode time and allocation: the old PIL round trip against image_decode's
+    direct grayscale decode, at full size and with reduced-size JPEG decoding.
+    The base64 rows include stripping the data URL prefix and base64-decoding.
+    """
+    import cv2
+    import image_decode
+
+    if args.images:
+        sources = [(os.path.basename(path), cv2.imread(path)) for path in args.images]
+        if any(image is None for _, image in sources):
+            raise SystemExit("Could not read one of the --images files")
+    else:
+        sources = [(f"{width}x{height}", synthetic_frame(width, height)) for width, height in args.sizes]
+
+    rows = []
+    for name, image in sources:
+        for image_format in args.formats:
+            ok, encoded = cv2.imencode(f".{image_format}", image)
+            if not ok:
+                raise SystemExit(f"Could not encode {image_format}")
+            image_data = encoded.tobytes()
+            data_url = f"data:image/{image_format};base64," + base64.b64encode(image_data).decode()
+
+            def pil_base64():
+                return pil_decode_to_gray(base64.b64decode(data_url.split(",")[1]))
+
+            cases = [("bytes", "pil", "full", lambda: pil_decode_to_gray(image_data)),
+                     ("base64", "pil", "full", pil_base64)]
+            for max_dim in args.max_dims:
+                def decode_bytes(max_dim=max_dim):
+                    return image_decode.decode_grayscale(image_data, max_dim=max_dim)[0]
+
+                def decode_base64(max_dim=max_dim):
+                    return image_decode.decode_grayscale(image_decode.decode_base64(data_url), max_dim=max_dim)[0]
+
+                cases += [("bytes", "opencv", max_dim or "full", decode_bytes),
+                          ("base64", "opencv", max_dim or "full", decode_base64)]
+
+            for source, decoder, max_dim, func in cases:
+                gray_image = func()
+                latencies = time_calls(func, args.iterations)
+                rows.append({
+                    "image": name,
+                    "format": image_format,
+                    "source": source,
+                    "decoder": decoder,
+                    "max_dim": max_dim,
+                    "output": f"{gray_image.shape[1]}x{gray_image.shape[0]}",
+                    **summarize(latencies),
+                    "alloc_mb": peak_allocation_mb(func)
+                })
+
+    print_table(rows, ["image", "format", "source", "decoder", "max_dim", "output", "mean_ms", "p50_ms", "p95_ms", "alloc_mb"])
+    return rows
+
+# ==============================
+# Pipeline (end-to-end)
+# ==============================
+
+def build_spotify_stub(latency_ms: float):
+    """Local stand-in for the Spotify Web API and accounts service"""
+    from fastapi import FastAPI, Request
+
+    stub = FastAPI()
+    delay = latency_ms / 1000.0
+
+    def track(index: int) -> Dict[str, Any]:
+        return {
+            "id": f"track{index}",
+            "name": f"Track {index}",
+            "artists": [{"name": f"Artist {index % 97}"}],
+            "album": {"name": "Album", "images": [{"url": "https://example.invalid/cover.jpg"}]},
+            "preview_url": None,
+            "external_urls": {"spotify": f"https://open.spotify.com/track/track{index}"},
+            "duration_ms": 180000,
+            "popularity": index % 100
+        }
+
+    @stub.post("/api/token")
+    async def token():
+        return {"access_token": "bench", "token_type": "Bearer", "expires_in": 3600}
+
+    @stub.get("/v1/search")
+    async def search(limit: int = 20, offset: int = 0):
+        await asyncio.sleep(delay)
+        return {"tracks": {"items": [track(offset + i) for i in range(limit)], "total": 1000}}
+
+    @stub.get("/v1/me")
+    async def me():
+        await asyncio.sleep(delay)
+        return {"id": "bench-user", "display_name": "Benchmark"}
+
+    @stub.get("/v1/me/playlists")
+    async def my_playlists(limit: int = 50, offset: int = 0):
+        await asyncio.sleep(delay)
+        return {"items": [], "total": 0, "limit": limit, "offset": offset}
+
+    @stub.post("/v1/users/{user_id}/playlists", status_code=201)
+    async def create_playlist(user_id: str, request: Request):
+        await asyncio.sleep(delay)
+        body = await request.json()
+        playlist_id = f"pl{time.perf_counter_ns()}"
+        return {
+            "id": playlist_id,
+            "name": body["name"],
+            "description": body.get("description", ""),
+            "external_urls": {"spotify": f"https://open.spotify.com/playlist/{playlist_id}"}
+        }
+
+    @stub.post("/v1/playlists/{playlist_id}/tracks", status_code=201)
+    async def add_tracks(playlist_id: str):
+        await asyncio.sleep(delay)
+        return {"snapshot_id": "bench"}
+
+    return stub
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(app, port: int):
+    """Run an ASGI app with uvicorn on a background thread; returns once it accepts connections"""
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 300
+    while not server.started:
+        if not thread.is_alive() or time.monotonic() > deadline:
+            raise SystemExit(f"Server on port {port} failed to start")
+        time.sleep(0.05)
+    return server, thread
+
+async def run_load(send: Callable, concurrency: int, total: int) -> Dict[str, Any]:
+    """Issue total calls of send() from concurrency workers; latency per call and overall throughput"""
+    latencies: List[float] = []
+    errors = 0
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                await send()
+                latencies.append((time.perf_counter() - start) * 1000.0)
+            except Exception:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": total,
+        "errors": errors,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        **(summarize(latencies) if latencies else {})
+    }
+
+async def bench_http(base_url: str, path: str, payload: Dict[str, Any], concurrency: int, total: int) -> Dict[str, Any]:
+    import httpx
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60.0) as client:
+        async def send():
+            response = await client.post(path, json=payload)
+            if response.status_code != 200:
+                raise RuntimeError(f"HTTP {response.status_code}")
+        # Warm the connection pool and caches before measuring
+        await run_load(send, concurrency, concurrency)
+        return await run_load(send, concurrency, total)
+
+async def bench_websocket(ws_url: str, frame_bytes: bytes, concurrency: int, total: int) -> Dict[str, Any]:
+    """One connection per concurrent client, each sending a frame and waiting for its result"""
+    from websockets.asyncio.client import connect
+
+    message = json.dumps({"image": base64.b64encode(frame_bytes).decode(), "timestamp": 0})
+    connections = [await connect(ws_url, max_size=None) for _ in range(concurrency)]
+    available = asyncio.Queue()
+    for connection in connections:
+        available.put_nowait(connection)
+
+    async def send():
+        connection = await available.get()
+        try:
+            await connection.send(message)
+            result = json.loads(await connection.recv())
+            if "error" in result:
+                raise RuntimeError(result["error"])
+        finally:
+            available.put_nowait(connection)
+
+    try:
+        await run_load(send, concurrency, concurrency)
+        return await run_load(send, concurrency, total)
+    finally:
+        for connection in connections:
+            await connection.close()
+
+def bench_pipeline(args) -> List[Dict[str, Any]]:
+    """
+    End-to-end benchmark: decode and mood detection in-process, then /detect-mood,
+    /mood-and-playlist and /ws/video-mood over real sockets against a uvicorn server
+    backed by a local Spotify stub. Client and server share this process (and its
+    CPU), so compare runs on the same machine rather than reading absolute numbers.
+    """
+    import cv2
+
+    workdir = tempfile.mkdtemp(prefix="kaguya-bench-")
+    stub_port, api_port = free_port(), free_port()
+
+    # Must be set before backend (and spotify_api) are imported
+    os.environ.update({
+        "SPOTIFY_CLIENT_ID": "bench",
+        "SPOTIFY_CLIENT_SECRET": "bench",
+        "SPOTIFY_API_BASE": f"http://127.0.0.1:{stub_port}/v1",
+        "SPOTIFY_ACCOUNTS_BASE": f"http://127.0.0.1:{stub_port}",
+        "KAGUYA_TRACK_POOL_PATH": os.path.join(workdir, "track_pools.json"),
+        "KAGUYA_PLAYLIST_REGISTRY_PATH": os.path.join(workdir, "playlists.db"),
+        # Every request repeats the same frame, so the near-duplicate cache would answer almost all of them
+        "KAGUYA_MOOD_CACHE_SIZE": os.environ.get("KAGUYA_MOOD_CACHE_SIZE", "256" if args.mood_cache else "0")
+    })
+    start_server(build_spotify_stub(args.spotify_latency_ms), stub_port)
+
+    import backend
+
+    # Per-request info logs would dominate the measurements
+    logging.getLogger("backend").setLevel(logging.WARNING)
+    start_server(backend.app, api_port)
+    # Models and Spotify finish setting up in background tasks after the server starts
+    while backend.model_status["phase"] in ("not_started", "loading") or not (backend.spotify_task and backend.spotify_task.done()):
+        time.sleep(0.1)
+    # Pretend a user authorized playlist creation; the stub accepts any token
+    backend.spotify_session.set_token({
+        "access_token": "bench", "refresh_token": "bench", "expires_at": time.time() + 86400
+    })
+    base_url = f"http://127.0.0.1:{api_port}"
+    targets = set(args.targets.split(","))
+
+    if args.images:
+        sources = [(os.path.basename(path), cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2RGB)) for path in args.images]
+    else:
+        sources = [(f"{width}x{height}", synthetic_frame(width, height)) for width, height in args.sizes]
+
+    rows = []
+    for size, image in sources:
+        jpeg = encode_jpeg(cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+        payload = {"image_base64": base64.b64encode(jpeg).decode()}
+        mood, _ = backend.detect_mood_from_image(image)
+        if mood is None:
+            print(f"Warning: no face detected in the {size} image - results measure the no-face path")
+
+        if "functions" in targets:
+            for name, func in (
+                ("decode_base64_image", lambda: backend.decode_base64_image(payload["image_base64"])),
+                ("detect_mood_from_image", lambda: backend.detect_mood_from_image(image))
+            ):
+                latencies = time_calls(func, args.iterations)
+                rows.append({
+                    "target": name, "size": size, "concurrency": 1,
+                    "requests": args.iterations, "errors": 0,
+                    "throughput_rps": 1000.0 / statistics.fmean(latencies),
+                    **summarize(latencies),
+                    "rss_mb": current_rss_mb()
+                })
+
+        for concurrency in args.concurrency:
+            runs = []
+            if "detect-mood" in targets:
+                runs.append(("/detect-mood", bench_http(base_url, "/detect-mood", payload, concurrency, args.requests)))
+            if "mood-and-playlist" in targets:
+                path = "/mood-and-playlist?async_playlist=true" if args.async_playlist else "/mood-and-playlist"
+                runs.append(("/mood-and-playlist", bench_http(base_url, path, payload, concurrency, args.requests)))
+            if "ws" in targets:
+                ws_url = f"ws://127.0.0.1:{api_port}/ws/video-mood"
+                runs.append(("/ws/video-mood", bench_websocket(ws_url, jpeg, concurrency, args.requests)))
+
+            for target, coroutine in runs:
+                result = asyncio.run(coroutine)
+                rows.append({"target": target, "size": size, "concurrency": concurrency, **result, "rss_mb": current_rss_mb()})
+
+    print_table(rows, ["target", "size", "concurrency", "requests", "errors", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "rss_mb"])
+    return rows
+
+# ==============================
+# Startup
+# ==============================
+
+def bench_startup(args) -> List[Dict[str, Any]]:
+    """
+    Cold start of a fresh `uvicorn backend:app` process: time to import the module,
+    time to the first /health response (liveness) and until it reports ready
+    """
+    import httpx
+
+    # Run from any directory: backend.py lives next to this file, the model in the working directory
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [app_dir, os.environ.get("PYTHONPATH")]))}
+
+    rows = []
+    for run in range(1, args.runs + 1):
+        import_started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import backend"], check=True, capture_output=True, env=env)
+        import_s = time.perf_counter() - import_started
+
+        port = free_port()
+        started = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "backend:app", "--app-dir", app_dir, "--host", "127.0.0.1", "--port", str(port)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env
+        )
+        live_s = ready_s = None
+        try:
+            while time.perf_counter() - started < args.timeout:
+                if server.poll() is not None:
+                    raise SystemExit(f"Server exited with status {server.returncode}")
+                try:
+                    health = httpx.get(f"http://127.0.0.1:{port}/health", timeout=1.0).json()
+                except httpx.HTTPError:
+                    time.sleep(0.01)
+                    continue
+                elapsed = time.perf_counter() - started
+                if live_s is None:
+                    live_s = elapsed
+                if health.get("ready") or health.get("model_status") == "failed":
+                    ready_s = elapsed if health.get("ready") else None
+                    break
+                time.sleep(0.01)
+        finally:
+            server.terminate()
+            server.wait()
+
+        rows.append({
+            "run": run,
+            "import_s": import_s,
+            "live_s": live_s,
+            "ready_s": ready_s,
+            "meets_target": live_s is not None and live_s <= args.target_seconds
+        })
+
+    print_table(rows, ["run", "import_s", "live_s", "ready_s", "meets_target"])
+    if not all(row["meets_target"] for row in rows):
+        print(f"Time to first healthy response exceeded the {args.target_seconds}s target")
+    return rows
+
+# ==============================
+# Baselines
+# ==============================
+
+# Result columns compared between runs; every other column identifies the row
+LOWER_IS_BETTER = {"mean_ms", "p50_ms", "p95_ms", "p99_ms", "per_frame_ms", "alloc_mb", "rss_mb", "import_s", "live_s", "ready_s"}
+HIGHER_IS_BETTER = {"throughput_rps", "recall"}
+COMPARED = ("p95_ms", "p99_ms", "throughput_rps", "per_frame_ms", "recall", "alloc_mb", "rss_mb", "import_s", "live_s", "ready_s")
+UNCOMPARED = {"requests", "errors", "faces", "meets_target", "output"}
+
+def row_key(row: Dict[str, Any]) -> tuple:
+    return tuple(
+        (column, str(value)) for column, value in sorted(row.items())
+        if column not in LOWER_IS_BETTER | HIGHER_IS_BETTER | UNCOMPARED
+    )
+
+def compare_to_baseline(rows: List[Dict[str, Any]], baseline_rows: List[Dict[str, Any]],
+                        tolerance: float) -> List[Dict[str, Any]]:
+    """Rows whose metrics got worse than the baseline by more than tolerance (a fraction)"""
+    baseline = {row_key(row): row for row in baseline_rows}
+    regressions = []
+    for row in rows:
+        previous = baseline.get(row_key(row))
+        if previous is None:
+            continue
+        for column in COMPARED:
+            old, new = previous.get(column), row.get(column)
+            if not isinstance(old, (int, float)) or not isinstance(new, (int, float)) or not old:
+                continue
+            change = (new - old) / old
+            if (column in LOWER_IS_BETTER and change > tolerance) or (column in HIGHER_IS_BETTER and change < -tolerance):
+                regressions.append({
+                    "row": ", ".join(f"{key}={value}" for key, value in row_key(row)),
+                    "metric": column,
+                    "baseline": old,
+                    "current": new,
+                    "change": f"{change:+.1%}"
+                })
+    return regressions
+
+# ==============================
+# CLI
+# ==============================
+
+def main():
+    parser = argparse.ArgumentParser(description="Kaguya Music Mood API benchmarks")
+    parser.add_argument("--json", help="Write results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against results saved earlier with --json")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative regression (default 0.10)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    backends_parser = subparsers.add_parser("backends", help="Compare inference backends on CPU")
+    backends_parser.add_argument("--model", default="MoodDetector.h5")
+    backends_parser.add_argument("--backends", default="keras,tf_function,tflite")
+    backends_parser.add_argument("--batch-sizes", type=parse_int_list, default=[1, 8, 16])
+    backends_parser.add_argument("--iterations", type=int, default=200)
+    backends_parser.set_defaults(func=bench_backends)
+
+    detection_parser = subparsers.add_parser("detection", help="Face detection latency and recall vs. detection resolution")
+    detection_parser.add_argument("--images", nargs="+", required=True, help="Photos containing faces")
+    detection_parser.add_argument("--resolutions", type=parse_resolutions, default=parse_resolutions("640x360,1280x720,1920x1080"))
+    detection_parser.add_argument("--max-dims", type=parse_int_list, default=[0, 320, 480, 640])
+    detection_parser.add_argument("--iterations", type=int, default=20)
+    detection_parser.set_defaults(func=bench_detection)
+
+    decode_parser = subparsers.add_parser("decode", help="Image decode time and allocation, PIL vs. direct grayscale")
+    decode_parser.add_argument("--images", nargs="+", help="Use these photos instead of synthetic faces")
+    decode_parser.add_argument("--sizes", type=parse_resolutions, default=parse_resolutions("640x480,1920x1080,3840x2160"))
+    decode_parser.add_argument("--formats", type=lambda value: [item for item in value.split(",") if item], default=["jpg", "png"])
+    decode_parser.add_argument("--max-dims", type=parse_int_list, default=[0, 640, 1280], help="Reduced JPEG decode targets (0 = full size)")
+    decode_parser.add_argument("--iterations", type=int, default=50)
+    decode_parser.set_defaults(func=bench_decode)
+
+    pipeline_parser = subparsers.add_parser("pipeline", help="End-to-end latency, throughput and RSS with a stubbed Spotify")
+    pipeline_parser.add_argument("--images", nargs="+", help="Use these photos instead of synthetic faces")
+    pipeline_parser.add_argument("--sizes", type=parse_resolutions, default=parse_resolutions("640x480,1280x720"))
+    pipeline_parser.add_argument("--concurrency", type=parse_int_list, default=[1, 4, 16])
+    pipeline_parser.add_argument("--requests", type=int, default=200, help="Requests per target and concurrency level")
+    pipeline_parser.add_argument("--iterations", type=int, default=50, help="Calls per in-process function benchmark")
+    pipeline_parser.add_argument("--targets", default="functions,detect-mood,mood-and-playlist,ws")
+    pipeline_parser.add_argument("--spotify-latency-ms", type=float, default=30.0, help="Simulated Spotify response time")
+    pipeline_parser.add_argument("--async-playlist", action="store_true", help="Benchmark /mood-and-playlist with async_playlist=true")
+    pipeline_parser.add_argument("--mood-cache", action="store_true", help="Keep the near-duplicate mood caches on")
+    pipeline_parser.set_defaults(func=bench_pipeline)
+
+    startup_parser = subparsers.add_parser("startup", help="Cold-start time to liveness and readiness")
+    startup_parser.add_argument("--runs", type=int, default=3)
+    startup_parser.add_argument("--target-seconds", type=float, default=2.0, help="Target time to the first /health response")
+    startup_parser.add_argument("--timeout", type=float, default=300.0)
+    startup_parser.set_defaults(func=bench_startup)
+
+    args = parser.parse_args()
+    if getattr(args, "model", None) and not os.path.exists(args.model):
+        parser.error(f"Model file not found: {args.model}")
+
+    results = args.func(args)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"command": args.command, "results": results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("command") != args.command:
+            parser.error(f"Baseline is from '{baseline.get('command')}', not '{args.command}'")
+        regressions = compare_to_baseline(results, baseline["results"], args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+            print_table(regressions, ["row", "metric", "baseline", "current", "change"])
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.tolerance:.0%} against {args.baseline}")
+
+if __name__ == "__main__":
+    main()
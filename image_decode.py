@@ -0,0 +1,192 @@
+"""
+Image decoding for the Kaguya backend.
+
+Every image the API receives is only ever used as grayscale, so it is decoded
+straight to a single-channel array with cv2.imdecode instead of going through
+PIL, an RGB array and a color conversion. Large JPEGs can be decoded at 1/2,
+1/4 or 1/8 size in the DCT domain, which is much cheaper than decoding at full
+size and downscaling. Byte and pixel limits are checked before decoding, the
+pixel count from the image header, so oversized images are rejected without
+allocating them.
+"""
+
+import binascii
+import io
+import struct
+from typing import Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+# A data URL prefix ("data:image/jpeg;base64,") is short; its comma is only looked for this far in
+DATA_URL_PREFIX_MAX = 256
+
+# cv2.imdecode flags by reduction factor
+REDUCED_GRAYSCALE_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8
+}
+
+class ImageDecodeError(ValueError):
+    """The data is not an image that can be decoded"""
+
+class ImageTooLargeError(ImageDecodeError):
+    """The image exceeds the configured byte or pixel limit"""
+
+# ==============================
+# Base64
+# ==============================
+
+def decode_base64(data: Union[str, BytesLike], max_bytes: int = 0) -> bytes:
+    """
+    Decode a base64 image, with or without a data URL prefix. The prefix is skipped
+    through a memoryview rather than split off, so the payload is not copied again,
+    and the decoded size is checked before decoding (0 = no limit).
+    """
+    if isinstance(data, str):
+        try:
+            data = data.encode("ascii")
+        except UnicodeEncodeError:
+            raise ImageDecodeError("Base64 data contains non-ASCII characters")
+
+    view = memoryview(data)
+    # Commas are not in the base64 alphabet, so one near the start ends a data URL prefix
+    comma = bytes(view[:DATA_URL_PREFIX_MAX]).find(b",")
+    if comma >= 0:
+        view = view[comma + 1:]
+
+    if max_bytes and len(view) // 4 * 3 > max_bytes:
+        raise ImageTooLargeError(f"Image too large (about {len(view) // 4 * 3} bytes, limit {max_bytes})")
+
+    try:
+        return binascii.a2b_base64(view)
+    except binascii.Error as e:
+        raise ImageDecodeError(f"Invalid base64 data: {e}")
+
+# ==============================
+# Header probing
+# ==============================
+
+# JPEG start-of-frame markers carry the image size; C4, C8 and CC are other segments
+JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+def is_jpeg(data: BytesLike) -> bool:
+    return bytes(data[:3]) == b"\xff\xd8\xff"
+
+def probe_image_size(data: BytesLike) -> Optional[Tuple[int, int]]:
+    """(width, height) read from a JPEG, PNG, WebP, GIF or BMP header, None if unknown"""
+    head = bytes(data[:32])
+    try:
+        if head.startswith(b"\x89PNG\r\n\x1a\n"):
+            return struct.unpack(">II", head[16:24])
+        if head[:6] in (b"GIF87a", b"GIF89a"):
+            return struct.unpack("<HH", head[6:10])
+        if head.startswith(b"BM"):
+            width, height = struct.unpack("<ii", head[18:26])
+            return abs(width), abs(height)
+        if head.startswith(b"RIFF") and head[8:12] == b"WEBP":
+            return probe_webp_size(head)
+        if is_jpeg(head):
+            return probe_jpeg_size(data)
+    except struct.error:
+        pass
+    return None
+
+def probe_webp_size(head: bytes) -> Optional[Tuple[int, int]]:
+    chunk = head[12:16]
+    if chunk == b"VP8 ":
+        width, height = struct.unpack("<HH", head[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L":
+        bits = int.from_bytes(head[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        return int.from_bytes(head[24:27], "little") + 1, int.from_bytes(head[27:30], "little") + 1
+    return None
+
+def probe_jpeg_size(data: BytesLike) -> Optional[Tuple[int, int]]:
+    """Walk the JPEG segments up to the start-of-frame marker (only headers are read)"""
+    view = memoryview(data)
+    offset = 2
+    while offset + 9 <= len(view):
+        if view[offset] != 0xFF:
+            return None
+        marker = view[offset + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            offset += 1
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack_from(">HH", view, offset + 5)
+            return width, height
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+            # Markers without a length field
+            offset += 2
+            continue
+        offset += 2 + struct.unpack_from(">H", view, offset + 2)[0]
+    return None
+
+# ==============================
+# Decoding
+# ==============================
+
+def reduction_factor(size: Optional[Tuple[int, int]], max_dim: int) -> int:
+    """Largest JPEG reduction (1, 2, 4 or 8) that keeps the longest side at least max_dim (0 = full size)"""
+    if not max_dim or size is None:
+        return 1
+    longest = max(size)
+    factor = 1
+    while factor < 8 and longest // (factor * 2) >= max_dim:
+        factor *= 2
+    return factor
+
+def decode_grayscale(data: BytesLike, max_bytes: int = 0, max_pixels: int = 0,
+                     max_dim: int = 0) -> Tuple[np.ndarray, int]:
+    """
+    Decode encoded image bytes to a grayscale array
+    max_bytes / max_pixels: limits checked before decoding (0 = no limit)
+    max_dim: JPEGs whose longest side is at least twice this are decoded at 1/2, 1/4 or 1/8
+    size while staying at least max_dim (0 = always full size)
+    Returns: (grayscale image, factor that maps its pixel coordinates back to the original)
+    """
+    if not len(data):
+        raise ImageDecodeError("Empty image data")
+    if max_bytes and len(data) > max_bytes:
+        raise ImageTooLargeError(f"Image too large ({len(data)} bytes, limit {max_bytes})")
+
+    size = probe_image_size(data)
+    if size is not None and max_pixels and size[0] * size[1] > max_pixels:
+        raise ImageTooLargeError(f"Image too large ({size[0]}x{size[1]} pixels, limit {max_pixels})")
+
+    factor = reduction_factor(size, max_dim) if is_jpeg(data) else 1
+    try:
+        gray_image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), REDUCED_GRAYSCALE_FLAGS[factor])
+    except cv2.error as e:
+        raise ImageDecodeError(f"Cannot decode image: {e}")
+    if gray_image is None:
+        # Formats OpenCV does not read (GIF, ...)
+        return decode_grayscale_with_pil(data, max_pixels), 1
+
+    if size is None and max_pixels and gray_image.size > max_pixels:
+        raise ImageTooLargeError(f"Image too large ({gray_image.shape[1]}x{gray_image.shape[0]} pixels, limit {max_pixels})")
+    return gray_image, factor
+
+def decode_grayscale_with_pil(data: BytesLike, max_pixels: int = 0) -> np.ndarray:
+    try:
+        from PIL import Image
+    except ImportError:
+        raise ImageDecodeError("Unsupported image format")
+
+    try:
+        pil_image = Image.open(io.BytesIO(data))
+        if max_pixels and pil_image.width * pil_image.height > max_pixels:
+            raise ImageTooLargeError(f"Image too large ({pil_image.width}x{pil_image.height} pixels, limit {max_pixels})")
+        return np.asarray(pil_image.convert("L"))
+    except ImageDecodeError:
+        raise
+    except Exception as e:
+        raise ImageDecodeError(f"Cannot decode image: {e}")
@@ -0,0 +1,375 @@
+"""
+Multi-process inference pool for the Kaguya backend.
+
+Each worker process loads MoodDetector.h5 and the face cascade once, then runs
+decode + face detection + preprocessing + prediction for frames it takes off a
+shared task queue. Frame bytes travel through a multiprocessing.shared_memory
+ring of fixed-size slots; only small task and result tuples are pickled.
+"""
+
+import asyncio
+import itertools
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+# Tasks queued on one worker at a time, so it can start the next frame without waiting on the parent
+WORKER_QUEUE_DEPTH = 4
+# Seconds between liveness checks of the worker processes
+WORKER_CHECK_INTERVAL = 1.0
+# Exit status of a worker whose model failed to load; such workers are not restarted
+LOAD_FAILED_EXIT_CODE = 3
+
+def attach_shared_memory(name: str) -> SharedMemory:
+    """
+    Attach to the parent's ring. Spawned workers share the parent's resource tracker,
+    which only unlinks the segment once; 3.13+ can skip tracking altogether.
+    """
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=name, track=False)
+    return SharedMemory(name=name)
+
+# ==============================
+# Worker process
+# ==============================
+
+def worker_main(shm_name: str, slot_bytes: int, task_queue, result_queue, threads: int):
+    """Entry point of a worker process: load the models once, then serve tasks until told to stop"""
+    import cv2
+
+    # N processes each using every core would oversubscribe the CPU
+    cv2.setNumThreads(threads)
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    import backend
+
+    ok = backend.load_face_cascade() and backend.load_mood_model()
+    if ok:
+        backend.warm_up_inference_worker(threading.Barrier(1))
+    result_queue.put(("ready", os.getpid(), ok))
+    if not ok:
+        sys.exit(LOAD_FAILED_EXIT_CODE)
+
+    ring = attach_shared_memory(shm_name)
+    try:
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            task_id, slot, nbytes, kind, width, height, mode, tracker = task
+            start = slot * slot_bytes
+            frame = {"kind": kind, "payload": ring.buf[start:start + nbytes], "width": width, "height": height}
+            try:
+                value = run_task(backend, frame, mode, tracker)
+                result_queue.put(("result", task_id, "ok", value))
+            except HTTPException as e:
+                result_queue.put(("result", task_id, "http", (e.status_code, e.detail)))
+            except Exception as e:
+                result_queue.put(("result", task_id, "error", f"{type(e).__name__}: {e}"))
+            finally:
+                # Views into the ring must be gone before it can be closed
+                try:
+                    frame["payload"].release()
+                except BufferError:
+                    pass
+                del frame
+    finally:
+        ring.close()
+
+def run_task(backend, frame: Dict[str, Any], mode: str, tracker):
+    """
+    single: (probabilities of the largest face or None, updated tracker, mood cache lookups)
+    group: (boxes, per-face probabilities) or ([], None)
+    """
+    gray_image, scale = backend.decode_binary_frame(frame)
+
+    if mode == "group":
+        boxes, face_batch = backend.extract_all_faces_scaled(gray_image, scale)
+        if face_batch is None:
+            return [], None
+        return boxes, backend.predict_mood_batch(face_batch)
+
+    counts = [(cache.hits, cache.misses) for cache in backend.mood_caches]
+    probabilities, face_input, cache_keys = backend.extract_face_cached(gray_image, tracker, scale)
+    if probabilities is None and face_input is not None:
+        probabilities = backend.predict_mood_batch(face_input[None])[0]
+        backend.store_mood_prediction(cache_keys, probabilities)
+
+    # This process's cache lookups, so the parent can report hit rates
+    lookups = [(cache.hits - hits, cache.misses - misses) for cache, (hits, misses) in zip(backend.mood_caches, counts)]
+    return probabilities, tracker, lookups
+
+# ==============================
+# Parent side
+# ==============================
+
+class ProcessInferencePool:
+    """
+    Dispatches frames to worker processes. The ring has one slot per in-flight
+    frame; when every slot is busy new work is rejected with 503, like the
+    thread executors. Each worker has its own task queue, fed from a backlog kept
+    here with at most WORKER_QUEUE_DEPTH tasks at a time: a worker killed while
+    waiting on a shared queue would hold its read lock and stall the others.
+    """
+
+    def __init__(self, processes: int, slots: int, slot_bytes: int,
+                 timeout: float = 30.0, threads_per_process: int = 1, worker_target=worker_main):
+        self.processes = processes
+        self.slots = max(slots, processes)
+        self.slot_bytes = slot_bytes
+        self.timeout = timeout
+        self.threads_per_process = threads_per_process
+        self.worker_target = worker_target
+        self.ring: Optional[SharedMemory] = None
+        self.workers = []
+        self.ready = threading.Event()
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.restarts = 0
+        self.load_failures = 0
+        self._context = get_context("spawn")
+        self._task_ids = itertools.count()
+        self._free_slots = list(range(self.slots))
+        self._inflight: Dict[int, tuple] = {}  # {task_id: (future, slot)}
+        self._backlog = deque()  # tasks not yet handed to a worker
+        self._assigned: List[List[int]] = [[] for _ in range(processes)]  # task ids queued per worker
+        self._worker_ready = [False] * processes
+        self._restarting = set()
+        self._load_failed = set()  # workers whose model failed to load; only touched by the listener
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._listener: Optional[threading.Thread] = None
+        self._stopping = False
+
+    def start(self):
+        """Create the ring and queues and spawn the workers (call from the event loop)"""
+        self._loop = asyncio.get_running_loop()
+        self.ring = SharedMemory(create=True, size=self.slots * self.slot_bytes)
+        self.task_queues = [self._context.Queue() for _ in range(self.processes)]
+        self.result_queue = self._context.Queue()
+        self.workers = [self._spawn(index) for index in range(self.processes)]
+        self._listener = threading.Thread(target=self._listen, name="kaguya-process-results", daemon=True)
+        self._listener.start()
+
+    def _spawn(self, index: int):
+        worker = self._context.Process(
+            target=self.worker_target,
+            args=(self.ring.name, self.slot_bytes, self.task_queues[index], self.result_queue, self.threads_per_process),
+            daemon=True
+        )
+        worker.start()
+        return worker
+
+    async def wait_ready(self, timeout: float = 600.0) -> bool:
+        """True once every worker has loaded and warmed up its model, False as soon as one fails to"""
+        deadline = time.monotonic() + timeout
+        while not self.ready.is_set():
+            if self._load_failed or time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.1)
+        return True
+
+    @property
+    def full(self) -> bool:
+        return not self._free_slots
+
+    async def run(self, mode: str, frame: Dict[str, Any], tracker=None):
+        """Process one frame in a worker; see run_task for the result shape"""
+        payload = frame["payload"]
+        nbytes = len(payload)
+        if nbytes > self.slot_bytes:
+            raise HTTPException(status_code=413, detail=f"Image too large ({nbytes} bytes, limit {self.slot_bytes})")
+        if not any(self._worker_ready):
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Inference processes are restarting, retry shortly",
+                headers={"Retry-After": "2"}
+            )
+        if not self._free_slots:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Server busy - inference processes are full, retry shortly",
+                headers={"Retry-After": "1"}
+            )
+
+        # Slots and in-flight tasks are only touched on the event loop thread
+        slot = self._free_slots.pop()
+        start = slot * self.slot_bytes
+        self.ring.buf[start:start + nbytes] = payload
+        task_id = next(self._task_ids)
+        future = self._loop.create_future()
+        self._inflight[task_id] = (future, slot)
+        self._backlog.append((
+            task_id, slot, nbytes, frame["kind"], frame.get("width", 0), frame.get("height", 0), mode, tracker
+        ))
+        self._dispatch()
+
+        try:
+            # The slot stays busy until the worker answers, even if this caller gives up
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="Inference timed out")
+
+    def _listen(self):
+        """Hand results to the event loop; restart workers that died"""
+        last_check = time.monotonic()
+        while not self._stopping:
+            try:
+                message = self.result_queue.get(timeout=WORKER_CHECK_INTERVAL)
+            except queue.Empty:
+                message = None
+            except (EOFError, OSError):
+                return
+
+            # On a clock rather than when idle: under steady traffic the queue is never empty
+            if time.monotonic() - last_check >= WORKER_CHECK_INTERVAL:
+                last_check = time.monotonic()
+                self._check_workers()
+            if message is None:
+                continue
+
+            if message[0] == "ready":
+                _, pid, ok = message
+                if ok:
+                    self._loop.call_soon_threadsafe(self._mark_ready, pid)
+                else:
+                    for index, worker in enumerate(self.workers):
+                        if worker.pid == pid:
+                            self._mark_load_failed(index)
+                continue
+
+            _, task_id, status, value = message
+            self._loop.call_soon_threadsafe(self._complete, task_id, status, value)
+
+    def _dispatch(self):
+        """Hand backlog tasks to the least busy workers that have loaded their model"""
+        while self._backlog:
+            candidates = [i for i in range(self.processes) if self._worker_ready[i]]
+            if not candidates:
+                return
+            index = min(candidates, key=lambda i: len(self._assigned[i]))
+            if len(self._assigned[index]) >= WORKER_QUEUE_DEPTH:
+                return
+            task = self._backlog.popleft()
+            self._assigned[index].append(task[0])
+            self.task_queues[index].put(task)
+
+    def _mark_ready(self, pid: int):
+        for index, worker in enumerate(self.workers):
+            if worker.pid == pid:
+                self._worker_ready[index] = True
+        if all(self._worker_ready):
+            self.ready.set()
+        self._dispatch()
+
+    def _complete(self, task_id: int, status: str, value):
+        entry = self._inflight.pop(task_id, None)
+        if entry is None:
+            # Already failed after a worker crash
+            return
+        future, slot = entry
+        self._free_slots.append(slot)
+        for assigned in self._assigned:
+            if task_id in assigned:
+                assigned.remove(task_id)
+        self._dispatch()
+
+        if status == "ok":
+            self.completed += 1
+            if not future.done():
+                future.set_result(value)
+            return
+
+        self.failed += 1
+        if future.done():
+            return
+        if status == "http":
+            status_code, detail = value
+            future.set_exception(HTTPException(status_code=status_code, detail=detail))
+        else:
+            future.set_exception(RuntimeError(value))
+
+    def _check_workers(self):
+        for index, worker in enumerate(self.workers):
+            if worker.is_alive() or self._stopping or index in self._restarting or index in self._load_failed:
+                continue
+            if worker.exitcode == LOAD_FAILED_EXIT_CODE:
+                self._mark_load_failed(index)
+                continue
+            logger.error(f"Inference process {worker.pid} exited with {worker.exitcode} - restarting it")
+            self._restarting.add(index)
+            self._loop.call_soon_threadsafe(self._restart_worker, index)
+
+    def _mark_load_failed(self, index: int):
+        """Leave a worker whose model failed to load down; respawning it would only fail again"""
+        if index in self._load_failed:
+            return
+        self._load_failed.add(index)
+        self.load_failures += 1
+        logger.error(f"Inference process {self.workers[index].pid} failed to load the model - not restarting it")
+
+    def _restart_worker(self, index: int):
+        """Replace a dead worker and its queue, failing the tasks it was given (on the event loop)"""
+        self.restarts += 1
+        self._worker_ready[index] = False
+        self.ready.clear()
+        task_ids, self._assigned[index] = self._assigned[index], []
+        for task_id in task_ids:
+            entry = self._inflight.pop(task_id, None)
+            if entry is None:
+                continue
+            future, slot = entry
+            self._free_slots.append(slot)
+            self.failed += 1
+            if not future.done():
+                future.set_exception(HTTPException(status_code=503, detail="Inference process crashed, retry shortly"))
+        # Its tasks were failed above, and the old queue may still be locked by the dead reader
+        self.task_queues[index] = self._context.Queue()
+        self.workers[index] = self._spawn(index)
+        self._restarting.discard(index)
+
+    def shutdown(self):
+        self._stopping = True
+        for task_queue in self.task_queues:
+            task_queue.put(None)
+        deadline = time.monotonic() + 5.0
+        for worker in self.workers:
+            worker.join(max(0.0, deadline - time.monotonic()))
+            if worker.is_alive():
+                worker.terminate()
+        if self.ring is not None:
+            self.ring.close()
+            self.ring.unlink()
+            self.ring = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "processes": self.processes,
+            "alive": sum(worker.is_alive() for worker in self.workers),
+            "ready": self.ready.is_set(),
+            "ready_workers": sum(self._worker_ready),
+            "load_failures": self.load_failures,
+            "slots": self.slots,
+            "slot_bytes": self.slot_bytes,
+            "in_flight": len(self._inflight),
+            "backlog": len(self._backlog),
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "restarts": self.restarts
+        }
@@ -0,0 +1,218 @@
+"""
+Asyncio-native Spotify Web API client used by the Kaguya backend.
+
+One httpx.AsyncClient (keep-alive pooling, HTTP/2 when the h2 package is
+installed) serves every request. 429 responses are retried after the
+Retry-After delay, 5xx responses and transport errors with exponential backoff.
+"""
+
+import asyncio
+import base64
+import importlib.util
+import logging
+import math
+import os
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# httpx logs every request at INFO, which drowns out the API's own logs
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+SPOTIFY_API_BASE = os.getenv("SPOTIFY_API_BASE", "https://api.spotify.com/v1")
+SPOTIFY_ACCOUNTS_BASE = os.getenv("SPOTIFY_ACCOUNTS_BASE", "https://accounts.spotify.com")
+
+class SpotifyAPIError(Exception):
+    """Non-retryable (or retries exhausted) error response from Spotify"""
+
+    def __init__(self, http_status: int, message: str):
+        super().__init__(f"HTTP {http_status}: {message}")
+        self.http_status = http_status
+        self.message = message
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """Delay from a Retry-After header (seconds or an HTTP-date), None if missing or malformed"""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        seconds = (retry_at - datetime.now(timezone.utc)).total_seconds()
+    return max(0.0, seconds) if math.isfinite(seconds) else None
+
+def backoff_delay(attempt: int) -> float:
+    return min(0.5 * 2 ** attempt, 8.0)
+
+class AsyncSpotifyClient:
+    """
+    Spotify Web API client. App-level calls (search) use a client-credentials
+    token managed here; user-level calls take the user's access token explicitly.
+    """
+
+    def __init__(self, client_id: str, client_secret: str,
+                 api_base: str = SPOTIFY_API_BASE,
+                 accounts_base: str = SPOTIFY_ACCOUNTS_BASE,
+                 timeout: float = 10.0,
+                 max_connections: int = 20,
+                 max_retries: int = 3,
+                 max_retry_after: float = 30.0):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.api_base = api_base.rstrip("/")
+        self.accounts_base = accounts_base.rstrip("/")
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+        self.http2 = importlib.util.find_spec("h2") is not None
+        self._http = httpx.AsyncClient(
+            http2=self.http2,
+            timeout=httpx.Timeout(timeout, connect=5.0),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+        self._app_token: Optional[str] = None
+        self._app_token_expires_at = 0.0
+        self._app_token_lock = asyncio.Lock()
+        self.retries = 0
+        self.rate_limited = 0
+
+    async def aclose(self):
+        await self._http.aclose()
+
+    def _basic_auth_header(self) -> Dict[str, str]:
+        credentials = base64.b64encode(f"{self.client_id}:{self.client_secret}".encode()).decode()
+        return {"Authorization": f"Basic {credentials}"}
+
+    async def _request_token(self, data: Dict[str, str]) -> Dict[str, Any]:
+        response = await self._http.post(
+            f"{self.accounts_base}/api/token",
+            data=data,
+            headers=self._basic_auth_header()
+        )
+        if response.status_code != 200:
+            raise SpotifyAPIError(response.status_code, response.text)
+        token_info = response.json()
+        token_info["expires_at"] = int(time.time()) + token_info.get("expires_in", 3600)
+        return token_info
+
+    async def app_access_token(self) -> str:
+        """Client-credentials token, fetched once and renewed a minute before it expires"""
+        async with self._app_token_lock:
+            if self._app_token is None or time.time() > self._app_token_expires_at - 60:
+                token_info = await self._request_token({"grant_type": "client_credentials"})
+                self._app_token = token_info["access_token"]
+                self._app_token_expires_at = token_info["expires_at"]
+            return self._app_token
+
+    async def refresh_user_token(self, refresh_token: str) -> Dict[str, Any]:
+        """Exchange a user's refresh token for a new access token"""
+        token_info = await self._request_token({
+            "grant_type": "refresh_token",
+            "refresh_token": refresh_token
+        })
+        # Spotify may omit the refresh token when it is unchanged
+        token_info.setdefault("refresh_token", refresh_token)
+        return token_info
+
+    async def request(self, method: str, path: str, token: Optional[str] = None,
+                      params: Optional[Dict[str, Any]] = None,
+                      json: Optional[Any] = None) -> Optional[Dict[str, Any]]:
+        """
+        Call the Web API with retries. Uses the app token unless a user token is given.
+        Raises: SpotifyAPIError once retries are exhausted or the error is not retryable
+        """
+        url = path if path.startswith("http") else f"{self.api_base}{path}"
+
+        for attempt in range(self.max_retries + 1):
+            access_token = token or await self.app_access_token()
+            try:
+                response = await self._http.request(
+                    method, url,
+                    params=params,
+                    json=json,
+                    headers={"Authorization": f"Bearer {access_token}"}
+                )
+            except httpx.TransportError as e:
+                if attempt == self.max_retries:
+                    raise SpotifyAPIError(0, f"{type(e).__name__}: {e}")
+                await self._backoff(attempt)
+                continue
+
+            if response.status_code == 429 and attempt < self.max_retries:
+                self.rate_limited += 1
+                retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+                if retry_after is None:
+                    retry_after = backoff_delay(attempt)
+                logger.warning(f"Spotify rate limit hit - retrying {method} {path} in {retry_after}s")
+                await asyncio.sleep(min(retry_after, self.max_retry_after))
+                self.retries += 1
+                continue
+
+            if response.status_code >= 500 and attempt < self.max_retries:
+                await self._backoff(attempt)
+                continue
+
+            if response.status_code == 401 and token is None and attempt < self.max_retries:
+                # App token revoked or expired early - fetch a new one
+                self._app_token = None
+                self.retries += 1
+                continue
+
+            if response.status_code >= 400:
+                raise SpotifyAPIError(response.status_code, response.text)
+
+            return response.json() if response.content else None
+
+    async def _backoff(self, attempt: int):
+        self.retries += 1
+        await asyncio.sleep(backoff_delay(attempt))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "http2": self.http2,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited
+        }
+
+    async def search(self, q: str, type: str = "track", limit: int = 20,
+                     offset: int = 0, market: Optional[str] = None) -> Dict[str, Any]:
+        params = {"q": q, "type": type, "limit": limit, "offset": offset}
+        if market:
+            params["market"] = market
+        return await self.request("GET", "/search", params=params)
+
+    async def current_user(self, token: str) -> Dict[str, Any]:
+        return await self.request("GET", "/me", token=token)
+
+    async def current_user_playlists(self, token: str, limit: int = 50, offset: int = 0) -> Dict[str, Any]:
+        return await self.request("GET", "/me/playlists", token=token, params={"limit": limit, "offset": offset})
+
+    async def create_playlist(self, token: str, user_id: str, name: str,
+                              public: bool = True, description: str = "") -> Dict[str, Any]:
+        return await self.request(
+            "POST", f"/users/{user_id}/playlists", token=token,
+            json={"name": name, "public": public, "description": description}
+        )
+
+    async def add_playlist_items(self, token: str, playlist_id: str, uris: List[str]) -> Optional[Dict[str, Any]]:
+        """Add tracks in chunks of 100, the most Spotify accepts per request"""
+        result = None
+        for start in range(0, len(uris), 100):
+            result = await self.request(
+                "POST", f"/playlists/{playlist_id}/tracks", token=token,
+                json={"uris": uris[start:start + 100]}
+            )
+        return result
+
+    async def unfollow_playlist(self, token: str, playlist_id: str):
+        """Unfollowing your own playlist is how Spotify deletes it"""
+        await self.request("DELETE", f"/playlists/{playlist_id}/followers", token=token)
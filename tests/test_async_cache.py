@@ -0,0 +1,44 @@
+import asyncio
+import gc
+
+from backend import AsyncTTLCache
+
+def test_failed_background_refresh_is_not_reported_as_unretrieved():
+    unhandled = []
+
+    async def scenario():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: unhandled.append(context))
+        cache = AsyncTTLCache("test", ttl=0.0, stale_ttl=60.0)
+
+        async def value():
+            return "tracks"
+
+        async def outage():
+            raise RuntimeError("Spotify is down")
+
+        assert await cache.get("happy", value) == "tracks"
+        # Stale entry: served at once while a refresh fails in the background
+        for _ in range(3):
+            assert await cache.get("happy", outage) == "tracks"
+            await asyncio.sleep(0)
+            await asyncio.sleep(0)
+        gc.collect()
+        return cache
+
+    cache = asyncio.run(scenario())
+    gc.collect()
+    assert unhandled == []
+    assert cache.refresh_errors == 3
+
+def test_failed_load_still_reaches_waiting_callers():
+    async def scenario():
+        cache = AsyncTTLCache("test", ttl=60.0, stale_ttl=60.0)
+
+        async def outage():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("Spotify is down")
+
+        return await asyncio.gather(cache.get("sad", outage), cache.get("sad", outage), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert [type(result) for result in results] == [RuntimeError, RuntimeError]
@@ -0,0 +1,49 @@
+import asyncio
+import json
+
+from fastapi import HTTPException
+
+import backend
+
+def collect(sources) -> list:
+    async def scenario():
+        return [json.loads(line) async for line in backend.stream_batch_scores(sources, [])]
+
+    return asyncio.run(scenario())
+
+def test_busy_images_are_reported_once_with_their_status(monkeypatch):
+    calls = []
+
+    async def detect(extract_func, image_data):
+        calls.append(image_data)
+        if image_data == b"busy":
+            raise HTTPException(status_code=503, detail="Server busy")
+        return None
+
+    monkeypatch.setattr(backend, "detect_group_mood_async", detect)
+    lines = collect([(name, None, lambda name=name: name.encode()) for name in ("first", "busy", "last")])
+
+    assert calls == [b"first", b"busy", b"last"]
+    assert lines[1] == {"name": "busy", "status": 503, "error": "Server busy"}
+    assert lines[0]["face_count"] == lines[2]["face_count"] == 0
+    assert lines[-1]["errors"] == lines[-1]["busy"] == 1
+
+def test_no_new_image_is_started_while_the_inference_queue_is_full(monkeypatch):
+    in_flight = []
+    most_in_flight = 0
+
+    async def detect(extract_func, image_data):
+        nonlocal most_in_flight
+        in_flight.append(image_data)
+        most_in_flight = max(most_in_flight, len(in_flight))
+        await asyncio.sleep(0.01)
+        in_flight.remove(image_data)
+        return None
+
+    monkeypatch.setattr(backend, "detect_group_mood_async", detect)
+    monkeypatch.setattr(backend, "inference_queue_full", lambda: True)
+    lines = collect([(str(index), None, lambda: b"image") for index in range(5)])
+
+    assert most_in_flight == 1
+    assert lines[-1]["images"] == 5
+    assert lines[-1]["errors"] == 0
@@ -0,0 +1,93 @@
+import base64
+
+import cv2
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+import backend
+import image_decode
+
+def jpeg_bytes(width: int = 64, height: int = 48) -> bytes:
+    image = np.random.default_rng(0).integers(0, 255, (height, width, 3), dtype=np.uint8)
+    return cv2.imencode(".jpg", image)[1].tobytes()
+
+def test_base64_frames_are_decoded_by_the_inference_process():
+    data_url = "data:image/jpeg;base64," + base64.b64encode(jpeg_bytes()).decode()
+    frame = backend.encoded_frame_from_base64(data_url)
+    assert frame["kind"] == backend.FRAME_KIND_BASE64
+
+    # What a worker does with the frame after reading it out of its ring slot
+    frame["payload"] = memoryview(frame["payload"])
+    gray_image, scale = backend.decode_binary_frame(frame)
+    assert gray_image.shape == (48, 64)
+    assert scale == 1
+
+def test_non_ascii_base64_is_rejected_before_dispatch():
+    with pytest.raises(HTTPException) as error:
+        backend.encoded_frame_from_base64("data:image/jpeg;base64,ünïcode")
+    assert error.value.status_code == 400
+
+def test_clients_cannot_send_base64_frames():
+    message = backend.FRAME_HEADER.pack(backend.FRAME_KIND_BASE64, 0, 0, 0, 0.0) + b"aGVsbG8="
+    with pytest.raises(ValueError):
+        backend.parse_binary_frame(message)
+
+@pytest.mark.parametrize("payload", ["", "data:image/jpeg;base64,", "bm90IGFuIGltYWdl", "%%%"])
+def test_empty_or_corrupt_base64_is_a_400(payload):
+    with pytest.raises(HTTPException) as error:
+        backend.extract_face_from_base64(payload)
+    assert error.value.status_code == 400
+
+@pytest.mark.parametrize("image_data", [b"", b"\xff\xd8\xff", jpeg_bytes()[:200], b"not an image at all"])
+def test_empty_or_corrupt_upload_is_a_400(image_data):
+    with pytest.raises(HTTPException) as error:
+        backend.extract_face_from_bytes(image_data)
+    assert error.value.status_code == 400
+
+def test_empty_encoded_websocket_frame_is_a_400():
+    frame = {"kind": backend.FRAME_KIND_ENCODED, "payload": memoryview(b""), "width": 0, "height": 0}
+    with pytest.raises(HTTPException) as error:
+        backend.decode_binary_frame(frame)
+    assert error.value.status_code == 400
+
+def test_oversized_image_is_rejected_from_its_header(monkeypatch):
+    monkeypatch.setattr(backend, "MAX_IMAGE_PIXELS", 1000)
+    with pytest.raises(HTTPException) as error:
+        backend.decode_image_bytes(jpeg_bytes(64, 48))
+    assert error.value.status_code == 413
+
+@pytest.mark.parametrize("extension", [".jpg", ".png", ".webp", ".bmp"])
+def test_probe_image_size(extension):
+    image = np.zeros((37, 53), np.uint8)
+    assert image_decode.probe_image_size(cv2.imencode(extension, image)[1].tobytes()) == (53, 37)
+
+def test_reduced_jpeg_decode_reports_its_scale():
+    gray_image, scale = image_decode.decode_grayscale(jpeg_bytes(1280, 960), max_dim=320)
+    assert scale == 4
+    assert gray_image.shape == (240, 320)
+
+class RecordingCascade:
+    def __init__(self):
+        self.calls = []
+
+    def detectMultiScale(self, gray_image, scale_factor, min_neighbors, minSize, maxSize):
+        self.calls.append((gray_image.shape, minSize, maxSize))
+        return ()
+
+def test_face_size_limits_stay_in_original_pixels_after_a_reduced_decode(monkeypatch):
+    cascade = RecordingCascade()
+    monkeypatch.setattr(backend, "thread_face_cascade", lambda: cascade)
+    monkeypatch.setattr(backend, "mood_backend", object())
+    monkeypatch.setattr(backend, "DECODE_MAX_DIM", 320)
+    monkeypatch.setattr(backend, "DETECTION_MAX_DIM", 0)
+    monkeypatch.setattr(backend, "MIN_FACE_SIZE", 200)
+    monkeypatch.setattr(backend, "MAX_FACE_SIZE", 800)
+    image_data = jpeg_bytes(1280, 960)
+
+    backend.extract_face_from_bytes(image_data)
+    backend.extract_all_faces_from_bytes(image_data)
+    backend.extract_face_from_base64(base64.b64encode(image_data).decode(), backend.FaceTracker())
+
+    # Decoded at 1/4 size, so the limits shrink by the same factor
+    assert cascade.calls == [((240, 320), (50, 50), (200, 200))] * 3
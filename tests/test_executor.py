@@ -0,0 +1,39 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from backend import BoundedExecutor
+
+def test_cancelled_caller_keeps_its_slot_until_the_job_finishes():
+    async def scenario():
+        executor = BoundedExecutor("test", 1, 0)
+        release = threading.Event()
+        try:
+            caller = asyncio.create_task(executor.run(release.wait))
+            await asyncio.sleep(0.05)
+            # What a WebSocket disconnect does to its frame processor
+            caller.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await caller
+
+            # The job is still running in the pool, so there is no room for another
+            assert executor.pending == 1
+            with pytest.raises(HTTPException) as error:
+                await executor.run(lambda: None)
+            assert error.value.status_code == 503
+
+            release.set()
+            for _ in range(100):
+                if not executor.pending:
+                    break
+                await asyncio.sleep(0.01)
+            return executor.pending, await executor.run(lambda: "ran")
+        finally:
+            release.set()
+            executor.shutdown()
+
+    pending, result = asyncio.run(scenario())
+    assert pending == 0
+    assert result == "ran"
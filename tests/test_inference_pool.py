@@ -0,0 +1,106 @@
+import asyncio
+import functools
+import os
+import signal
+import sys
+import time
+
+from fastapi import HTTPException
+
+from inference_pool import LOAD_FAILED_EXIT_CODE, ProcessInferencePool
+
+# Stand-ins for inference_pool.worker_main that skip TensorFlow: same queue protocol, no model
+
+def echo_worker(startup_delay: float, shm_name, slot_bytes, task_queue, result_queue, threads):
+    time.sleep(startup_delay)
+    result_queue.put(("ready", os.getpid(), True))
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        time.sleep(0.005)
+        result_queue.put(("result", task[0], "ok", task[2]))
+
+def failing_worker(shm_name, slot_bytes, task_queue, result_queue, threads):
+    result_queue.put(("ready", os.getpid(), False))
+    sys.exit(LOAD_FAILED_EXIT_CODE)
+
+FRAME = {"kind": 0, "payload": b"frame", "width": 0, "height": 0}
+
+async def wait_for(condition, timeout: float = 20.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.05)
+    return True
+
+def test_killed_worker_is_restarted_under_load():
+    async def scenario():
+        pool = ProcessInferencePool(2, 8, 1024, timeout=10.0, worker_target=functools.partial(echo_worker, 1.0))
+        pool.start()
+        try:
+            assert await pool.wait_ready(60)
+            statuses = []
+            stop = asyncio.Event()
+
+            async def client():
+                while not stop.is_set():
+                    try:
+                        assert await pool.run("single", FRAME) == len(FRAME["payload"])
+                        statuses.append(200)
+                    except HTTPException as e:
+                        statuses.append(e.status_code)
+                        await asyncio.sleep(0.01)
+
+            clients = [asyncio.create_task(client()) for _ in range(6)]
+            await asyncio.sleep(0.5)
+            os.kill(pool.workers[0].pid, signal.SIGKILL)
+
+            # Traffic keeps the result queue busy the whole time, so this relies on the clock-based check
+            assert await wait_for(lambda: pool.restarts == 1)
+            saw_not_ready = not pool.ready.is_set()
+            assert await wait_for(pool.ready.is_set)
+
+            statuses.clear()
+            await asyncio.sleep(0.5)
+            stop.set()
+            await asyncio.gather(*clients)
+            assert await wait_for(lambda: not pool.stats()["in_flight"])
+            return saw_not_ready, statuses, pool.stats()
+        finally:
+            pool.shutdown()
+
+    saw_not_ready, statuses, stats = asyncio.run(scenario())
+    assert saw_not_ready
+    assert statuses and set(statuses) == {200}
+    assert stats["alive"] == 2
+    assert stats["ready_workers"] == 2
+    assert stats["restarts"] == 1
+
+def test_worker_that_fails_to_load_is_not_respawned():
+    async def scenario():
+        pool = ProcessInferencePool(2, 4, 1024, worker_target=failing_worker)
+        pool.start()
+        try:
+            started = time.monotonic()
+            ready = await pool.wait_ready(60)
+            waited = time.monotonic() - started
+            # Several liveness checks, each of which would respawn a crashed worker
+            await asyncio.sleep(2.5)
+            with_no_workers = None
+            try:
+                await pool.run("single", FRAME)
+            except HTTPException as e:
+                with_no_workers = e.status_code
+            return ready, waited, with_no_workers, pool.stats()
+        finally:
+            pool.shutdown()
+
+    ready, waited, with_no_workers, stats = asyncio.run(scenario())
+    assert not ready
+    assert waited < 30
+    assert with_no_workers == 503
+    assert stats["restarts"] == 0
+    assert stats["load_failures"] == 2
+    assert stats["alive"] == 0
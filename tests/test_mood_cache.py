@@ -0,0 +1,95 @@
+import itertools
+
+import cv2
+import numpy as np
+import pytest
+
+import backend
+from backend import FaceTracker, PerceptualHashCache
+from benchmark import synthetic_frame
+
+@pytest.fixture
+def caches(monkeypatch):
+    if not hasattr(backend.cv2, "CascadeClassifier"):
+        pytest.skip("this OpenCV build has no CascadeClassifier")
+    assert backend.load_face_cascade()
+    # extract_face only checks that a model is loaded; these tests never predict
+    monkeypatch.setattr(backend, "mood_backend", object())
+    frame_cache = PerceptualHashCache("frame", 16, 16, 8, 60.0)
+    face_cache = PerceptualHashCache("face", 16, backend.FACE_HASH_SIZE, backend.FACE_HASH_MAX_DISTANCE, 60.0)
+    monkeypatch.setattr(backend, "frame_mood_cache", frame_cache)
+    monkeypatch.setattr(backend, "face_mood_cache", face_cache)
+    return frame_cache, face_cache
+
+def face_crop(mouth: str, size: int = 96) -> np.ndarray:
+    """48x48 model input of one cartoon face with the given mouth"""
+    face = np.full((size, size), 90, np.uint8)
+    center, mouth_y = size // 2, size // 2 + size // 5
+    cv2.ellipse(face, (center, center), (int(size * 0.32), int(size * 0.42)), 0, 0, 360, 200, -1)
+    for side in (-1, 1):
+        cv2.ellipse(face, (center + side * size // 8, center - size // 12), (size // 14, size // 28), 0, 0, 360, 40, -1)
+    if mouth == "neutral":
+        cv2.ellipse(face, (center, mouth_y), (size // 8, size // 25), 0, 0, 360, 70, -1)
+    elif mouth == "smile":
+        cv2.ellipse(face, (center, mouth_y - 6), (size // 7, size // 12), 0, 0, 180, 70, 3)
+    elif mouth == "frown":
+        cv2.ellipse(face, (center, mouth_y + 6), (size // 7, size // 12), 0, 180, 360, 70, 3)
+    elif mouth == "open":
+        cv2.ellipse(face, (center, mouth_y), (size // 12, size // 11), 0, 0, 360, 40, -1)
+    face = cv2.GaussianBlur(face, (0, 0), 1.0)
+    return backend.preprocess_face(face, (0, 0, size, size))[..., 0]
+
+def test_scoped_entries_are_invisible_to_other_scopes():
+    cache = PerceptualHashCache("frame", 16, 16, 8, 60.0)
+    probabilities = np.full(7, 1 / 7)
+    cache.store(0b1011, probabilities, "stream-a")
+
+    assert cache.lookup(0b1011, "stream-b") is None
+    assert cache.lookup(0b1011) is None
+    assert cache.lookup(0b1010, "stream-a") is probabilities
+
+def test_different_expressions_miss_the_face_cache():
+    cache = PerceptualHashCache("face", 16, backend.FACE_HASH_SIZE, backend.FACE_HASH_MAX_DISTANCE, 60.0)
+    crops = {mouth: face_crop(mouth) for mouth in ("neutral", "smile", "frown", "open", "none")}
+
+    for stored, looked_up in itertools.permutations(crops, 2):
+        cache.clear()
+        cache.store(cache.key(crops[stored]), np.full(7, 1 / 7), "stream")
+        assert cache.lookup(cache.key(crops[looked_up]), "stream") is None, (stored, looked_up)
+        assert cache.lookup(cache.key(crops[stored]), "stream") is not None
+
+def test_http_requests_do_not_use_the_caches(caches):
+    frame_cache, face_cache = caches
+    image = synthetic_frame(320, 240)
+
+    probabilities, face_input, keys = backend.extract_face_cached(image)
+    assert probabilities is None and face_input is not None
+    backend.store_mood_prediction(keys, np.full(7, 1 / 7))
+    assert frame_cache.stats()["entries"] == face_cache.stats()["entries"] == 0
+
+    # A second request for the same picture runs the model again
+    probabilities, face_input, _ = backend.extract_face_cached(image)
+    assert probabilities is None and face_input is not None
+    assert face_cache.hits == face_cache.misses == 0
+
+def test_streams_only_reuse_their_own_entries(caches):
+    frame_cache, face_cache = caches
+    image = synthetic_frame(320, 240)
+    first, second = FaceTracker(), FaceTracker()
+
+    _, face_input, keys = backend.extract_face_cached(image, first)
+    assert face_input is not None
+    backend.store_mood_prediction(keys, np.full(7, 1 / 7))
+
+    # Another connection sees neither the first stream's frame nor its face
+    probabilities, face_input, _ = backend.extract_face_cached(image, second)
+    assert probabilities is None and face_input is not None
+    assert frame_cache.hits == face_cache.hits == 0
+    assert second.full_detections == 1
+
+    # The first stream does, and its tracker still counts the frame
+    probabilities, face_input, _ = backend.extract_face_cached(image, first)
+    assert probabilities is not None and face_input is None
+    assert frame_cache.hits == 1
+    assert first.frames == 2
+    assert first.frames_since_detection == 2
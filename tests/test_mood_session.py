@@ -0,0 +1,42 @@
+import asyncio
+
+import numpy as np
+
+import backend
+from backend import MOOD_LABELS, MoodSession
+
+def mood_probabilities(mood: str, share: float = 0.8) -> np.ndarray:
+    probabilities = np.full(len(MOOD_LABELS), (1.0 - share) / (len(MOOD_LABELS) - 1))
+    probabilities[list(MOOD_LABELS.values()).index(mood)] = share
+    return probabilities
+
+def run_frames(monkeypatch, session: MoodSession, moods: list) -> list:
+    results = iter([mood_probabilities(mood) if mood else None for mood in moods])
+
+    async def detect(extract_func, *args):
+        return next(results)
+
+    monkeypatch.setattr(backend, "detect_mood_probabilities_async", detect)
+    frame = {"image": b"", "binary": True, "timestamp": 0.0, "include_playlist": False,
+             "multi_face": False, "create_playlist": False}
+
+    async def scenario():
+        return [await backend.process_video_frame(frame, None, session) for _ in moods]
+
+    return asyncio.run(scenario())
+
+def test_first_frames_report_the_frame_mood(monkeypatch):
+    session = MoodSession(alpha=0.5, margin=0.1, min_frames=3)
+    responses = run_frames(monkeypatch, session, ["Happy", "Happy", "Happy"])
+
+    assert [response["mood"] for response in responses] == ["Happy"] * 3
+    assert responses[0]["confidence"] > 0.0
+    # Only the third frame settles the session on a mood
+    assert [response["mood_changed"] for response in responses] == [False, False, True]
+
+def test_settled_mood_ignores_single_frame_flicker(monkeypatch):
+    session = MoodSession(alpha=0.5, margin=0.1, min_frames=3)
+    responses = run_frames(monkeypatch, session, ["Happy", "Happy", "Happy", "Sad", "Happy"])
+
+    assert [response["mood"] for response in responses] == ["Happy"] * 5
+    assert responses[3]["frame_mood"] == "Sad"
@@ -0,0 +1,41 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import httpx
+import pytest
+
+import spotify_api
+from spotify_api import AsyncSpotifyClient, retry_after_seconds
+
+def test_retry_after_seconds():
+    in_a_minute = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=60), usegmt=True)
+    assert retry_after_seconds("2") == 2.0
+    assert retry_after_seconds("0.5") == 0.5
+    assert 55 <= retry_after_seconds(in_a_minute) <= 60
+    assert retry_after_seconds("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    for malformed in (None, "", "soon", "nan", "inf"):
+        assert retry_after_seconds(malformed) is None
+
+@pytest.mark.parametrize("retry_after", ["soon", "Wed, 21 Oct 2015 07:28:00 GMT"])
+def test_rate_limit_with_an_unusual_retry_after_is_retried(monkeypatch, retry_after):
+    delays = []
+
+    async def sleep(seconds):
+        delays.append(seconds)
+
+    monkeypatch.setattr(spotify_api.asyncio, "sleep", sleep)
+    responses = iter([httpx.Response(429, headers={"Retry-After": retry_after}), httpx.Response(200, json={"id": "me"})])
+
+    async def scenario():
+        client = AsyncSpotifyClient("id", "secret")
+        client._http = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: next(responses)))
+        try:
+            return await client.current_user("user-token"), client.stats()
+        finally:
+            await client.aclose()
+
+    user, stats = asyncio.run(scenario())
+    assert user == {"id": "me"}
+    assert stats["rate_limited"] == 1
+    assert delays == [0.0 if "GMT" in retry_after else spotify_api.backoff_delay(0)]
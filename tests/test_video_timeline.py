@@ -0,0 +1,98 @@
+import asyncio
+import csv
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+import backend
+from backend import BoundedExecutor
+from video_timeline import process_video_file
+
+def write_video(path: str, frames: int = 6) -> bool:
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 10.0, (64, 48))
+    if not writer.isOpened():
+        return False
+    for index in range(frames):
+        writer.write(np.full((48, 64, 3), index * 20, np.uint8))
+    writer.release()
+    return True
+
+def test_run_when_free_waits_for_room_instead_of_rejecting():
+    async def scenario():
+        executor = BoundedExecutor("test", 1, 0)
+        release = threading.Event()
+        try:
+            first = asyncio.create_task(executor.run(release.wait))
+            await asyncio.sleep(0.05)
+            assert executor.full
+            queued = asyncio.create_task(executor.run_when_free(lambda: "queued"))
+            await asyncio.sleep(0.05)
+            waiting = executor.stats()["waiting"]
+            release.set()
+            return waiting, await first, await queued, executor.rejected
+        finally:
+            release.set()
+            executor.shutdown()
+
+    waiting, first, queued, rejected = asyncio.run(scenario())
+    assert waiting == 1
+    assert first is True
+    assert queued == "queued"
+    assert rejected == 0
+
+def test_timeline_runs_detection_and_inference_through_run_blocking(tmp_path, monkeypatch):
+    video = str(tmp_path / "clip.avi")
+    if not write_video(video):
+        pytest.skip("this OpenCV build cannot write MJPG video")
+
+    face_batch = np.zeros((1, 48, 48, 1), np.float32)
+
+    def extract_all_faces(gray_image):
+        return [[0, 0, 8, 8]], face_batch
+
+    def predict_mood_batch(faces):
+        return np.tile(np.eye(7)[3], (len(faces), 1))
+
+    monkeypatch.setattr(backend, "mood_backend", object())
+    monkeypatch.setattr(backend, "face_cascade", object())
+    monkeypatch.setattr(backend, "extract_all_faces", extract_all_faces)
+    monkeypatch.setattr(backend, "predict_mood_batch", predict_mood_batch)
+
+    calls = []
+
+    def run_blocking(func, *args):
+        calls.append(func)
+        return func(*args)
+
+    output = str(tmp_path / "clip.csv")
+    summary = process_video_file(video, output, workers=1, batch_size=4, run_blocking=run_blocking)
+
+    assert summary["frames_analyzed"] == 6
+    assert summary["mood_frames"]["Happy"] == 6
+    # Every frame's detection and every model call went through the caller's executor
+    assert calls.count(extract_all_faces) == 6
+    assert predict_mood_batch in calls
+    with open(output) as timeline:
+        assert len(list(csv.DictReader(timeline))) == 6
+
+def test_pruned_jobs_delete_their_files(tmp_path):
+    async def scenario():
+        registry = backend.JobRegistry(retention=0.0)
+        output = tmp_path / "timeline.csv"
+
+        async def run(job):
+            job.files.append(str(output))
+            output.write_text("frame,timestamp\n")
+            return {"output": str(output)}
+
+        job = registry.start("video", run)
+        await job.task
+        assert output.exists()
+        await asyncio.sleep(0.01)
+        return registry.get(job.id), output.exists()
+
+    job, exists = asyncio.run(scenario())
+    assert job is None
+    assert not exists
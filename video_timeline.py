@@ -0,0 +1,346 @@
+"""
+Kaguya Music Mood API - Offline video mood timelines
+
+Usage:
+    python video_timeline.py session.mp4 [-o timeline.csv] [--stride 5] [--workers 2] [--batch-size 16] [--all-faces]
+
+Decodes a recorded video with cv2.VideoCapture and runs the same face and mood
+pipeline as the API on every stride-th frame. A reader thread feeds worker
+threads through a bounded queue and rows are written as soon as they are in
+order, so memory stays flat however long the video is. Writes CSV, or Parquet
+when the output ends in .parquet (needs pyarrow).
+"""
+
+import argparse
+import csv
+import importlib.util
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TIMELINE_FORMATS = ("csv", "parquet")
+
+# ==============================
+# Timeline writers
+# ==============================
+
+def timeline_columns(mood_labels: List[str]) -> List[str]:
+    return [
+        "frame", "time_seconds", "face_count", "face", "x", "y", "w", "h", "mood", "confidence",
+        *[f"p_{label.lower()}" for label in mood_labels]
+    ]
+
+class CsvTimelineWriter:
+    def __init__(self, path: str, columns: List[str]):
+        self.columns = columns
+        self._file = open(path, "w", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(columns)
+
+    def write(self, rows: List[Dict[str, Any]]):
+        self._writer.writerows([row.get(column) for column in self.columns] for row in rows)
+
+    def close(self):
+        self._file.close()
+
+class ParquetTimelineWriter:
+    """Buffers rows into row groups so only one group is held in memory at a time"""
+
+    def __init__(self, path: str, columns: List[str], row_group_size: int = 5000):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Parquet output needs pyarrow - pip install pyarrow, or write CSV")
+
+        self._pa = pa
+        self.columns = columns
+        self.row_group_size = row_group_size
+        self._rows: List[Dict[str, Any]] = []
+        types = {"frame": pa.int64(), "face_count": pa.int32(), "face": pa.int32(), "mood": pa.string()}
+        for column in ("x", "y", "w", "h"):
+            types[column] = pa.int32()
+        self._schema = pa.schema([(column, types.get(column, pa.float64())) for column in columns])
+        self._writer = pq.ParquetWriter(path, self._schema)
+
+    def write(self, rows: List[Dict[str, Any]]):
+        self._rows.extend(rows)
+        if len(self._rows) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if self._rows:
+            self._writer.write_table(self._pa.Table.from_pylist(self._rows, schema=self._schema))
+            self._rows = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+def parquet_available() -> bool:
+    return importlib.util.find_spec("pyarrow") is not None
+
+def open_timeline_writer(path: str, columns: List[str], output_format: Optional[str] = None):
+    """CSV or Parquet writer, picked by output_format or else by the file extension"""
+    if output_format is None:
+        output_format = "parquet" if path.lower().endswith((".parquet", ".pq")) else "csv"
+    if output_format not in TIMELINE_FORMATS:
+        raise ValueError(f"Unknown timeline format: {output_format} (use one of {', '.join(TIMELINE_FORMATS)})")
+    if output_format == "parquet":
+        return ParquetTimelineWriter(path, columns)
+    return CsvTimelineWriter(path, columns)
+
+# ==============================
+# Pipeline
+# ==============================
+
+def frame_rows(index: int, timestamp: float, boxes: list, probabilities: Optional[np.ndarray],
+               mood_labels: List[str]) -> List[Dict[str, Any]]:
+    """One row per face, or a single row without a face so the timeline has no gaps"""
+    if probabilities is None:
+        return [{"frame": index, "time_seconds": timestamp, "face_count": 0}]
+
+    rows = []
+    for face, (box, face_probabilities) in enumerate(zip(boxes, probabilities)):
+        mood_index = int(np.argmax(face_probabilities))
+        row = {
+            "frame": index,
+            "time_seconds": timestamp,
+            "face_count": len(boxes),
+            "face": face,
+            "x": box[0], "y": box[1], "w": box[2], "h": box[3],
+            "mood": mood_labels[mood_index],
+            "confidence": float(face_probabilities[mood_index])
+        }
+        for label, value in zip(mood_labels, face_probabilities):
+            row[f"p_{label.lower()}"] = float(value)
+        rows.append(row)
+    return rows
+
+def process_video_file(path: str, output: str, stride: int = 1, workers: int = 2, batch_size: int = 16,
+                       max_in_flight: int = 64, all_faces: bool = False,
+                       output_format: Optional[str] = None,
+                       progress: Optional[Dict[str, Any]] = None,
+                       cancelled: Optional[threading.Event] = None,
+                       run_blocking: Optional[Callable] = None) -> Dict[str, Any]:
+    """
+    Write a mood timeline for a video file. The mood model and face cascade must already be
+    loaded in backend (the API loads them at startup, the CLI below loads them itself).
+    At most max_in_flight sampled frames are decoded and not yet written at any time.
+    progress: dict updated in place with frames read and rows written
+    cancelled: set it to stop early; the rows written so far are kept
+    run_blocking: run_blocking(func, *args) runs face detection and model calls for the worker
+    threads (default: call directly); the API passes its inference executor here
+    Returns: summary with frame counts, throughput and frames per mood
+    """
+    import backend
+
+    if backend.mood_backend is None or backend.face_cascade is None:
+        raise RuntimeError("Mood model and face cascade are not loaded")
+
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError(f"Cannot open video: {path}")
+
+    stride = max(1, stride)
+    workers = max(1, workers)
+    mood_labels = list(backend.MOOD_LABELS.values())
+    video_fps = capture.get(cv2.CAP_PROP_FPS) or 0.0
+    total_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    progress = progress if progress is not None else {}
+    progress.update({"total_frames": total_frames, "frames_read": 0, "frames_sampled": 0, "rows_written": 0})
+    cancelled = cancelled or threading.Event()
+    run_blocking = run_blocking or (lambda func, *args: func(*args))
+
+    # Every sampled frame holds a slot from decode until its rows are written - the memory bound
+    slots = threading.Semaphore(max_in_flight)
+    frames: queue.Queue = queue.Queue()
+    results: queue.Queue = queue.Queue()
+    errors: List[BaseException] = []
+
+    def read_frames():
+        sequence = index = 0
+        try:
+            while not cancelled.is_set() and not errors:
+                # grab() advances without converting or copying the frame; only sampled frames are retrieved
+                if not capture.grab():
+                    break
+                if index % stride == 0:
+                    ok, image = capture.retrieve()
+                    if ok:
+                        timestamp = index / video_fps if video_fps else capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+                        gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+                        del image
+                        while not slots.acquire(timeout=0.5):
+                            if cancelled.is_set() or errors:
+                                return
+                        frames.put((sequence, index, timestamp, gray_image))
+                        sequence += 1
+                        progress["frames_sampled"] = sequence
+                index += 1
+                progress["frames_read"] = index
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            capture.release()
+            for _ in range(workers):
+                frames.put(None)
+
+    def analyze_frames():
+        try:
+            finished = False
+            while not finished:
+                batch = [frames.get()]
+                if batch[0] is None:
+                    break
+                # Take whatever else is already decoded, up to one model batch
+                while len(batch) < batch_size:
+                    try:
+                        item = frames.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        finished = True
+                        break
+                    batch.append(item)
+
+                extracted = []
+                for sequence, index, timestamp, gray_image in batch:
+                    boxes, face_batch = run_blocking(backend.extract_all_faces, gray_image)
+                    if face_batch is not None and not all_faces:
+                        boxes, face_batch = boxes[:1], face_batch[:1]
+                    extracted.append((sequence, index, timestamp, boxes, face_batch))
+
+                # One model call for every face in the batch of frames
+                face_batches = [face_batch for *_, face_batch in extracted if face_batch is not None]
+                probabilities = run_blocking(backend.predict_mood_batch, np.concatenate(face_batches)) if face_batches else None
+                offset = 0
+                for sequence, index, timestamp, boxes, face_batch in extracted:
+                    face_probabilities = None
+                    if face_batch is not None:
+                        face_probabilities = probabilities[offset:offset + len(face_batch)]
+                        offset += len(face_batch)
+                    results.put((sequence, frame_rows(index, timestamp, boxes, face_probabilities, mood_labels)))
+        except BaseException as e:
+            errors.append(e)
+            cancelled.set()
+        finally:
+            results.put(None)
+
+    started = time.perf_counter()
+    try:
+        writer = open_timeline_writer(output, timeline_columns(mood_labels), output_format)
+    except Exception:
+        capture.release()
+        raise
+    threads = [threading.Thread(target=read_frames, name="kaguya-video-reader", daemon=True)]
+    threads += [threading.Thread(target=analyze_frames, name=f"kaguya-video-worker-{n}", daemon=True) for n in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    # Write rows in frame order; results that arrive early wait in `pending`
+    pending: Dict[int, List[Dict[str, Any]]] = {}
+    next_sequence = 0
+    mood_frames = {label: 0 for label in mood_labels}
+    no_face_frames = 0
+    running_workers = workers
+    try:
+        while running_workers:
+            item = results.get()
+            if item is None:
+                running_workers -= 1
+                continue
+            sequence, rows = item
+            pending[sequence] = rows
+            while next_sequence in pending:
+                rows = pending.pop(next_sequence)
+                writer.write(rows)
+                if rows[0].get("mood"):
+                    mood_frames[rows[0]["mood"]] += 1
+                else:
+                    no_face_frames += 1
+                progress["rows_written"] += len(rows)
+                next_sequence += 1
+                slots.release()
+    finally:
+        if errors:
+            cancelled.set()
+        writer.close()
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+
+    seconds = time.perf_counter() - started
+    return {
+        "output": output,
+        "video_fps": video_fps,
+        "total_frames": total_frames,
+        "frames_read": progress["frames_read"],
+        "frames_analyzed": next_sequence,
+        "rows": progress["rows_written"],
+        "stride": stride,
+        "cancelled": cancelled.is_set(),
+        "seconds": round(seconds, 3),
+        "frames_per_second": round(next_sequence / seconds, 1) if seconds else 0.0,
+        # Mood of the largest face per analyzed frame
+        "mood_frames": mood_frames,
+        "no_face_frames": no_face_frames
+    }
+
+# ==============================
+# CLI
+# ==============================
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a mood timeline for a recorded video")
+    parser.add_argument("video", help="Video file readable by OpenCV")
+    parser.add_argument("-o", "--output", help="Timeline file (default: <video>.mood.csv)")
+    parser.add_argument("--format", choices=TIMELINE_FORMATS, help="Default: from the output extension")
+    parser.add_argument("--stride", type=int, default=1, help="Analyze every Nth frame")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Face detection and inference threads")
+    parser.add_argument("--batch-size", type=int, default=16, help="Frames per model call")
+    parser.add_argument("--max-in-flight", type=int, default=64, help="Decoded frames held in memory at most")
+    parser.add_argument("--all-faces", action="store_true", help="One row per face instead of only the largest face")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.video):
+        parser.error(f"Video file not found: {args.video}")
+    output = args.output or os.path.splitext(args.video)[0] + (".mood.parquet" if args.format == "parquet" else ".mood.csv")
+
+    import backend
+
+    if not (backend.load_face_cascade() and backend.load_mood_model()):
+        sys.exit(1)
+
+    summary = process_video_file(
+        args.video, output,
+        stride=args.stride,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        max_in_flight=args.max_in_flight,
+        all_faces=args.all_faces,
+        output_format=args.format
+    )
+    print(
+        f"Wrote {summary['rows']} rows for {summary['frames_analyzed']} of {summary['frames_read']} frames "
+        f"to {output} in {summary['seconds']:.1f}s ({summary['frames_per_second']} frames/s)"
+    )
+    for mood, count in sorted(summary["mood_frames"].items(), key=lambda item: -item[1]):
+        if count:
+            print(f"  {mood:<10} {count}")
+    if summary["no_face_frames"]:
+        print(f"  {'no face':<10} {summary['no_face_frames']}")
+
+if __name__ == "__main__":
+    main()